@@ -19,8 +19,20 @@ __license__ = 'GPLV3'
 __version__ = "4.2"
 
 from .mdfreader import Mdf, MdfInfo
+from .mdf4writer import Mdf4Writer
+from .mdfsort import sort_mdf
+from .mdf4tools import recompress, extract, cut
+from .mdf3to4 import convert3to4
+from .mdf4resample import StreamingResampler
 
 __all__ = [
     'Mdf',
-    'MdfInfo'
+    'MdfInfo',
+    'Mdf4Writer',
+    'sort_mdf',
+    'recompress',
+    'extract',
+    'cut',
+    'convert3to4',
+    'StreamingResampler'
             ]
@@ -10,6 +10,7 @@ Dependencies
 -------------------
 - Python >3.4 <http://www.python.org>
 - Numpy >1.6 <http://numpy.scipy.org>
+- xxhash (optional) <https://github.com/ifduyue/python-xxhash> for faster data deduplication
 
 
 mdf
@@ -23,7 +24,15 @@ from string import ascii_letters
 from collections import OrderedDict, defaultdict
 from time import time
 from warnings import warn
-from numpy import array_repr, set_printoptions, recarray, fromstring
+from weakref import WeakValueDictionary
+from numpy import array, array_equal, ascontiguousarray, array_repr, set_printoptions, recarray, frombuffer, ndarray, where
+from numpy import asarray, empty, issubdtype, integer, iinfo, rint, float64
+from numpy import searchsorted, clip, minimum, isnan, errstate, vstack
+from numpy import arange, ceil, floor, flatnonzero, abs as npabs, concatenate, repeat, diff, append, int64
+from numpy import packbits, unpackbits, uint8, zeros, bitwise_and, bitwise_or, bitwise_xor, invert, \
+    logical_and, logical_or, logical_xor, logical_not
+from numpy import dtype as numpy_dtype, full, bool_, result_type
+from numpy.lib.mixins import NDArrayOperatorsMixin
 try:
     from pandas import set_option
 except ImportError:
@@ -32,10 +41,17 @@ set_printoptions(threshold=100, edgeitems=1)
 _notAllowedChannelNames = set(dir(recarray))
 try:
     CompressionPossible = True
-    from blosc import compress, decompress
+    from blosc import compress, decompress, SHUFFLE
 except ImportError:
     # Cannot compress data, please install bcolz and blosc
     CompressionPossible = False
+try:
+    from xxhash import xxh3_64 as data_hash  # fast hash for data deduplication
+except ImportError:
+    from hashlib import blake2b
+
+    def data_hash():
+        return blake2b(digest_size=8)
 
 descriptionField = 'description'
 unitField = 'unit'
@@ -47,13 +63,18 @@ attachmentField = 'attachment'
 idField = 'id'
 invalidPosField = 'invalid_bit'
 invalidChannel = 'invalid_channel'
+chunk_size_conversion = 1048576  # number of samples converted at once, bounds temporary arrays
+compression_chunk_size = 1048576  # size in bytes of chunks compressed independently in memory
+chunk_size_records = 4194304  # size in bytes of records buffer interleaved at once when writing
+run_length_ratio = 0.01  # maximum number of runs per sample for run length encoded storage
+_bit_count_table = array([bin(value).count('1') for value in range(256)], dtype='u1')  # set bits per byte
 
 
 class MdfSkeleton(dict):
     __slots__ = ['masterChannelList', 'fileName', 'MDFVersionNumber', 'multiProc',
                  'convertAfterRead', 'filterChannelNames', 'fileMetadata', 'convertTables',
-                 '_pandasframe', 'info', '_compression_level', '_noDataLoading',
-                 'fid', 'zipfile']
+                 '_pandasframe', 'info', '_compression_level', '_compression_codec',
+                 '_compression_cache', '_noDataLoading', '_readWindow', '_sharedData', 'fid', 'zipfile']
     """ MdfSkeleton class
 
     Attributes
@@ -87,11 +108,15 @@ class MdfSkeleton(dict):
         copy a mdf class
     add_metadata(author, organisation, project, subject, comment, date, time)
         adds basic metadata from file
+    deduplicate_channels()
+        shares data buffer of channels having identical data
+    memory_stats()
+        returns memory used by channels data and saved by sharing
     """
 
     def __init__(self, file_name=None, channel_list=None, convert_after_read=True,
                  filter_channel_names=False, no_data_loading=False,
-                 compression=False, convert_tables=False, metadata=2):
+                 compression=False, convert_tables=False, metadata=2, deduplicate=False, compression_cache=0):
         """ mdf_skeleton class constructor.
 
         Parameters
@@ -120,9 +145,17 @@ class MdfSkeleton(dict):
         compression : bool optional
             flag to compress data in memory.
 
+        compression_cache : int, optional, default 0
+            number of decompressed chunks kept in cache per compressed channel,
+            speeds up repeated slicing of same data. 0 deactivates cache
+
         convert_tables : bool, optional, default False
             flag to convert or not only conversions with tables.
             These conversions types take generally long time and memory.
+
+        deduplicate : bool, optional, default False
+            flag to share one read only data buffer between channels added with identical data,
+            typically same time base recorded in several data groups.
         """
         self.masterChannelList = OrderedDict()
         # flag to control multiprocessing, default deactivate,
@@ -142,7 +175,12 @@ class MdfSkeleton(dict):
         self._pandasframe = False
         self.info = None
         self._compression_level = 9  # default compression level
+        self._compression_codec = 'blosclz'  # default blosc compressor
+        self._compression_cache = compression_cache  # number of decompressed chunks kept in cache per channel
         self._noDataLoading = False  # in case reading with this argument activated
+        self._readWindow = None  # master channel window applied by next read, set by cut
+        # data of added channels by content hash, shared by channels having identical data
+        self._sharedData = WeakValueDictionary() if deduplicate else None
         # clears class from previous reading and avoid to mess up
         self.clear()
         self.fileName = file_name
@@ -184,7 +222,7 @@ class MdfSkeleton(dict):
             (channel name, channel source, channel path),
             (group name, group source, group path)
         """
-        if not self._noDataLoading:
+        if not self._noDataLoading or channel_name not in self:  # new channel, not loaded on demand
             self[channel_name] = {}
             if master_channel not in self.masterChannelList:
                 self.masterChannelList[master_channel] = []
@@ -196,6 +234,8 @@ class MdfSkeleton(dict):
                 self.set_channel_master_type(channel_name, 1)
             else:  # mdf4
                 self.set_channel_master_type(channel_name, master_type)
+        if not compression:
+            data = self._deduplicate(data)
         self.set_channel_data(channel_name, data, compression)
         if conversion is not None:
             self[channel_name]['conversion'] = {}
@@ -205,6 +245,8 @@ class MdfSkeleton(dict):
                 if 'conversion' in conversion:
                     self[channel_name]['conversion']['parameters'] = \
                         conversion['conversion']
+                if 'table' in conversion:  # table precompiled by Info3
+                    self[channel_name]['conversion']['table'] = conversion['table']
                 if conversion['cc_type'] == 0 and \
                         'P2' in self[channel_name]['conversion']['parameters'] and \
                         (self[channel_name]['conversion']['parameters']['P2'] == 1.0 and
@@ -234,6 +276,80 @@ class MdfSkeleton(dict):
         if identifier is not None:
             self[channel_name]['id'] = identifier
 
+    def _deduplicate(self, data):
+        """ returns data already added with identical content if any, otherwise registers data
+
+        Parameters
+        ----------------
+        data : numpy array
+            channel data
+
+        Returns
+        -----------
+        numpy array
+            shared data is made read only, modifying channel data means replacing it (copy on write).
+            Data not shared is made contiguous
+        """
+        if self._sharedData is None or type(data) is not ndarray or not data.ndim or not data.size \
+                or data.dtype.hasobject:
+            return data
+        key = (_data_digest(data), data.shape, data.dtype)
+        shared = self._sharedData.get(key)
+        if shared is not None and array_equal(shared, data, equal_nan=data.dtype.kind in ('f', 'c')):
+            shared.flags.writeable = False
+            return shared
+        if not data.flags.c_contiguous:
+            # view of records, copied so that records buffer is freed and sharing saves memory
+            data = ascontiguousarray(data)
+        self._sharedData[key] = data
+        return data
+
+    def deduplicate_channels(self):
+        """ shares one read only data buffer between channels having identical data
+
+        Returns
+        -----------
+        int
+            number of bytes saved by sharing
+        """
+        if self._sharedData is None:
+            self._sharedData = WeakValueDictionary()
+        for channel in self:
+            data = self[channel].get(dataField)
+            shared = self._deduplicate(data)
+            if shared is not data:
+                self._set_channel(channel, shared, field=dataField)
+        return self.memory_stats()['shared_bytes']
+
+    def memory_stats(self):
+        """ memory used by channels data
+
+        Returns
+        -----------
+        dict
+            channels: number of channels
+            data_bytes: bytes used by channels data, buffer shared by several channels counted once
+            shared_bytes: bytes saved by channels sharing same buffer
+        """
+        stats = {'channels': len(self), 'data_bytes': 0, 'shared_bytes': 0}
+        buffers = set()
+        for channel in self:
+            data = self[channel].get(dataField)
+            if isinstance(data, CompressedData):
+                nbytes = sum(len(chunk) for chunk in data.data or ())
+            else:
+                nbytes = getattr(data, 'nbytes', 0)
+            if isinstance(data, ndarray):  # views of same memory are same buffer
+                buffer = (data.__array_interface__['data'][0], data.shape, data.strides, data.dtype)
+            else:
+                buffer = id(data)
+            if buffer in buffers:
+                stats['shared_bytes'] += nbytes
+            else:
+                buffers.add(buffer)
+                stats['data_bytes'] += nbytes
+        return stats
+
     def remove_channel(self, channel_name):
         """ removes channel from mdf dict.
 
@@ -450,11 +566,17 @@ class MdfSkeleton(dict):
         data : numpy array
             channel data
         compression : bool or str
-            trigger for data compression
+            trigger for data compression, if str, name of blosc compressor
+            ('blosclz', 'lz4', 'lz4hc', 'zlib' or 'zstd'), if int, compression level
         """
-        if compression and CompressionPossible:
-            temp = CompressedData()
-            temp.compression(data)
+        if compression and CompressionPossible and not isinstance(data, (RangeData, RunData, BitData)):  # compact
+            temp = CompressedData(self._compression_cache)
+            if isinstance(compression, str):
+                temp.compression(data, self._compression_level, compression)
+            elif compression is not True and isinstance(compression, int):  # compression level
+                temp.compression(data, compression, self._compression_codec)
+            else:
+                temp.compression(data, self._compression_level, self._compression_codec)
             self._set_channel(channel_name, temp, field=dataField)
         else:
             self._set_channel(channel_name, data, field=dataField)
@@ -665,6 +787,24 @@ class MdfSkeleton(dict):
         return yop
 
 
+def _data_digest(data):
+    """ fast hash of array content, computed by chunks
+
+    Parameters
+    -----------
+    data : numpy array
+        array, contiguous or not
+
+    Returns
+    --------
+    bytes
+    """
+    hasher = data_hash()
+    for index in range(0, len(data), chunk_size_conversion):
+        hasher.update(ascontiguousarray(data[index:index + chunk_size_conversion]).view('u1'))
+    return hasher.digest()
+
+
 def _open_mdf(file_name):
     """ Opens mdf, make a few checks and returns fid
 
@@ -752,6 +892,138 @@ def _bits_to_bytes_not_aligned(n_bits):
     return n_bytes
 
 
+def _chunked_conversion(vector, conversion_function, dtype=None):
+    """ applies element wise conversion by chunks into a preallocated output array
+
+    Parameters
+    -------------
+    vector : numpy array
+        raw data
+    conversion_function : function
+        element wise conversion taking and returning numpy array
+    dtype : numpy dtype or str, optional
+        output precision policy: None keeps dtype resulting from conversion (mostly float64),
+        'float32', 'float64' or any numpy dtype forces output dtype,
+        'keep' keeps raw integer dtype as long as converted values are integers fitting in it
+
+    Returns
+    ----------
+    converted numpy array
+    """
+    if dtype == 'keep' and not issubdtype(vector.dtype, integer):
+        dtype = None
+    out = None
+    for start in range(0, max(len(vector), 1), chunk_size_conversion):
+        piece = vector[start:start + chunk_size_conversion]
+        chunk = conversion_function(piece)
+        if chunk is None:  # conversion failed
+            return None
+        if chunk is piece:  # identity conversion
+            if dtype is None or dtype == 'keep':
+                return vector
+            return vector.astype(dtype)
+        chunk = asarray(chunk)
+        if out is None:
+            if dtype == 'keep':
+                out = empty(vector.shape, dtype=vector.dtype)
+            else:
+                out = empty(vector.shape, dtype=chunk.dtype if dtype is None else dtype)
+        if dtype == 'keep' and issubdtype(out.dtype, integer) and not _integer_fit(chunk, out.dtype):
+            # converted values can not be kept as integer
+            out = out.astype(float64)
+        out[start:start + len(chunk)] = chunk
+    return out
+
+
+def _integer_fit(vector, dtype):
+    """ checks if values can be stored in integer dtype without loss
+
+    Parameters
+    -------------
+    vector : numpy array
+        values to check
+    dtype : numpy dtype
+        integer dtype
+
+    Returns
+    ----------
+    bool
+    """
+    if len(vector) == 0:
+        return True
+    limits = iinfo(dtype)
+    if not issubdtype(vector.dtype, integer) and not (rint(vector) == vector).all():
+        return False
+    return limits.min <= vector.min() and vector.max() <= limits.max
+
+
+def _record_dtype(columns):
+    """ builds packed record dtype from channel columns
+
+    Parameters
+    -------------
+    columns : list of numpy arrays
+        channel data, first dimension being number of records, next ones giving array channels shape
+
+    Returns
+    ----------
+    numpy structured dtype
+    """
+    return numpy_dtype({'names': ['f{}'.format(n) for n in range(len(columns))],
+                        'formats': [(column.dtype, column.shape[1:]) if column.ndim > 1 else column.dtype
+                                    for column in columns]})
+
+
+def _record_chunks(n_records, record_length, chunk_size=chunk_size_records):
+    """ splits number of records in chunks of bounded size
+
+    Parameters
+    -------------
+    n_records : int
+        number of records
+    record_length : int
+        record length in bytes
+    chunk_size : int, optional
+        maximum chunk size in bytes
+
+    Returns
+    ----------
+    list of number of records per chunk
+    """
+    n_record_chunk = max(chunk_size // max(record_length, 1), 1)
+    return [min(n_record_chunk, n_records - start) for start in range(0, n_records, n_record_chunk)]
+
+
+def _interleave_records(columns, chunks, record_dtype=None):
+    """ interleaves channel columns into records, chunk by chunk into a reusable buffer
+
+    Parameters
+    -------------
+    columns : list of numpy arrays
+        channel data, first dimension being number of records
+    chunks : list of int
+        number of records of each chunk
+    record_dtype : numpy dtype, optional
+        record structured dtype, by default built from columns
+
+    Returns
+    ----------
+    generator of memoryview of interleaved records bytes, one per chunk
+    buffer is overwritten by next chunk, copy it if needed after next iteration
+    """
+    if record_dtype is None:
+        record_dtype = _record_dtype(columns)
+    raw = empty(max(chunks, default=0) * record_dtype.itemsize, dtype='u1')
+    records = raw.view(record_dtype)
+    start = 0
+    for n_records in chunks:
+        view = records[:n_records]
+        for name, column in zip(record_dtype.names, columns):
+            view[name] = column[start:start + n_records]
+        start += n_records
+        yield memoryview(raw[:n_records * record_dtype.itemsize])
+
+
 def _convert_name(channel_name):
     """ Check if channelName is valid python identifier
     to be removed with next function if no more need
@@ -795,32 +1067,82 @@ def _sanitize_identifier(name):
 
 
 class CompressedData:
-    __slots__ = ['data', 'dtype']
-    """ class to represent compressed data by blosc
+    __slots__ = ['data', 'dtype', 'shape', 'chunk_length', 'cache', 'cache_size']
+    """ class to represent data compressed by blosc in chunks
+
+    Data is split in chunks of around 1MB along first dimension, each chunk compressed independently.
+    Slicing only decompresses touched chunks and a small cache of decompressed chunks can be kept.
     """
-    def __init__(self):
+    def __init__(self, cache_size=0):
         """ data compression method
 
         Attributes
         -------------
-        data : numpy array compressed
-            compressed data
+        data : list of bytes
+            compressed chunks
         dtype : numpy dtype object
             numpy array dtype
+        shape : tuple
+            numpy array shape
+        chunk_length : int
+            number of samples per chunk
+        cache : OrderedDict
+            decompressed chunks, most recently used last
+        cache_size : int
+            maximum number of decompressed chunks kept in cache, 0 deactivates cache
         """
         self.data = None
         self.dtype = None
+        self.shape = None
+        self.chunk_length = 1
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
 
-    def compression(self, a):
+    def compression(self, a, level=9, codec='blosclz', chunk_size=compression_chunk_size):
         """ data compression method
 
         Parameters
         -------------
         a : numpy array
             data to be compresses
+        level : int, optional
+            compression level from 0 to 9
+        codec : str, optional
+            blosc compressor name: 'blosclz', 'lz4', 'lz4hc', 'zlib' or 'zstd'
+        chunk_size : int, optional
+            approximate size in bytes of uncompressed chunks
         """
-        self.data = compress(a.tobytes())
         self.dtype = a.dtype
+        self.shape = a.shape
+        sample_size = max(a.itemsize * (a.size // max(len(a), 1)), 1)
+        self.chunk_length = max(chunk_size // sample_size, 1)
+        typesize = a.itemsize if 0 < a.itemsize <= 255 else 1  # typesize allows byte shuffle
+        self.data = [compress(a[start:start + self.chunk_length].tobytes(), typesize=typesize,
+                              clevel=level, shuffle=SHUFFLE, cname=codec)
+                     for start in range(0, len(a), self.chunk_length)]
+        self.cache.clear()
+
+    def _chunk(self, index):
+        """ decompresses one chunk
+
+        Parameters
+        -------------
+        index : int
+            chunk index
+
+        Returns
+        -------------
+        read only numpy array of chunk
+        """
+        if index in self.cache:
+            self.cache.move_to_end(index)
+            return self.cache[index]
+        chunk = frombuffer(decompress(self.data[index]), dtype=self.dtype).reshape((-1,) + self.shape[1:])
+        if self.cache_size > 0:
+            self.cache[index] = chunk
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return chunk
 
     def decompression(self):
         """ data decompression
@@ -829,9 +1151,985 @@ class CompressedData:
         -------------
         uncompressed numpy array
         """
-        return fromstring(decompress(self.data), dtype=self.dtype)
+        return self[:]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, item):
+        """ decompresses only chunks needed by item
+
+        Parameters
+        -------------
+        item : int or slice
+            other index types decompress whole data
+
+        Returns
+        -------------
+        uncompressed numpy array or value
+        """
+        if isinstance(item, (int, integer)):
+            index = item + len(self) if item < 0 else item
+            if not 0 <= index < len(self):
+                raise IndexError('index {} is out of bounds for size {}'.format(item, len(self)))
+            return self._chunk(index // self.chunk_length)[index % self.chunk_length]
+        if not isinstance(item, slice):
+            return self[:][item]
+        start, stop, step = item.indices(len(self))
+        if step < 0:
+            return self[stop + 1:start + 1][::-1][::-step]
+        out = empty((max(0, -(-(stop - start) // step)),) + self.shape[1:], dtype=self.dtype)
+        position = 0
+        for index in range(start // self.chunk_length, -(-stop // self.chunk_length)):
+            chunk_start = index * self.chunk_length
+            # first sample of chunk aligned on step
+            first = max(start, chunk_start)
+            first += -(first - start) % step
+            last = min(stop, chunk_start + self.chunk_length)
+            if first >= last:
+                continue
+            values = self._chunk(index)[first - chunk_start:last - chunk_start:step]
+            out[position:position + len(values)] = values
+            position += len(values)
+        return out
 
     def __str__(self):
         """ prints compressed_data object content
         """
-        return self.decompression()
+        return str(self.decompression())
+
+
+class ScaledData(NDArrayOperatorsMixin):
+    __slots__ = ['raw', 'coefficients']
+    """ class to represent raw data with a lazily applied linear or rational conversion
+
+    Physical values are computed only when sliced or used by numpy (ufunc, arithmetic operators
+    or array conversion), raw data, usually integers, is kept as storage.
+    """
+    def __init__(self, raw, coefficients):
+        """ lazy scaled data constructor
+
+        Parameters
+        -------------
+        raw : numpy array
+            raw data
+        coefficients : tuple of float
+            (p1, p2) for linear conversion physical = p1 + p2 * raw
+            (p1, p2, p3, p4, p5, p6) for rational conversion
+            physical = (p1 * raw**2 + p2 * raw + p3) / (p4 * raw**2 + p5 * raw + p6)
+        """
+        self.raw = raw
+        self.coefficients = tuple(coefficients)
+
+    def _apply(self, raw):
+        """ applies conversion to raw data
+
+        Parameters
+        -------------
+        raw : numpy array or scalar
+            raw data
+
+        Returns
+        -------------
+        converted data
+        """
+        if len(self.coefficients) == 2:
+            p1, p2 = self.coefficients
+            if p2 == 1.0 and p1 in (0.0, -0.0):
+                return raw
+            return raw * p2 + p1
+        else:
+            p1, p2, p3, p4, p5, p6 = self.coefficients
+            return (p1 * raw * raw + p2 * raw + p3) / (p4 * raw * raw + p5 * raw + p6)
+
+    @property
+    def shape(self):
+        return self.raw.shape
+
+    @property
+    def ndim(self):
+        return self.raw.ndim
+
+    @property
+    def size(self):
+        return self.raw.size
+
+    @property
+    def nbytes(self):
+        """ memory used by raw storage """
+        return self.raw.nbytes
+
+    @property
+    def dtype(self):
+        """ dtype of converted data """
+        return self._apply(self.raw[:0]).dtype
+
+    def __len__(self):
+        return len(self.raw)
+
+    def __getitem__(self, item):
+        return self._apply(self.raw[item])
+
+    def __array__(self, dtype=None, copy=None):
+        vector = self._apply(self.raw)
+        if vector is self.raw:
+            vector = vector.copy()
+        if dtype is not None:
+            vector = vector.astype(dtype, copy=False)
+        return vector
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        if any(isinstance(out, ScaledData) for out in kwargs.get('out', ())):
+            return NotImplemented
+        inputs = tuple(value._apply(value.raw) if isinstance(value, ScaledData) else value
+                       for value in inputs)
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __getattr__(self, name):
+        # other numpy array attributes and methods are taken from converted data
+        if name in ScaledData.__slots__:
+            raise AttributeError(name)
+        return getattr(self.__array__(), name)
+
+    def __repr__(self):
+        return 'ScaledData({}, coefficients={})'.format(array_repr(self.raw), self.coefficients)
+
+    def __str__(self):
+        return str(self.__array__())
+
+
+class RangeData(NDArrayOperatorsMixin):
+    __slots__ = ['start', 'step', 'length', 'offset', 'stride', '_dtype']
+    """ class to represent regularly sampled data, typically master channels, as start + index * step
+
+    Values are computed only when indexed or used by numpy (ufunc, arithmetic operators or array conversion),
+    slicing returns a new RangeData and searchsorted is computed without values.
+    Slices keep start and step of original range so their values are identical to original ones.
+    """
+    def __init__(self, start, step, length, dtype=float64, offset=0, stride=1):
+        """ lazy range constructor
+
+        Parameters
+        -------------
+        start : int or float
+            first value
+        step : int or float
+            constant interval between values, not null
+        length : int
+            number of values
+        dtype : numpy dtype, optional
+            dtype of values, float64 by default
+        offset : int, optional
+            index in original range of first value, used by slicing
+        stride : int, optional
+            index increment in original range between values, used by slicing
+        """
+        self.start = start
+        self.step = step
+        self.length = int(length)
+        self.offset = int(offset)
+        self.stride = int(stride)
+        self._dtype = numpy_dtype(dtype)
+
+    @staticmethod
+    def from_array(data, relative_tolerance=1e-6):
+        """ detects regular sampling of data
+
+        Parameters
+        -------------
+        data : numpy array
+            increasing 1D numeric data
+        relative_tolerance : float, optional
+            maximum deviation from regular sampling, relative to sampling interval
+
+        Returns
+        -------------
+        RangeData, None if data is not regularly sampled
+        """
+        if isinstance(data, RangeData):
+            return data
+        if not isinstance(data, ndarray) or data.ndim != 1 or len(data) < 2 or data.dtype.kind not in 'uif':
+            return None
+        step = (data[-1] - data[0]) / (len(data) - 1)
+        if data.dtype.kind in 'ui':
+            step = int(step) if step == int(step) else None
+        if not step or step < 0:
+            return None
+        tolerance = abs(step) * relative_tolerance
+        for index in range(0, len(data), chunk_size_conversion):
+            piece = data[index:index + chunk_size_conversion]
+            expected = data[0] + arange(index, index + len(piece)) * step
+            if npabs(piece - expected).max() > tolerance:
+                return None
+        return RangeData(data[0].item(), step, len(data), data.dtype)
+
+    def _values(self, index):
+        """ computes values at indexes
+
+        Parameters
+        -------------
+        index : numpy array or int
+            indexes
+
+        Returns
+        -------------
+        values with range dtype
+        """
+        values = asarray(self.start + (self.offset + index * self.stride) * self.step)
+        return values.astype(self._dtype, copy=False)
+
+    def linear(self, p1, p2):
+        """ linear conversion p1 + p2 * value, kept as range
+
+        Parameters
+        -------------
+        p1 : float
+            offset
+        p2 : float
+            factor
+
+        Returns
+        -------------
+        RangeData
+        """
+        if p2 == 1.0 and p1 in (0.0, -0.0):
+            return self
+        return RangeData(self.start * p2 + p1, self.step * p2, self.length, offset=self.offset, stride=self.stride)
+
+    @property
+    def shape(self):
+        return (self.length,)
+
+    @property
+    def ndim(self):
+        return 1
+
+    @property
+    def size(self):
+        return self.length
+
+    @property
+    def nbytes(self):
+        """ memory used, values are not stored """
+        return 0
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self.length)
+            return RangeData(self.start, self.step, len(range(start, stop, step)), self._dtype,
+                             self.offset + start * self.stride, self.stride * step)
+        if isinstance(item, (int, integer)):
+            if item < 0:
+                item += self.length
+            if not 0 <= item < self.length:
+                raise IndexError('index {} out of range'.format(item))
+            return self._values(item)[()]
+        item = asarray(item)
+        if item.dtype == bool:
+            item = flatnonzero(item)
+        return self._values(where(item < 0, item + self.length, item))
+
+    def searchsorted(self, values, side='left', sorter=None):
+        """ indexes where values should be inserted to maintain order, computed without values
+
+        Parameters
+        -------------
+        values : scalar or numpy array
+            values to insert
+        side : str, optional
+            'left' or 'right', like numpy.searchsorted
+
+        Returns
+        -------------
+        int or numpy array of int
+        """
+        values = asarray(values)
+        position = ((values - self.start) / self.step - self.offset) / self.stride
+        if side == 'left':
+            index = ceil(position)
+        else:
+            index = floor(position) + 1
+        index = clip(index, 0, self.length).astype(int)
+        # correction of rounding, values computed as stored
+        previous = self._values(clip(index - 1, 0, max(self.length - 1, 0)))
+        current = self._values(clip(index, 0, max(self.length - 1, 0)))
+        if side == 'left':
+            index -= (index > 0) & (previous >= values)
+            index += (index < self.length) & (current < values)
+        else:
+            index -= (index > 0) & (previous > values)
+            index += (index < self.length) & (current <= values)
+        if index.ndim == 0:
+            return int(index)
+        return index
+
+    def __array__(self, dtype=None, copy=None):
+        vector = self._values(arange(self.length))
+        if dtype is not None:
+            vector = vector.astype(dtype, copy=False)
+        return vector
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        if any(isinstance(out, RangeData) for out in kwargs.get('out', ())):
+            return NotImplemented
+        inputs = tuple(value.__array__() if isinstance(value, RangeData) else value for value in inputs)
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __getattr__(self, name):
+        # other numpy array attributes and methods are taken from values
+        if name in RangeData.__slots__:
+            raise AttributeError(name)
+        return getattr(self.__array__(), name)
+
+    def __repr__(self):
+        return 'RangeData(start={}, step={}, length={}, dtype={})'.format(self[0] if self.length else self.start,
+                                                                           self.step * self.stride,
+                                                                           self.length, self._dtype)
+
+    def __str__(self):
+        return str(self.__array__())
+
+
+class RunData(NDArrayOperatorsMixin):
+    __slots__ = ['starts', 'values', 'length']
+    """ class to represent slowly changing data, typically states, flags or counters, as runs of same value
+
+    Only the index where each run starts and its value are stored. Values are expanded only when indexed
+    or used by numpy, element wise ufuncs with scalars (arithmetic, comparisons) are computed on runs values
+    only and return a new RunData, slicing returns a new RunData.
+
+    Attributes
+    --------------
+    starts : numpy array of int64
+        index of first sample of each run, increasing, first one is 0
+    values : numpy array
+        value of each run
+    length : int
+        number of samples
+    """
+    def __init__(self, starts, values, length):
+        """ run length constructor
+
+        Parameters
+        -------------
+        starts : numpy array of int
+            index of first sample of each run
+        values : numpy array
+            value of each run
+        length : int
+            number of samples
+        """
+        self.starts = asarray(starts, dtype=int64)
+        self.values = asarray(values)
+        self.length = int(length)
+
+    @staticmethod
+    def from_array(data, max_run_ratio=run_length_ratio):
+        """ encodes data by runs if it changes seldom enough
+
+        Parameters
+        -------------
+        data : numpy array
+            1D data
+        max_run_ratio : float, optional
+            maximum number of runs per sample
+
+        Returns
+        -------------
+        RunData, None if data has too many runs
+        """
+        if isinstance(data, RunData):
+            return data
+        if type(data) is not ndarray or data.ndim != 1 or len(data) < 2 or data.dtype.kind in 'OV':
+            return None
+        max_runs = int(len(data) * max_run_ratio)
+        changes = []
+        n_runs = 1
+        for index in range(0, len(data) - 1, chunk_size_conversion):
+            piece = data[index:index + chunk_size_conversion + 1]
+            change = flatnonzero(piece[1:] != piece[:-1])
+            n_runs += len(change)
+            if n_runs > max_runs:
+                return None
+            changes.append(change + index + 1)
+        starts = concatenate([[0]] + changes).astype(int64)
+        return RunData(starts, data[starts], len(data))
+
+    def with_values(self, values):
+        """ same runs with other values, typically converted ones
+
+        Parameters
+        -------------
+        values : numpy array
+            new value of each run
+
+        Returns
+        -------------
+        RunData
+        """
+        return RunData(self.starts, values, self.length)
+
+    def run_index(self, index):
+        """ run containing samples
+
+        Parameters
+        -------------
+        index : int or numpy array of int
+            sample indexes, positive
+
+        Returns
+        -------------
+        int or numpy array of int
+        """
+        return searchsorted(self.starts, index, side='right') - 1
+
+    @property
+    def shape(self):
+        return (self.length,)
+
+    @property
+    def ndim(self):
+        return 1
+
+    @property
+    def size(self):
+        return self.length
+
+    @property
+    def nbytes(self):
+        """ memory used by runs """
+        return self.starts.nbytes + self.values.nbytes
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self.length)
+            if step != 1:
+                return self.values[self.run_index(arange(start, stop, step))]
+            if stop <= start:
+                return RunData(self.starts[:0], self.values[:0], 0)
+            first = self.run_index(start)
+            last = self.run_index(stop - 1)
+            starts = self.starts[first:last + 1] - start
+            starts[0] = 0
+            return RunData(starts, self.values[first:last + 1], stop - start)
+        if isinstance(item, (int, integer)):
+            if item < 0:
+                item += self.length
+            if not 0 <= item < self.length:
+                raise IndexError('index {} out of range'.format(item))
+            return self.values[self.run_index(item)]
+        item = asarray(item)
+        if item.dtype == bool:
+            item = flatnonzero(item)
+        return self.values[self.run_index(where(item < 0, item + self.length, item))]
+
+    def searchsorted(self, values, side='left', sorter=None):
+        """ indexes where values should be inserted to maintain order, computed on runs
+
+        Parameters
+        -------------
+        values : scalar or numpy array
+            values to insert
+        side : str, optional
+            'left' or 'right', like numpy.searchsorted
+
+        Returns
+        -------------
+        int or numpy array of int
+
+        Notes
+        --------
+        Data must be increasing, like for numpy.searchsorted
+        """
+        index = append(self.starts, self.length)[searchsorted(self.values, values, side=side)]
+        if index.ndim == 0:
+            return int(index)
+        return index
+
+    def __array__(self, dtype=None, copy=None):
+        vector = repeat(self.values, diff(append(self.starts, self.length)))
+        if dtype is not None:
+            vector = vector.astype(dtype, copy=False)
+        return vector
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        if method == '__call__' and ufunc.nout == 1 and 'out' not in kwargs and \
+                sum(isinstance(value, RunData) for value in inputs) == 1 and \
+                all(isinstance(value, RunData) or asarray(value).ndim == 0 for value in inputs):
+            # element wise with scalars, computed on runs only
+            return self.with_values(getattr(ufunc, method)(*(value.values if isinstance(value, RunData) else value
+                                                            for value in inputs), **kwargs))
+        if any(isinstance(out, RunData) for out in kwargs.get('out', ())):
+            return NotImplemented
+        inputs = tuple(value.__array__() if isinstance(value, RunData) else value for value in inputs)
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __getattr__(self, name):
+        # other numpy array attributes and methods are taken from values
+        if name in RunData.__slots__:
+            raise AttributeError(name)
+        return getattr(self.__array__(), name)
+
+    def __repr__(self):
+        return 'RunData(runs={}, length={}, dtype={})'.format(len(self.starts), self.length, self.dtype)
+
+    def __str__(self):
+        return str(self.__array__())
+
+
+class BitData(NDArrayOperatorsMixin):
+    __slots__ = ['packed', 'length', '_dtype']
+    """ class to represent 1 bit channels as packed bits, 8 samples per byte
+
+    Bits are packed in little bit order, padding bits of last byte are always null.
+    Values are unpacked only when indexed or used by numpy. Bitwise and logical operations between
+    BitData or with boolean scalars, counting and edge detection are computed on packed bytes.
+    Inversion is logical, like for boolean arrays. Results keep dtype of operands, except logical
+    operations giving bool like numpy.
+
+    Attributes
+    --------------
+    packed : numpy array of uint8
+        packed bits
+    length : int
+        number of samples
+    """
+    def __init__(self, packed, length, dtype=bool):
+        """ packed bits constructor
+
+        Parameters
+        -------------
+        packed : numpy array of uint8
+            bits packed in little bit order, padding bits null
+        length : int
+            number of samples
+        dtype : numpy dtype, optional
+            dtype of unpacked values, bool by default
+        """
+        self.packed = packed
+        self.length = int(length)
+        self._dtype = numpy_dtype(dtype)
+
+    @staticmethod
+    def from_array(data):
+        """ packs 1 bit data
+
+        Parameters
+        -------------
+        data : numpy array
+            1D bool or unsigned integer data containing only 0 and 1
+
+        Returns
+        -------------
+        BitData
+        """
+        if isinstance(data, BitData):
+            return data
+        return BitData(packbits(data, bitorder='little'), len(data), data.dtype)
+
+    def _unpack(self, start, stop):
+        """ unpacks samples between start and stop indexes, start lower than stop
+
+        Returns
+        -------------
+        numpy array of uint8 0 or 1
+        """
+        first = start >> 3
+        return unpackbits(self.packed[first:(stop + 7) >> 3], bitorder='little')[start - (first << 3):
+                                                                                stop - (first << 3)]
+
+    def _mask_padding(self, packed):
+        """ clears padding bits of last byte """
+        if self.length & 7:
+            packed[-1] &= (1 << (self.length & 7)) - 1
+        return packed
+
+    def to_bool(self):
+        """ unpacked values as boolean numpy array """
+        return self._unpack(0, self.length).view(bool)
+
+    def count_nonzero(self):
+        """ number of samples set
+
+        Returns
+        -------------
+        int
+        """
+        return int(_bit_count_table[self.packed].sum(dtype=int64))
+
+    def indexes(self):
+        """ indexes of samples set, only bytes having set bits are unpacked
+
+        Returns
+        -------------
+        numpy array of int64
+        """
+        bytes_index = flatnonzero(self.packed)
+        bits = unpackbits(self.packed[bytes_index], bitorder='little').reshape(-1, 8)
+        rows, columns = bits.nonzero()
+        return (bytes_index[rows] << 3) + columns
+
+    def _previous(self):
+        """ packed bits shifted by one sample, first previous sample being first sample """
+        previous = (self.packed << 1).astype(uint8)
+        previous[1:] |= self.packed[:-1] >> 7
+        if len(previous):
+            previous[0] |= self.packed[0] & 1
+        return previous
+
+    def rising_edges(self):
+        """ samples set while previous sample is not set
+
+        Returns
+        -------------
+        BitData
+        """
+        return BitData(self.packed & ~self._previous(), self.length, self._dtype)
+
+    def falling_edges(self):
+        """ samples not set while previous sample is set
+
+        Returns
+        -------------
+        BitData
+        """
+        return BitData(self._mask_padding(~self.packed & self._previous()), self.length, self._dtype)
+
+    @property
+    def shape(self):
+        return (self.length,)
+
+    @property
+    def ndim(self):
+        return 1
+
+    @property
+    def size(self):
+        return self.length
+
+    @property
+    def nbytes(self):
+        """ memory used by packed bits """
+        return self.packed.nbytes
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self.length)
+            if step != 1:
+                return self.__array__()[item]
+            if stop <= start:
+                return BitData(self.packed[:0], 0, self._dtype)
+            if not start & 7:  # byte aligned, view of packed bits
+                packed = self.packed[start >> 3:(stop + 7) >> 3]
+                sliced = BitData(packed, stop - start, self._dtype)
+                if stop & 7 and stop != self.length:  # padding bits to be cleared
+                    sliced.packed = sliced._mask_padding(packed.copy())
+                return sliced
+            return BitData(packbits(self._unpack(start, stop), bitorder='little'), stop - start, self._dtype)
+        if isinstance(item, (int, integer)):
+            if item < 0:
+                item += self.length
+            if not 0 <= item < self.length:
+                raise IndexError('index {} out of range'.format(item))
+            return self._dtype.type((self.packed[item >> 3] >> (item & 7)) & 1)
+        return self.__array__()[item]
+
+    def __array__(self, dtype=None, copy=None):
+        vector = self._unpack(0, self.length)
+        if self._dtype == bool:
+            vector = vector.view(bool)
+        else:
+            vector = vector.astype(self._dtype, copy=False)
+        if dtype is not None:
+            vector = vector.astype(dtype, copy=False)
+        return vector
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        if method == '__call__' and 'out' not in kwargs and not kwargs:
+            if ufunc in (invert, logical_not) and len(inputs) == 1:
+                return BitData(self._mask_padding(~self.packed), self.length,
+                               bool if ufunc is logical_not else self._dtype)
+            operation = {bitwise_and: bitwise_and, logical_and: bitwise_and, bitwise_or: bitwise_or,
+                         logical_or: bitwise_or, bitwise_xor: bitwise_xor, logical_xor: bitwise_xor}.get(ufunc)
+            if operation is not None and len(inputs) == 2:
+                packed = []
+                for value in inputs:
+                    if isinstance(value, BitData) and value.length == self.length:
+                        packed.append(value.packed)
+                    elif isinstance(value, (bool, bool_)):
+                        packed.append(self._mask_padding(full(len(self.packed), 255 * value, dtype=uint8)))
+                    else:
+                        break
+                else:
+                    if ufunc in (logical_and, logical_or, logical_xor):
+                        dtype = bool
+                    else:
+                        dtype = result_type(*[value.dtype for value in inputs if isinstance(value, BitData)])
+                    return BitData(operation(packed[0], packed[1]), self.length, dtype)
+        if any(isinstance(out, BitData) for out in kwargs.get('out', ())):
+            return NotImplemented
+        inputs = tuple(value.__array__() if isinstance(value, BitData) else value for value in inputs)
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __getattr__(self, name):
+        # other numpy array attributes and methods are taken from values
+        if name in BitData.__slots__:
+            raise AttributeError(name)
+        return getattr(self.__array__(), name)
+
+    def __repr__(self):
+        return 'BitData(length={}, dtype={})'.format(self.length, self._dtype)
+
+    def __str__(self):
+        return str(self.__array__())
+
+
+class _BitFieldColumn(object):
+    __slots__ = ['bits', 'length']
+    """ record column of up to 8 BitData channels sharing one byte, bit n being channel n """
+    dtype = numpy_dtype('u1')
+    ndim = 1
+
+    def __init__(self, length):
+        self.bits = []
+        self.length = length
+
+    @property
+    def shape(self):
+        return (self.length,)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, item):
+        start, stop, _ = item.indices(self.length)
+        column = zeros(max(stop - start, 0), dtype=uint8)
+        for position, bits in enumerate(self.bits):
+            column |= bits._unpack(start, stop) << position
+        return column
+
+
+class Resampler(object):
+    __slots__ = ['index', 'right', 'weight', 'length']
+    """ resampling of channels sharing same master channel onto a new master channel
+
+    Bracketing indexes and interpolation weights are computed once from master channels and
+    applied to every channel of the group: float channels are linearly interpolated like numpy.interp,
+    other channels are resampled with zero order hold.
+
+    Attributes
+    --------------
+    index : numpy array
+        index of last old master sample lower or equal to each new master sample, clipped to
+        valid indexes, used for zero order hold and as left bracketing index
+    right : numpy array
+        right bracketing index
+    weight : numpy array
+        interpolation weight of right bracketing sample, between 0 and 1
+    length : int
+        number of samples of old master channel
+    """
+
+    def __init__(self, master_data, new_master_data):
+        """ computes bracketing indexes and weights
+
+        Parameters
+        ----------------
+        master_data : numpy array
+            increasing master channel data of channels to be resampled
+        new_master_data : numpy array
+            increasing master channel data to resample onto
+        """
+        if not isinstance(master_data, RangeData):  # otherwise indexes computed without values
+            master_data = asarray(master_data)
+        new_master_data = asarray(new_master_data, dtype=float64)
+        self.length = len(master_data)
+        last = max(self.length - 1, 0)
+        self.index = searchsorted(master_data, new_master_data, side='right')
+        self.index -= 1
+        clip(self.index, 0, last, out=self.index)
+        self.right = minimum(self.index + 1, last)
+        with errstate(divide='ignore', invalid='ignore'):
+            self.weight = (new_master_data - master_data[self.index]) / \
+                (master_data[self.right] - master_data[self.index])
+        self.weight[isnan(self.weight)] = 0.0  # no right bracketing sample or duplicated master samples
+        clip(self.weight, 0.0, 1.0, out=self.weight)
+
+    def __call__(self, data):
+        """ resamples channel data
+
+        Parameters
+        ----------------
+        data : numpy array
+            channel data, first dimension along master channel
+
+        Returns
+        -----------
+        resampled numpy array
+        """
+        if len(data) != self.length:
+            raise ValueError('channel and master channel do not have same length')
+        if data.dtype.kind != 'f':  # zero order hold
+            return data[self.index]
+        weight = self.weight.reshape((-1,) + (1,) * (data.ndim - 1))
+        values = data[self.index].astype(float64, copy=False)
+        delta = data[self.right] - values
+        delta *= weight
+        values += delta
+        return values
+
+    def __getitem__(self, selection):
+        """ restricts resampling to part of new master channel, sharing indexes and weights when sliced
+
+        Parameters
+        ----------------
+        selection : slice or numpy array
+            part of new master channel samples
+
+        Returns
+        -----------
+        Resampler
+        """
+        part = Resampler.__new__(Resampler)
+        part.index = self.index[selection]
+        part.right = self.right[selection]
+        part.weight = self.weight[selection]
+        part.length = self.length
+        return part
+
+    def stack(self, vectors):
+        """ resamples several channels data of same dtype at once, stacked in a 2D matrix
+
+        Parameters
+        ----------------
+        vectors : list of numpy 1D arrays
+            channels data of same dtype
+
+        Returns
+        -----------
+        list of resampled numpy 1D arrays, rows of a same matrix
+        """
+        matrix = vstack(vectors)  # one row per channel
+        if matrix.shape[1] != self.length:
+            raise ValueError('channels and master channel do not have same length')
+        if matrix.dtype.kind != 'f':  # zero order hold
+            return list(matrix.take(self.index, axis=1))
+        values = matrix.take(self.index, axis=1).astype(float64, copy=False)
+        delta = matrix.take(self.right, axis=1).astype(float64, copy=False)
+        delta -= values
+        delta *= self.weight
+        values += delta
+        return list(values)
+
+
+class AlignedView(object):
+    __slots__ = ['mdf', 'master', 'channels', '_resamplers']
+    """ read-only view of channels from several master channels aligned on one master channel
+
+    Resampling indexes and weights are computed once per master channel, channels are resampled
+    only when accessed, fully or by slice. Original data is never modified, channels with
+    linear or rational conversion are converted only for the samples needed.
+
+    Attributes
+    --------------
+    mdf : Mdf class
+        mdf object containing channels
+    master : numpy array
+        master channel data channels are aligned on
+    channels : list of str
+        channel names
+    _resamplers : dict
+        Resampler by master channel name, None if master channel is already aligned
+
+    Examples
+    --------------
+    >>> view = yop.aligned_view(['speed', 'torque'], sampling=0.01)
+    >>> power = view['speed'] * view['torque']
+    >>> first_second = view['speed', :100]
+    """
+
+    def __init__(self, mdf, master_data, channel_list):
+        """ computes resampling of each master channel
+
+        Parameters
+        ----------------
+        mdf : Mdf class
+            mdf object containing channels
+        master_data : numpy array
+            increasing master channel data to align channels on
+        channel_list : list of str
+            channel names
+        """
+        self.mdf = mdf
+        self.master = asarray(master_data)
+        self.channels = []
+        self._resamplers = dict()
+        for name in channel_list:
+            if name not in mdf:
+                warn('channel {} not found'.format(name))
+                continue
+            master_name = mdf.get_channel_master(name)
+            if master_name not in self._resamplers:
+                master_data = mdf.get_channel_data(master_name, lazy_conversion=True) if master_name in mdf else None
+                if master_data is None:
+                    warn('channel {} has no master channel, not aligned'.format(name))
+                    continue
+                if len(master_data) == len(self.master) and (asarray(master_data) == self.master).all():
+                    self._resamplers[master_name] = None
+                else:
+                    self._resamplers[master_name] = Resampler(master_data, self.master)
+            self.channels.append(name)
+
+    def __len__(self):
+        return len(self.master)
+
+    def __iter__(self):
+        return iter(self.channels)
+
+    def __contains__(self, channel_name):
+        return channel_name in self.channels
+
+    def __getitem__(self, key):
+        """ aligned channel data
+
+        Parameters
+        ----------------
+        key : str or tuple
+            channel name or tuple of channel name and slice or index array of master channel samples
+
+        Returns
+        -----------
+        numpy array, view of original data if its master channel is already aligned
+        """
+        if isinstance(key, tuple):
+            channel_name, selection = key
+        else:
+            channel_name, selection = key, slice(None)
+        if channel_name not in self.channels:
+            raise KeyError(channel_name)
+        data = self.mdf.get_channel_data(channel_name, lazy_conversion=True)
+        resampler = self._resamplers[self.mdf.get_channel_master(channel_name)]
+        if resampler is None:
+            return asarray(data[selection])
+        return resampler[selection](data)
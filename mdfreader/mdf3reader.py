@@ -10,15 +10,15 @@ mdf3reader
 """
 from __future__ import absolute_import  # for consistency between python 2 and 3
 from __future__ import print_function
-from numpy import right_shift, bitwise_and, interp, empty
+from numpy import right_shift, bitwise_and, empty
 from numpy import max as npmax, min as npmin
-from numpy import asarray, recarray, array, searchsorted, vectorize
+from numpy import recarray
 from numpy import issubdtype, number as numpy_number
 import numpy as np
 if np.lib.NumpyVersion(np.__version__) >= '2.0.0b1':
-    from numpy.rec import fromstring, fromarrays
+    from numpy.rec import fromstring
 else:
-    from numpy.core.records import fromstring, fromarrays
+    from numpy.core.records import fromstring
 from collections import defaultdict
 from math import log, exp
 from time import strftime, time, gmtime
@@ -30,8 +30,9 @@ from warnings import warn
 import os
 from warnings import simplefilter
 from .mdf import MdfSkeleton, _open_mdf, \
-    dataField, conversionField, idField, CompressedData
-from .mdfinfo3 import Info3
+    dataField, conversionField, idField, CompressedData, ScaledData, RangeData, RunData, BitData, _chunked_conversion, \
+    _interleave_records, _record_chunks
+from .mdfinfo3 import Info3, ValueTable, TextTable, TextRangeTable, compile_cc_table
 from .channel import Channel3
 if os.name == 'posix':
     from os import getlogin
@@ -43,6 +44,11 @@ except ImportError:
     dataRead_available = False
 
 chunk_size_reading = 100000000  # reads by chunk of 100Mb, can be tuned for best performance
+# converts data type from mdf 3.x to 4.x
+convertDataType3to4 = {0: 0, 1: 2, 2: 4, 3: 4,
+                       7: 6, 8: 10,
+                       9: 1, 10: 3, 11: 5, 12: 5,
+                       13: 0, 14: 2, 15: 4, 16: 4}
 
 
 def _linear_conversion(data, conversion):  # 0 Parametric, Linear: Physical =Integer*P2 + P1
@@ -77,9 +83,7 @@ def _tab_interp_conversion(data, conversion):  # 1 Tabular with interpolation
     -----------
     converted data to physical value
     """
-    tmp = array([(key, val['int'], val['phys'])
-                 for (key, val) in conversion.items()])
-    return interp(data, tmp[:, 1], tmp[:, 2])
+    return ValueTable(conversion, interpolation=True)(data)
 
 
 def _tab_conversion(data, conversion):  # 2 Tabular
@@ -95,10 +99,7 @@ def _tab_conversion(data, conversion):  # 2 Tabular
     -----------
     converted data to physical value
     """
-    tmp = array([(key, val['int'], val['phys'])
-                 for (key, val) in conversion.items()])
-    indexes = searchsorted(tmp[:, 1], data)
-    return tmp[indexes, 2]
+    return ValueTable(conversion, interpolation=False)(data)
 
 
 def _polynomial_conversion(data, conversion):  # 6 Polynomial
@@ -227,10 +228,7 @@ def _text_table_conversion(data, conversion):  # 11 Text table
     -----------
     converted data to physical value
     """
-    conversion_table = dict()
-    for pair in conversion:
-        conversion_table[conversion[pair]['int']] = conversion[pair]['text']
-    return vectorize(conversion_table.__getitem__)(data)
+    return TextTable(conversion)(data)
 
 
 def _text_range_table_conversion(data, conversion):  # 12 Text range table
@@ -247,36 +245,7 @@ def _text_range_table_conversion(data, conversion):  # 12 Text range table
     converted data to physical value
     """
     try:
-        n_pair = len(conversion)
-        lower = [conversion[pair]['lowerRange'] for pair in range(n_pair)]
-        upper = [conversion[pair]['upperRange'] for pair in range(n_pair)]
-        text = {}
-        for pair in range(n_pair):
-            text[pair] = conversion[pair]['Textrange']
-            if text[pair] is None:
-                continue
-            if 'LINEAR_CONV' in text[pair]:  # linear conversion from CANape
-                from sympy import lambdify, symbols
-                X = symbols('X')  # variable is X
-                left = text[pair].find('"')
-                right = text[pair].rfind('"')
-                text[pair] = text[pair][left + 1: right].replace('{', '').replace('}', '')
-                text[pair] = lambdify(X, text[pair], modules='numpy', dummify=False)
-        temp = []
-        for l_index in range(len(data)):
-            value = text[0]  # default value
-            for pair in range(1, n_pair):
-                if lower[pair] <= data[l_index] <= upper[pair]:
-                    value = text[pair]
-                    break
-            if callable(value):
-                value = value(data[l_index])
-            temp.append(value)
-        try:
-            temp = asarray(temp)  # try to convert to numpy
-        except:
-            pass
-        return temp
+        return TextRangeTable(conversion)(data)
     except:
         warn('Failed to convert text to range table')
 
@@ -516,11 +485,6 @@ class Record(list):
                                                                'formats': numpy_data_record_format})
                 if dataRead_available:
                     try:  # use rather cython compiled code for performance
-                        # converts data type from mdf 3.x to 4.x
-                        convertDataType3to4 = {0: 0, 1: 2, 2: 4, 3: 4,
-                                               7: 6, 8: 10,
-                                               9: 1, 10: 3, 11: 5, 12: 5,
-                                               13: 0, 14: 2, 15: 4, 16: 4}
                         for n_record_chunk, chunk_size in chunks:
                             bit_stream = fid.read(chunk_size)
                             for id, chan in enumerate(rec_chan):
@@ -991,6 +955,8 @@ class Mdf3(MdfSkeleton):
                                         temp = bitwise_and(temp, mask)
                                     else:  # should not happen
                                         warn('bit count and offset not applied to correct data type')
+                                if chan.bitCount == 1 and temp.ndim == 1 and temp.dtype.kind in ('u', 'b'):
+                                    temp = BitData.from_array(temp)  # flag stored as packed bits
                                 self.add_channel(chan.name, temp, master_channel, master_type=1, unit=chan.unit,
                                                  description=chan.desc, conversion=chan.conversion, info=None,
                                                  compression=compression)
@@ -1004,7 +970,7 @@ class Mdf3(MdfSkeleton):
             self._noDataLoading = False
             self._convert_all_channel3()
 
-    def _get_channel_data3(self, channel_name, raw_data=False):
+    def _get_channel_data3(self, channel_name, raw_data=False, lazy_conversion=False, dtype=None):
         """Returns channel numpy array
 
         Parameters
@@ -1013,6 +979,10 @@ class Mdf3(MdfSkeleton):
             channel name
         raw_data: bool
             flag to return non converted data
+        lazy_conversion: bool
+            flag to return linear or rational converted data as ScaledData, keeping raw data storage
+        dtype : numpy dtype or str, optional
+            converted data precision policy: None, 'float32', 'float64' or 'keep' for raw integer dtype
 
         Returns
         -----------
@@ -1030,13 +1000,26 @@ class Mdf3(MdfSkeleton):
                     (self.info.fid, self.info.fileName, zipfile) = _open_mdf(self.fileName)
                 self.read3(file_name=None, info=self.info, channel_list=[channel_name], convert_after_read=False)
             if not raw_data:
-                return self._convert3(channel_name, self.convertTables)
+                conversion = self.get_channel(channel_name).get(conversionField)
+                if lazy_conversion and conversion is not None and conversion['type'] in (0, 9):
+                    vector = self.get_channel(channel_name)[dataField]
+                    if isinstance(vector, CompressedData):
+                        vector = vector.decompression()
+                    if issubdtype(vector.dtype, numpy_number) and not isinstance(vector, (RangeData, RunData, BitData)):
+                        parameters = conversion['parameters']
+                        if conversion['type'] == 0:
+                            return ScaledData(vector, (parameters['P1'], parameters['P2']))
+                        return ScaledData(vector, [parameters['P{}'.format(i)] for i in range(1, 7)])
+                vector = self._convert3(channel_name, self.convertTables, dtype)
             else:
-                return self.get_channel(channel_name)[dataField]
+                vector = self.get_channel(channel_name)[dataField]
+            if isinstance(vector, (RangeData, RunData, BitData)) and not lazy_conversion:
+                vector = vector.__array__()  # regularly sampled, slowly changing or 1 bit data stored compact
+            return vector
         else:
             return None
 
-    def _convert3(self, channel_name, convert_tables=False):
+    def _convert3(self, channel_name, convert_tables=False, dtype=None):
         """converts specific channel from raw to physical data according to CCBlock information
 
         Parameters
@@ -1045,6 +1028,9 @@ class Mdf3(MdfSkeleton):
             Name of channel
         convert_tables : bool
             activates computation intensive loops for conversion with tables. Default is False
+        dtype : numpy dtype or str, optional
+            output precision policy for element wise conversions, converted by chunks:
+            None (default, mostly float64), 'float32', 'float64' or 'keep' to keep raw integer dtype
 
         Returns
         -----------
@@ -1060,52 +1046,95 @@ class Mdf3(MdfSkeleton):
             else:
                 vector = self[channel_name][dataField][:]  # to have bcolz uncompressed data
         if conversionField in self[channel_name]:  # there is conversion property
-            conversion = self[channel_name][conversionField]
-            if conversion['type'] == 0:
-                return _linear_conversion(vector, conversion['parameters'])
-            elif conversion['type'] == 1:
-                return _tab_interp_conversion(vector, conversion['parameters'])
-            elif conversion['type'] == 2:
-                return _tab_conversion(vector, conversion['parameters'])
-            elif conversion['type'] == 6:
-                return _polynomial_conversion(vector, conversion['parameters'])
-            elif conversion['type'] == 7:
-                return _exponential_conversion(vector, conversion['parameters'])
-            elif conversion['type'] == 8:
-                return _log_conversion(vector, conversion['parameters'])
-            elif conversion['type'] == 9:
-                return _rational_conversion(vector, conversion['parameters'])
-            elif conversion['type'] == 10:
-                return _formula_conversion(vector, conversion['parameters'])
-            elif conversion['type'] == 11 and convert_tables:
-                return _text_table_conversion(vector, conversion['parameters'])
-            elif conversion['type'] == 12 and convert_tables:
-                return _text_range_table_conversion(vector, conversion['parameters'])
-            else:
-                return vector
+            if isinstance(vector, BitData):  # converted values are not bits, kept packed if not converted
+                bits = vector.__array__()
+                converted = self._convert_vector3(bits, self[channel_name][conversionField], convert_tables, dtype)
+                return vector if converted is bits else converted
+            if isinstance(vector, RunData):  # conversion applied on runs values only
+                return vector.with_values(self._convert_vector3(vector.values, self[channel_name][conversionField],
+                                                                convert_tables, dtype))
+            return self._convert_vector3(vector, self[channel_name][conversionField], convert_tables, dtype)
+        else:
+            return vector
+
+    @staticmethod
+    def _convert_vector3(vector, conversion, convert_tables=False, dtype=None):
+        """converts raw data to physical data according to CCBlock information
+
+        Parameters
+        ----------------
+        vector : numpy array
+            raw data
+        conversion : dict
+            channel conversion with keys type and parameters
+        convert_tables : bool
+            activates computation intensive loops for conversion with tables. Default is False
+        dtype : numpy dtype or str, optional
+            output precision policy for element wise conversions
+
+        Returns
+        -----------
+        numpy array
+            returns numpy array converted to physical values according to conversion type
+        """
+        if conversion['type'] in (1, 2, 11, 12) and 'table' not in conversion:
+            # channel not created from Info3, compiles its table once
+            conversion['table'] = compile_cc_table(conversion['type'], conversion['parameters'])
+        if conversion['type'] == 0 and isinstance(vector, RangeData) and dtype is None:
+            return vector.linear(conversion['parameters']['P1'], conversion['parameters']['P2'])
+        elif conversion['type'] == 0:
+            return _chunked_conversion(vector, lambda v: _linear_conversion(v, conversion['parameters']), dtype)
+        elif conversion['type'] in (1, 2) and conversion['table'] is not None:
+            return _chunked_conversion(vector, conversion['table'], dtype)
+        elif conversion['type'] == 6:
+            return _chunked_conversion(vector, lambda v: _polynomial_conversion(v, conversion['parameters']),
+                                       dtype)
+        elif conversion['type'] == 7:
+            return _exponential_conversion(vector, conversion['parameters'])
+        elif conversion['type'] == 8:
+            return _log_conversion(vector, conversion['parameters'])
+        elif conversion['type'] == 9:
+            return _chunked_conversion(vector, lambda v: _rational_conversion(v, conversion['parameters']),
+                                       dtype)
+        elif conversion['type'] == 10:
+            return _formula_conversion(vector, conversion['parameters'])
+        elif conversion['type'] == 11 and convert_tables and conversion['table'] is not None:
+            return conversion['table'](vector)
+        elif conversion['type'] == 12 and convert_tables and conversion['table'] is not None:
+            try:
+                return conversion['table'](vector)
+            except:
+                warn('Failed to convert text to range table')
         else:
             return vector
 
-    def _convert_channel3(self, channel_name):
+    def _convert_channel3(self, channel_name, dtype=None):
         """converts specific channel from raw to physical data according to CCBlock information
 
         Parameters
         ----------------
         channel_name : str
             Name of channel
+        dtype : numpy dtype or str, optional
+            converted data precision policy: None, 'float32', 'float64' or 'keep' for raw integer dtype
         """
-        self.set_channel_data(channel_name, self._convert3(channel_name, self.convertTables))
+        self.set_channel_data(channel_name, self._convert3(channel_name, self.convertTables, dtype))
         self.remove_channel_conversion(channel_name)
 
-    def _convert_all_channel3(self):
+    def _convert_all_channel3(self, dtype=None):
         """Converts all channels from raw data to converted data according to CCBlock information
         Converted data will take more memory.
+
+        Parameters
+        ----------------
+        dtype : numpy dtype or str, optional
+            converted data precision policy: None, 'float32', 'float64' or 'keep' for raw integer dtype
         """
         if self._noDataLoading:  # no data loaded, load everything
             self.read3(self.fileName, convert_after_read=True)
         else:
             for channel in self:
-                self._convert_channel3(channel)
+                self._convert_channel3(channel, dtype)
 
     def write3(self, file_name=None):
         """Writes simple mdf 3.3 file
@@ -1240,7 +1269,7 @@ class Mdf3(MdfSkeleton):
 
             # Channel blocks writing
             pointers['CN'][data_group] = {}
-            data_list = ()
+            columns = []
             data_type_list = ''
             record_number_of_bits = 0
             preceeding_channel = None
@@ -1271,8 +1300,7 @@ class Mdf3(MdfSkeleton):
                     bit_offset -= 0x10000
                     byte_offset += 8192
                 data = self.get_channel_data(channel)  # channel data
-                temp = data
-                data_list = data_list + (temp, )
+                columns.append(data)
                 cn_numpy_kind = data.dtype.kind
                 cn_numpy_item_size = data.dtype.itemsize
                 number_of_bits = cn_numpy_item_size * 8
@@ -1360,8 +1388,9 @@ class Mdf3(MdfSkeleton):
             # data writing
             # write data pointer in datagroup
             write_pointer(fid, pointers['DG'][data_group]['data'], fid.tell())
-            # dumps data vector from numpy
-            fid.write(fromarrays(data_list).tobytes(order='F'))
+            # dumps records, interleaved chunk by chunk into a reused buffer
+            for records in _interleave_records(columns, _record_chunks(n_records, record_number_of_bits // 8)):
+                fid.write(records)
 
             data_group += 1
 
@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+""" Measured Data Format streaming conversion from version 3.x to 4.x
+
+:Author: `Aymeric Rateau <https://github.com/ratal/mdfreader>`__
+
+Data group, channel group, channel and conversion blocks of a mdf 3.x file are mapped onto
+mdf 4.x blocks, records are copied raw chunk by chunk so that channels keep their raw encoding
+and file is never loaded in memory.
+
+Dependencies
+-------------------
+- Python >3.4 <http://www.python.org>
+- Numpy >1.14 <http://numpy.scipy.org>
+
+mdf3to4
+--------------------------
+"""
+from io import open
+from os.path import splitext
+from struct import pack
+from datetime import datetime
+from calendar import timegm
+from warnings import warn
+from .mdfinfo3 import Info3, read_tx_block
+from .mdfinfo4 import IDBlock, FHBlock, CommentBlock, _HeaderStruct, _CGStruct2, _CCStruct2, _DGStruct, \
+    _calculate_block_start, chunk_size_writing
+from .mdf3reader import convertDataType3to4
+from .mdf4tools import _write_data_blocks4
+
+# default byte order data types of big endian files
+_big_endian_data_types = {0: 1, 1: 3, 2: 5, 3: 5}
+
+
+def _write_block4(out, pointer, block_id, links, data=b''):
+    """ writes mdf 4.x block
+
+    Parameters
+    ----------------
+    out
+        output file identifier
+    pointer : int
+        block position
+    block_id : bytes
+        block identifier like b'##CN'
+    links : list of int
+        links of block
+    data : bytes, optional
+        data section of block
+
+    Returns
+    -----------
+    next free position, 8 bytes aligned
+    """
+    length = 24 + 8 * len(links) + len(data)
+    out.seek(pointer)
+    out.write(_HeaderStruct.pack(block_id, 0, length, len(links)))
+    out.write(pack('<{}Q'.format(len(links)), *links))
+    out.write(data)
+    return _calculate_block_start(pointer + length)
+
+
+def _write_text4(out, pointer, text, texts):
+    """ writes TX block, reusing already written block with same text
+
+    Parameters
+    ----------------
+    out
+        output file identifier
+    pointer : int
+        block position if written
+    text : str
+        text
+    texts : dict
+        TX blocks positions by text
+
+    Returns
+    -----------
+    tuple of TX block position (0 if no text) and next free position
+    """
+    if not text:
+        return 0, pointer
+    if text not in texts:
+        texts[text] = pointer
+        pointer = _write_block4(out, pointer, b'##TX', [], b''.join([text.encode('utf-8', 'replace'), b'\0']))
+    return texts[text], pointer
+
+
+def _write_conversion4(out, pointer, conversion, texts):
+    """ writes CC block from mdf 3.x conversion
+
+    Parameters
+    ----------------
+    out
+        output file identifier
+    pointer : int
+        block position if written
+    conversion : dict
+        mdfinfo3 CCBlock dict
+    texts : dict
+        TX blocks positions by text
+
+    Returns
+    -----------
+    tuple of CC block position (0 if no conversion) and next free position
+    """
+    cc_type = conversion['cc_type']
+    parameters = conversion.get('conversion', dict())
+    values = []
+    references = []
+    if cc_type == 0:  # linear
+        new_type = 1
+        values = [parameters['P1'], parameters['P2']]
+    elif cc_type in (1, 2):  # tabular with or without interpolation
+        new_type = 4 if cc_type == 1 else 5
+        for pair in range(len(parameters)):
+            values.extend((parameters[pair]['int'], parameters[pair]['phys']))
+    elif cc_type == 6:  # polynomial, expressed as rational
+        offset = parameters['P5'] + parameters['P6']
+        new_type = 2
+        values = [0.0, -parameters['P4'], parameters['P2'] + parameters['P4'] * offset,
+                  0.0, parameters['P3'], -parameters['P3'] * offset - parameters['P1']]
+    elif cc_type == 9:  # rational
+        new_type = 2
+        values = [parameters['P{}'.format(index)] for index in range(1, 7)]
+    elif cc_type in (7, 8, 10):  # exponential, logarithmic and text formula, expressed as formula
+        new_type = 3
+        if cc_type == 10:
+            formula = parameters['textFormula']
+        else:
+            function = 'exp' if cc_type == 7 else 'log'
+            p = dict((key, repr(value)) for key, value in parameters.items())
+            if parameters['P4'] == 0 and parameters['P1'] != 0 and parameters['P2'] != 0:
+                formula = '{0}(((X-{P7})*{P6}-{P3})/{P1})/{P2}'.format(function, **p)
+            elif parameters['P1'] == 0 and parameters['P4'] != 0 and parameters['P5'] != 0:
+                formula = '{0}(({P3}/(X-{P7})-{P6})/{P4})/{P5}'.format(function, **p)
+            else:
+                warn('Non possible exponential or logarithmic conversion parameters, conversion ignored')
+                return 0, pointer
+        link, pointer = _write_text4(out, pointer, formula, texts)
+        references = [link]
+    elif cc_type == 11:  # text table
+        new_type = 7
+        for pair in range(len(parameters)):
+            values.append(parameters[pair]['int'])
+            link, pointer = _write_text4(out, pointer, parameters[pair]['text'], texts)
+            references.append(link)
+        references.append(0)  # no default text
+    elif cc_type == 12:  # text range table, first pair being default
+        new_type = 8
+        for pair in range(1, len(parameters)):
+            values.extend((parameters[pair]['lowerRange'], parameters[pair]['upperRange']))
+            link, pointer = _write_text4(out, pointer, parameters[pair]['Textrange'], texts)
+            references.append(link)
+        link, pointer = _write_text4(out, pointer, parameters[0]['Textrange'] if parameters else '', texts)
+        references.append(link)
+    else:
+        if cc_type != 65535:
+            warn('Conversion type {} can not be converted to mdf 4.x, conversion ignored'.format(cc_type))
+        return 0, pointer
+    flags = 0b10 if conversion.get('valueRangeKnown') else 0  # physical range valid
+    data = b''.join([_CCStruct2.pack(new_type, 0, flags, len(references), len(values),
+                                     conversion.get('valueRangeMinimum', 0.0),
+                                     conversion.get('valueRangeMaximum', 0.0)),
+                     pack('<{}d'.format(len(values)), *values)])
+    cc_pointer = pointer
+    pointer = _write_block4(out, pointer, b'##CC', [0, 0, 0, 0] + references, data)
+    return cc_pointer, pointer
+
+
+def _hd_start_time(hd_block):
+    """ computes start time of recording from mdf 3.x header
+
+    Parameters
+    ----------------
+    hd_block : dict
+        mdfinfo3 HDBlock dict
+
+    Returns
+    -----------
+    tuple of start time in ns, time zone offset in minutes and mdf 4.x time flags
+    """
+    if hd_block.get('TimeStamp'):  # local time stamp and UTC offset in hours since version 3.2
+        return (hd_block['TimeStamp'] - hd_block['UTCTimeOffset'] * 3600000000000,
+                hd_block['UTCTimeOffset'] * 60, 0b10)
+    try:
+        start = datetime.strptime(' '.join([hd_block['Date'], hd_block['Time']]), '%d:%m:%Y %H:%M:%S')
+    except ValueError:
+        warn('Unexpected recording date {} and time {}'.format(hd_block['Date'], hd_block['Time']))
+        return 0, 0, 0b1
+    return timegm(start.timetuple()) * 1000000000, 0, 0b1  # local time
+
+
+def convert3to4(file_name, output_file_name=None, compression=False):
+    """ converts mdf 3.x file into mdf 4.x file, records being copied raw
+
+    Parameters
+    ----------------
+    file_name : str
+        name of mdf 3.x file
+    output_file_name : str, optional
+        name of written file, by default file name with '.mf4' extension
+    compression : bool, optional
+        flag to write DZ blocks
+
+    Returns
+    -----------
+    output file name
+
+    Notes
+    --------
+    Data groups with two record IDs (before and after each record) can not be described in mdf 4.x,
+    they are not converted and file can be sorted first with sort_mdf.
+    Date and time conversions are ignored, other conversions are mapped onto their mdf 4.x equivalent,
+    polynomial, exponential and logarithmic conversions being expressed as rational or formula.
+
+    Examples
+    --------------
+    >>> from mdfreader import convert3to4
+    >>> convert3to4('file.dat', 'file.mf4', compression=True)
+    """
+    if output_file_name is None:
+        output_file_name = ''.join([splitext(file_name)[0], '.mf4'])
+    info = Info3(file_name)
+    if info['IDBlock']['ByteOrder']:
+        data_types = dict(convertDataType3to4, **_big_endian_data_types)
+    else:
+        data_types = convertDataType3to4
+    with open(file_name, 'rb') as fid, open(output_file_name, 'wb') as out:
+        id_block = IDBlock()
+        id_block['id_vers'] = b'4.10    '
+        id_block['id_ver'] = 410
+        id_block.write(out)
+        texts = dict()
+        sources = dict()
+        pointer = 64 + 104  # HD block written at the end
+
+        # header and file history comments
+        hd_block = info['HDBlock']
+        comment = CommentBlock()
+        comment.load({'comment': hd_block.get('TXBlock') or '', 'subject': hd_block['Subject'],
+                      'project': hd_block['ProjectName'], 'organisation': hd_block['Organization'],
+                      'author': hd_block['Author']}, 'HD')
+        hd_md_comment = pointer
+        out.seek(pointer)
+        comment.write(out)
+        pointer = _calculate_block_start(pointer + comment['block_length'])
+        comment = CommentBlock()
+        comment.load({'comment': 'converted from mdf 3.x file {}'.format(file_name)}, 'FH')
+        fh_block = FHBlock()
+        fh_block['block_start'] = pointer
+        fh_block['MD'] = pointer + 56
+        fh_block.write(out)
+        comment.write(out)
+        pointer = _calculate_block_start(fh_block['MD'] + comment['block_length'])
+
+        dg_pointers = []
+        for dg in range(len(info['DGBlock'])):
+            dg_block = info['DGBlock'][dg]
+            if dg_block['numberOfRecordIDs'] > 1:
+                warn('data group {} has record IDs before and after records, not converted, '
+                     'file can be sorted first with sort_mdf'.format(dg))
+                continue
+            id_size = dg_block['numberOfRecordIDs']
+            cg_first = 0
+            data_length = 0
+            for cg in reversed(range(len(info['CGBlock'][dg]))):
+                cg_block = info['CGBlock'][dg][cg]
+                data_length += (id_size + cg_block['dataRecordSize']) * cg_block['numberOfRecords']
+                cn_first = 0
+                for cn in reversed(range(len(info['CNBlock'][dg][cg]))):
+                    cn_block = info['CNBlock'][dg][cg][cn]
+                    cc_block = info['CCBlock'][dg][cg][cn]
+                    # original name, device name being written as source
+                    name = cn_block['orig_name']
+                    if cn_block['pointerToASAMNameBlock']:
+                        long_name = read_tx_block(fid, cn_block['pointerToASAMNameBlock'])
+                        if len(long_name) > len(name):
+                            name = long_name
+                    name = name.split('\\')
+                    si_pointer = 0
+                    if len(name) > 1 and name[1]:
+                        if name[1] not in sources:
+                            tx_pointer, pointer = _write_text4(out, pointer, name[1], texts)
+                            sources[name[1]] = pointer
+                            pointer = _write_block4(out, pointer, b'##SI', [tx_pointer, 0, 0],
+                                                    pack('<3B5s', 1, 0, 0, b'\0' * 5))  # ECU source
+                        si_pointer = sources[name[1]]
+                    tx_name, pointer = _write_text4(out, pointer, name[0], texts)
+                    tx_unit, pointer = _write_text4(out, pointer, cc_block.get('physicalUnit', ''), texts)
+                    description = cn_block['signalDescription'] or cn_block['ChannelCommentBlock']
+                    tx_comment, pointer = _write_text4(out, pointer, description, texts)
+                    cc_pointer, pointer = _write_conversion4(out, pointer, cc_block, texts)
+                    if cn_block['BlockSize'] >= 228:  # additional byte offset since version 3.0
+                        byte_offset = cn_block['ByteOffset']
+                    else:
+                        byte_offset = 0
+                    if cn_block['signalDataType'] not in data_types:
+                        warn('channel {} data type {} not supported, written as byte array'
+                             .format(name[0], cn_block['signalDataType']))
+                    data = pack('<4B4I2BH6d',
+                                2 if cn_block['channelType'] else 0,  # master channel
+                                1 if cn_block['channelType'] else 0,  # time synchronisation
+                                data_types.get(cn_block['signalDataType'], 10),
+                                cn_block['numberOfTheFirstBits'] % 8,
+                                byte_offset + cn_block['numberOfTheFirstBits'] // 8,
+                                cn_block['numberOfBits'],
+                                0b1000 if cn_block['valueRangeKnown'] else 0,  # value range valid
+                                0, 0, 0, 0,
+                                cn_block['valueRangeMinimum'], cn_block['valueRangeMaximum'],
+                                0, 0, 0, 0)
+                    cn_pointer = pointer
+                    pointer = _write_block4(out, pointer, b'##CN', [cn_first, 0, tx_name, si_pointer, cc_pointer, 0,
+                                                                   tx_unit, tx_comment], data)
+                    cn_first = cn_pointer
+                tx_comment, pointer = _write_text4(out, pointer, cg_block.get('TXBlock'), texts)
+                data = _CGStruct2.pack(cg_block['recordID'] if id_size else 0, cg_block['numberOfRecords'],
+                                       0, 0, 0, cg_block['dataRecordSize'], 0)
+                cg_pointer = pointer
+                pointer = _write_block4(out, pointer, b'##CG', [cg_first, cn_first, 0, 0, 0, tx_comment], data)
+                cg_first = cg_pointer
+
+            # records copied raw
+            if id_size or not info['CGBlock'][dg]:
+                record_length = 0  # no transposition of unsorted records
+                chunk_size = chunk_size_writing
+            else:
+                record_length = info['CGBlock'][dg][0]['dataRecordSize']
+                chunk_size = max(chunk_size_writing // max(record_length, 1), 1) * max(record_length, 1)
+            data_pointer, pointer = _write_data_blocks4(out, pointer,
+                                                        _read_records3(fid, dg_block['pointerToDataRecords'],
+                                                                       data_length, chunk_size),
+                                                        record_length, compression)
+            dg_pointers.append(pointer)
+            out.seek(pointer)
+            out.write(_DGStruct.pack(b'##DG', 0, 64, 4, 0, cg_first, data_pointer, 0, id_size, b'\x00' * 7))
+            pointer += 64
+
+        # data groups chain and header
+        for dg_pointer, next_dg_pointer in zip(dg_pointers, dg_pointers[1:]):
+            out.seek(dg_pointer + 24)
+            out.write(pack('<Q', next_dg_pointer))
+        start_time, tz_offset, time_flags = _hd_start_time(hd_block)
+        out.seek(64)
+        out.write(pack('<4sI2Q7Q2h3Bs2d', b'##HD', 0, 104, 6,
+                       dg_pointers[0] if dg_pointers else 0, fh_block['block_start'], 0, 0, 0, hd_md_comment,
+                       start_time, tz_offset, 0, time_flags, 0, 0, b'\0', 0, 0))
+    return output_file_name
+
+
+def _read_records3(fid, pointer, length, chunk_size):
+    """ reads mdf 3.x records chunk by chunk
+
+    Parameters
+    ----------------
+    fid
+        file identifier
+    pointer : int
+        records position
+    length : int
+        records length in bytes
+    chunk_size : int
+        chunks size in bytes
+
+    Returns
+    -----------
+    generator of bytes
+    """
+    if not pointer:
+        return
+    fid.seek(pointer)
+    while length > 0:
+        chunk = fid.read(min(chunk_size, length))
+        if not chunk:
+            warn('data block of {} bytes missing at end of file'.format(length))
+            return
+        length -= len(chunk)
+        yield chunk
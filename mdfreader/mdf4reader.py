@@ -24,16 +24,18 @@ from math import pow
 from io import open
 from os.path import splitext
 from time import gmtime, localtime
-from multiprocessing import Queue, Process
+from multiprocessing import cpu_count
+from concurrent.futures import ThreadPoolExecutor
 from sys import byteorder
 from collections import defaultdict, OrderedDict
 import numpy as np
 if np.lib.NumpyVersion(np.__version__) >= '2.0.0b1':
-    from numpy.rec import fromstring, fromarrays
+    from numpy.rec import fromstring
 else:
-    from numpy.core.records import fromstring, fromarrays
+    from numpy.core.records import fromstring
 from numpy import array, recarray, asarray, empty, where, frombuffer, reshape
 from numpy import arange, right_shift, bitwise_and, all, diff, interp, zeros, concatenate
+from numpy import bitwise_or, unpackbits, packbits, flatnonzero
 from numpy import issubdtype, number as numpy_number
 from numpy import max as npmax, min as npmin
 from numpy.lib.recfunctions import rename_fields
@@ -41,9 +43,10 @@ from numpy.ma import MaskedArray
 from warnings import simplefilter, warn
 from .mdfinfo4 import Info4, IDBlock, HDBlock, DGBlock, \
     CGBlock, CNBlock, FHBlock, CommentBlock, _load_header, DLBlock, \
-    DZBlock, HLBlock, CCBlock, DTBlock, CABlock, DVBlock, LDBlock
+    DZBlock, HLBlock, CCBlock, DTBlock, CABlock, DVBlock, LDBlock, _calculate_block_start
 from .mdf import MdfSkeleton, _open_mdf, invalidChannel, dataField, \
-    conversionField, idField, invalidPosField, CompressedData
+    conversionField, idField, invalidPosField, CompressedData, ScaledData, RangeData, RunData, BitData, \
+    _chunked_conversion, _interleave_records, _record_chunks, _BitFieldColumn
 from .channel import Channel4
 try:
     from dataRead import sorted_data_read, unsorted_data_read4, sd_data_read
@@ -54,6 +57,7 @@ except ImportError:
 
 chunk_size_reading = 100000000  # reads by chunk of 100Mb, can be tuned for best performance
 _VLSDStruct = Struct('I')
+invalidBitmapsField = 'invalid_bitmaps'  # InvalidBitmaps cached in invalid bytes channel
 
 
 def _data_block(record, info, parent_block, channel_set=None, n_records=None, sorted_flag=True, vlsd=None):
@@ -292,6 +296,69 @@ def _read_sd_block(signal_data_type, sd_block, sd_block_length, n_records, point
         return None
 
 
+class InvalidBitmaps(object):
+    __slots__ = ['source', 'n_records', 'packed', 'columns']
+    """ invalidation bits of a data group, extracted in one pass and kept packed
+
+    Bytes holding at least one invalid bit are unpacked at once, bits of each used position are then
+    packed along records. Positions without any invalid sample are not stored.
+
+    Attributes
+    --------------
+    source : numpy 2D array of uint8
+        invalid bytes of data group, one row per record, bitmaps are computed from it
+    n_records : int
+        number of records
+    packed : numpy 2D array of uint8
+        bits packed along records, one column per invalid bit position having invalid samples
+    columns : dict
+        column in packed of each invalid bit position having invalid samples
+    """
+
+    def __init__(self, invalid_bytes):
+        """ extracts invalidation bits
+
+        Parameters
+        ----------------
+        invalid_bytes : numpy 2D array of uint8
+            invalid bytes of data group, one row per record
+        """
+        self.source = invalid_bytes
+        self.n_records = invalid_bytes.shape[0]
+        self.packed = None
+        self.columns = dict()
+        if self.n_records:
+            used_bytes = flatnonzero(bitwise_or.reduce(invalid_bytes, axis=0))
+            if len(used_bytes):  # otherwise all samples are valid
+                bits = unpackbits(invalid_bytes[:, used_bytes], axis=1, bitorder='little')
+                positions = (used_bytes[:, None] * 8 + arange(8)).ravel()
+                used_bits = flatnonzero(bits.any(axis=0))
+                self.packed = packbits(bits[:, used_bits], axis=0, bitorder='little')
+                self.columns = {int(positions[column]): index for index, column in enumerate(used_bits)}
+
+    def all_valid(self):
+        """ True if no invalid bit is set in data group
+        """
+        return not self.columns
+
+    def mask(self, bit_position):
+        """ boolean mask of invalid samples
+
+        Parameters
+        ----------------
+        bit_position : int
+            invalid bit position of channel
+
+        Returns
+        -----------
+        numpy boolean array, None if all samples are valid
+        """
+        column = self.columns.get(bit_position)
+        if column is None:
+            return None
+        return unpackbits(self.packed[:, column], count=self.n_records, bitorder='little').view(bool)
+
+
 class Data(dict):
     __slots__ = ['fid', 'pointer_to_data', 'type']
     """ Data class is organizing record classes itself made of channel class.
@@ -1231,7 +1298,7 @@ class Mdf4(MdfSkeleton):
         One key or master channel represents then a data group having same sampling interval.
     multiProc : bool
         Flag to request channel conversion multi processed for performance improvement.
-        One thread per data group.
+        Channels are converted in batches by a bounded thread pool.
     convertAfterRead : bool
         flag to convert raw data to physical just after read
     filterChannelNames : bool
@@ -1439,8 +1506,9 @@ class Mdf4(MdfSkeleton):
                                                 temp = buf[record_id]['VLSD'][record_name]
                                             except:
                                                 temp = None
-                                        else:  # virtual channel
-                                            temp = arange(buf[record_id]['record'].numberOfRecords)
+                                        else:  # virtual channel, record index kept as range
+                                            temp = RangeData(0, 1, buf[record_id]['record'].numberOfRecords,
+                                                             dtype='int64')
 
                                         # Process concatenated bits inside uint8
                                         bit_count = chan.bit_count(info)
@@ -1470,6 +1538,9 @@ class Mdf4(MdfSkeleton):
                                             else:  # should not happen
                                                 warn('bit count and offset not applied to correct '
                                                      'data type {}'.format(chan.name))
+                                        if bit_count == 1 and temp is not None and temp.ndim == 1 \
+                                                and temp.dtype.kind in ('u', 'b'):
+                                            temp = BitData.from_array(temp)  # flag stored as packed bits
 
                                         if temp is not None:  # channel contains data
                                             # string data decoding
@@ -1542,7 +1613,7 @@ class Mdf4(MdfSkeleton):
             self._convert_all_channel4()
         # print( 'Finished in ' + str( time.clock() - inttime ) , file=stderr)
 
-    def _get_channel_data4(self, channel_name, raw_data=False):
+    def _get_channel_data4(self, channel_name, raw_data=False, lazy_conversion=False, dtype=None):
         """Returns channel numpy array
 
         Parameters
@@ -1551,6 +1622,10 @@ class Mdf4(MdfSkeleton):
             channel name
         raw_data: bool
             flag to return non converted data
+        lazy_conversion: bool
+            flag to return linear or rational converted data as ScaledData, keeping raw data storage
+        dtype : numpy dtype or str, optional
+            converted data precision policy: None, 'float32', 'float64' or 'keep' for raw integer dtype
 
         Returns
         -----------
@@ -1568,15 +1643,25 @@ class Mdf4(MdfSkeleton):
                     (self.info.fid, self.info.fileName, self.info.zipfile) = _open_mdf(self.fileName)
                 self.read4(file_name=None, info=None, channel_list=[channel_name], convert_after_read=False)
             if not raw_data:
-                return self._convert_channel_data4(self.get_channel(channel_name), channel_name,
-                                                   self.convertTables)[channel_name]
+                conversion = self.get_channel(channel_name).get(conversionField)
+                if lazy_conversion and conversion is not None and conversion['type'] in (1, 2):
+                    vector = self.get_channel(channel_name)[dataField]
+                    if isinstance(vector, CompressedData):
+                        vector = vector.decompression()
+                    if issubdtype(vector.dtype, numpy_number) and not isinstance(vector, (RangeData, RunData, BitData)):
+                        return ScaledData(vector, conversion['parameters']['cc_val'])
+                vector = self._convert_channel_data4(self.get_channel(channel_name), channel_name,
+                                                     self.convertTables, dtype=dtype)[channel_name]
             else:
-                return self.get_channel(channel_name)[dataField]
+                vector = self.get_channel(channel_name)[dataField]
+            if isinstance(vector, (RangeData, RunData, BitData)) and not lazy_conversion:
+                vector = vector.__array__()  # regularly sampled, slowly changing or 1 bit data stored compact
+            return vector
         else:
             return None
 
     @staticmethod
-    def _convert_channel_data4(channel, channel_name, convert_tables, multi_processed=False, q=None):
+    def _convert_channel_data4(channel, channel_name, convert_tables, dtype=None):
         """converts specific channel from raw to physical data according to CCBlock information
 
         Parameters
@@ -1587,10 +1672,9 @@ class Mdf4(MdfSkeleton):
             name of channel
         convert_tables : bool
             activates computation intensive loops for conversion with tables. Default is False
-        multi_processed : bool, default False
-            flag to put data in multiprocess queue
-        q : Queue class, default None
-            Queue used for multiprocessing
+        dtype : numpy dtype or str, optional
+            output precision policy for linear, rational and interpolation conversions, converted by chunks:
+            None (default, mostly float64), 'float32', 'float64' or 'keep' to keep raw integer dtype
 
         Returns
         -----------
@@ -1605,18 +1689,34 @@ class Mdf4(MdfSkeleton):
                 vector = channel[dataField].decompression()  # uncompressed blosc data
             else:
                 vector = channel[dataField][:]  # to have bcolz uncompressed data
-        if conversionField in channel and channel[conversionField]['type']:  # there is conversion property
+        bits = None
+        if isinstance(vector, BitData) and conversionField in channel and channel[conversionField]['type']:
+            bits, vector = vector, vector.__array__()  # converted values are not bits
+            unpacked = vector
+        if isinstance(vector, RunData) and conversionField in channel and channel[conversionField]['type']:
+            # conversion applied on runs values only
+            values = Mdf4._convert_channel_data4({dataField: vector.values, conversionField: channel[conversionField]},
+                                                 channel_name, convert_tables, dtype=dtype)[channel_name]
+            vector = vector.with_values(values)
+        elif conversionField in channel and channel[conversionField]['type']:  # there is conversion property
             text_type = vector.dtype.kind in ['S', 'U', 'V']  # channel of string or not ?
             conversion_type = channel[conversionField]['type']
             conversion_parameter = channel[conversionField]['parameters']
-            if conversion_type == 1 and not text_type:
-                vector = _linear_conversion(vector, conversion_parameter['cc_val'])
+            if conversion_type == 1 and not text_type and isinstance(vector, RangeData) and dtype is None:
+                vector = vector.linear(conversion_parameter['cc_val'][0], conversion_parameter['cc_val'][1])
+            elif conversion_type == 1 and not text_type:
+                vector = _chunked_conversion(vector, lambda v: _linear_conversion(v, conversion_parameter['cc_val']),
+                                             dtype)
             elif conversion_type == 2 and not text_type:
-                vector = _rational_conversion(vector, conversion_parameter['cc_val'])
+                vector = _chunked_conversion(vector,
+                                             lambda v: _rational_conversion(v, conversion_parameter['cc_val']),
+                                             dtype)
             elif conversion_type == 3 and not text_type:
                 vector = _formula_conversion(vector, conversion_parameter['cc_ref']['Comment'])
             elif conversion_type == 4 and not text_type:
-                vector = _value_to_value_table_with_interpolation_conversion(vector, conversion_parameter['cc_val'])
+                vector = _chunked_conversion(vector,
+                                             lambda v: _value_to_value_table_with_interpolation_conversion(
+                                                 v, conversion_parameter['cc_val']), dtype)
             elif conversion_type == 5 and not text_type:
                 vector = _value_to_value_table_without_interpolation_conversion(vector, conversion_parameter['cc_val'])
             elif conversion_type == 6 and not text_type and convert_tables:
@@ -1635,57 +1735,91 @@ class Mdf4(MdfSkeleton):
             elif conversion_type == 11 and text_type and convert_tables:
                 vector = _bitfield_text_table_conversion(vector, conversion_parameter['cc_val'],
                                                          conversion_parameter['cc_ref'])
+        if bits is not None and vector is unpacked:  # not converted, kept packed
+            vector = bits
         L = dict()
         L[channel_name] = vector
-        if multi_processed:
-            q.put(L)
-        else:
-            return L
+        return L
 
-    def _convert_channel4(self, channel_name):
+    def _convert_channel4(self, channel_name, dtype=None):
         """converts specific channel from raw to physical data according to CCBlock information
 
         Parameters
         ----------------
         channel_name : str
             Name of channel
+        dtype : numpy dtype or str, optional
+            converted data precision policy: None, 'float32', 'float64' or 'keep' for raw integer dtype
         """
-        self.set_channel_data(channel_name, self._get_channel_data4(channel_name))
+        # data stored as range or runs is kept compact
+        compact = isinstance(self.get_channel(channel_name)[dataField], (RangeData, RunData, BitData))
+        self.set_channel_data(channel_name, self._get_channel_data4(channel_name, lazy_conversion=compact,
+                                                                    dtype=dtype))
         self.remove_channel_conversion(channel_name)
 
-    def _convert_all_channel4(self):
+    def _convert_all_channel4(self, dtype=None):
         """Converts all channels from raw data to converted data according to CCBlock information
         Converted data will take more memory.
+
+        Parameters
+        ----------------
+        dtype : numpy dtype or str, optional
+            converted data precision policy: None, 'float32', 'float64' or 'keep' for raw integer dtype
         """
 
         if self._noDataLoading:  # no data loaded, load everything
             self.read4(self.fileName, convert_after_read=True)
         else:
             if self.multiProc is False:
-                [self._convert_channel4(channelName) for channelName in self]
-            else:  # multiprocessing
-                proc = []
-                Q = Queue()
-                L = {}
+                [self._convert_channel4(channelName, dtype) for channelName in self]
+            else:  # pooled conversion
+                # group channels by conversion type so each task runs the same kernel
+                by_type = defaultdict(list)
                 for channelName in self:
                     channel = self.get_channel(channelName)
-                    if 'conversion' in channel:
-                        conversion = self.get_channel_conversion(channelName)
-                        if conversion['type'] in (1, 2):  # more time in multi proc
-                            self._convert_channel4(channelName)
-                        else:
-                            proc.append(Process(target=self._convert_channel_data4,
-                                                args=(channel, channelName, self.convertTables, True, Q)))
-                            proc[-1].start()
-                for p in proc:
-                    L.update(Q.get())  # concatenate results of processes in dict
-                for p in proc:
-                    p.join()
-                del Q  # free memory
-                for channelName in self:
-                    if channelName in L:
-                        self.set_channel_data(channelName, L[channelName])
-                        self.remove_channel_conversion(channelName)
+                    if isinstance(channel[dataField], (RangeData, RunData, BitData)):
+                        self._convert_channel4(channelName, dtype)  # kept compact like serial conversion
+                    elif conversionField in channel and channel[conversionField]['type']:
+                        by_type[channel[conversionField]['type']].append(channelName)
+                n_workers = cpu_count() or 1
+                batches = []
+                for conversion_type in sorted(by_type):
+                    names = by_type[conversion_type]
+                    # a few batches per worker to balance load without task overhead per channel
+                    batch_size = max(1, -(-len(names) // (4 * n_workers)))
+                    batches.extend(names[i:i + batch_size] for i in range(0, len(names), batch_size))
+                # numpy kernels release the GIL, threads share arrays without pickling
+                with ThreadPoolExecutor(max_workers=n_workers) as pool:
+                    results = pool.map(self._convert_batch4,
+                                       [[(self.get_channel(name), name) for name in batch] for batch in batches],
+                                       [self.convertTables] * len(batches), [dtype] * len(batches))
+                    for L in results:
+                        for channelName in L:
+                            self.set_channel_data(channelName, L[channelName])
+                            self.remove_channel_conversion(channelName)
+
+    @staticmethod
+    def _convert_batch4(batch, convert_tables, dtype=None):
+        """converts a batch of channels sharing the same conversion type
+
+        Parameters
+        ----------------
+        batch : list of tuple
+            list of (channel, channel_name)
+        convert_tables : bool
+            activates computation intensive loops for conversion with tables
+        dtype : numpy dtype or str, optional
+            converted data precision policy: None, 'float32', 'float64' or 'keep' for raw integer dtype
+
+        Returns
+        -----------
+        dict
+            channel name keys with converted numpy arrays
+        """
+        L = dict()
+        for channel, channel_name in batch:
+            L.update(Mdf4._convert_channel_data4(channel, channel_name, convert_tables, dtype=dtype))
+        return L
 
     def write4(self, file_name=None, compression=False, column_oriented=False):
         """Writes simple mdf file
@@ -1797,22 +1931,198 @@ class Mdf4(MdfSkeleton):
                 self._write4_non_column(fid, pointer, compression)
         fid.close()
 
-    def _write4_non_column(self, fid, pointer, compression=False):
+    def append4(self, file_name=None, master_channels=None, compression=False):
+        """Appends data groups at end of existing mdf 4.x file
+
+        New DG, CG, CN and data blocks are written after end of file and last data group of file is
+        linked to them, all existing blocks are left untouched.
+
+        Parameters
+        ----------------
+        file_name : str, optional
+            Name of existing mdf 4.x file, by default the one read
+        master_channels : list of str, optional
+            master channels of data groups to be appended, by default data groups having
+            none of their channels already in file
+        compression : bool
+            flag to store data compressed, not possible for file version older than 4.1
+
+        Notes
+        --------
+        Channels of appended data groups are converted to physical data, other channels are left untouched
+        """
+        if file_name is None:
+            file_name = self.fileName
+        if master_channels is None:
+            info = Info4(file_name, None, minimal=1)  # reads only blocks metadata, not data
+            file_channels = set(info['CN'][dg][cg][cn]['name'] for dg in info['CN']
+                                for cg in info['CN'][dg] for cn in info['CN'][dg][cg])
+            master_channels = []
+            for master, channels in self.masterChannelList.items():
+                in_file = file_channels.intersection(channels)
+                if not in_file:
+                    master_channels.append(master)
+                elif len(in_file) < len(channels):
+                    warn('data group of master channel {} is partly in file {}, not appended, '
+                         'use master_channels to append it anyway'.format(master, file_name))
+        for master in master_channels:
+            for channel in self.masterChannelList[master]:
+                if conversionField in self[channel]:
+                    self._convert_channel4(channel)
+        fid = open(file_name, 'r+b')
+        try:
+            id_block = IDBlock(fid)
+            if id_block['id_file'][:3] != b'MDF' or id_block['id_ver'] < 400:
+                raise Exception('{} is not a mdf 4.x file'.format(file_name))
+            if b'UnFin' in id_block['id_file']:
+                raise Exception('{} is not finalised, can not append data groups'.format(file_name))
+            if compression and id_block['id_ver'] < 410:
+                warn('DZ blocks not allowed in mdf version {}, data not compressed'.format(id_block['id_ver']))
+                compression = False
+            # finds link to be updated, next DG of last data group or first DG of header
+            link_position = 64 + 24
+            fid.seek(link_position)
+            (next_dg,) = structunpack('<Q', fid.read(8))
+            while next_dg:
+                link_position = next_dg + 24
+                fid.seek(link_position)
+                (next_dg,) = structunpack('<Q', fid.read(8))
+            fid.seek(0, 2)
+            pointer = _calculate_block_start(fid.tell())
+            if self._write4_non_column(fid, pointer, compression, master_channels) > pointer:
+                # new data groups linked only once completely written
+                fid.seek(link_position)
+                fid.write(pack('<Q', pointer))
+        finally:
+            fid.close()
+
+    def patch4(self, file_name=None, names=None, units=None, descriptions=None, file_metadata=None):
+        """Modifies metadata of existing mdf 4.x file in place without rewriting data
+
+        New TX or MD blocks are written at end of file and only links to them are updated
+        (cn_tx_name, cn_md_unit, cn_md_comment and hd_md_comment), old blocks are left orphan.
+        Changes are also applied to channels and metadata in memory.
+
+        Parameters
+        ----------------
+        file_name : str, optional
+            Name of existing mdf 4.x file, by default the one read
+        names : dict, optional
+            new channel names by channel name
+        units : dict, optional
+            new channel units by channel name
+        descriptions : dict, optional
+            new channel descriptions by channel name
+        file_metadata : dict, optional
+            new file metadata with keys author, organisation, project, subject or comment,
+            missing keys are taken from fileMetadata
+
+        Examples
+        --------------
+        >>> yop = Mdf('file.mf4', no_data_loading=True)
+        >>> yop.patch4(names={'ENGSPD': 'EngineSpeed'}, units={'EngineSpeed': 'rpm'})
+        """
+        if file_name is None:
+            file_name = self.fileName
+        names = names or {}
+        units = units or {}
+        descriptions = descriptions or {}
+        metadata = dict(self.fileMetadata)
+        if file_metadata is not None:
+            metadata.update(file_metadata)
+
+        fid = open(file_name, 'r+b')
+        try:
+            id_block = IDBlock(fid)
+            if id_block['id_file'][:3] != b'MDF' or id_block['id_ver'] < 400:
+                raise Exception('{} is not a mdf 4.x file'.format(file_name))
+            # list of new text blocks and positions of links to them, channel names are the ones in file
+            patches = []
+            if names or units or descriptions:
+                info = Info4(file_name, None, minimal=1)  # reads only blocks metadata, not data
+                found = set()
+                for dg in info['CN']:
+                    for cg in info['CN'][dg]:
+                        for cn in info['CN'][dg][cg]:
+                            cn_block = info['CN'][dg][cg][cn]
+                            name = cn_block['name']
+                            if name in names:
+                                patches.append((cn_block['pointer'] + 40, names[name], 'TX'))
+                            for channel in (name, names.get(name, name)):
+                                if channel in units:
+                                    patches.append((cn_block['pointer'] + 72, units[channel], 'TX'))
+                                    break
+                            for channel in (name, names.get(name, name)):
+                                if channel in descriptions:
+                                    patches.append((cn_block['pointer'] + 80, descriptions[channel], 'TX'))
+                                    break
+                            found.add(name)
+                            found.add(names.get(name, name))
+                for channel in set(names).union(units, descriptions).difference(found):
+                    warn('{} channel not found in file {}'.format(channel, file_name))
+            if file_metadata is not None:
+                patches.append((64 + 64, metadata, 'HD'))
+
+            if patches:
+                fid.seek(0, 2)
+                pointer = _calculate_block_start(fid.tell())
+                links = []
+                for link_position, text, md_type in patches:
+                    block = CommentBlock()
+                    block.load(text, md_type)
+                    fid.seek(pointer)
+                    block.write(fid)
+                    links.append((link_position, pointer))
+                    pointer += block['block_length']
+                # links updated only once new blocks are completely written
+                for link_position, block_start in links:
+                    fid.seek(link_position)
+                    fid.write(pack('<Q', block_start))
+        finally:
+            fid.close()
+
+        # changes in memory, once file patched
+        for channel, new_name in names.items():
+            if channel in self:
+                self.rename_channel(channel, new_name)
+        for channel, unit in units.items():
+            if channel in self:
+                self.set_channel_unit(channel, unit)
+        for channel, desc in descriptions.items():
+            if channel in self:
+                self.set_channel_desc(channel, desc)
+        if file_metadata is not None:
+            self.fileMetadata.update(file_metadata)
+        if self._noDataLoading and names and file_name == self.fileName:
+            # channels loaded on demand are found by their names in file info
+            self.info = Info4(file_name, None, filter_channel_names=self.filterChannelNames, minimal=1)
+
+    def _write4_non_column(self, fid, pointer, compression=False, master_channels=None):
         """Writes simple mdf 4.1 file with sorted data
 
         Parameters
         ----------------
         fid
             file identifier
+        pointer : int
+            position of first data group
         compression : bool
             flag to store data compressed
+        master_channels : list of str, optional
+            master channels of data groups to be written, by default all data groups
+
+        Returns
+        -----------
+        position of next block after last written data group
 
         Notes
         --------
         All channels will be converted to physical data, so size might be bigger than original file
         """
-
-        for dataGroup, masterChannel in enumerate(self.masterChannelList):
+        if master_channels is None:
+            master_channels = list(self.masterChannelList)
+        dg = None
+        for dataGroup, masterChannel in enumerate(master_channels):
             # writes dataGroup Block
             dg = DGBlock()
             dg['block_start'] = pointer
@@ -1847,11 +2157,14 @@ class Mdf4(MdfSkeleton):
             record_byte_offset = 0
             cn_flag = 0
             n_records = 0
-            data_list = ()
+            columns = []
             last_channel = 0
             previous_n_channel = 0
+            bit_field = None  # record byte shared by consecutive 1 bit channels
             for n_channel, channel in enumerate(self.masterChannelList[masterChannel]):
-                data = self.get_channel_data(channel)
+                data = self.get_channel(channel)[dataField]
+                if not isinstance(data, BitData) or self.get_channel(channel).get(conversionField) is not None:
+                    data = self.get_channel_data(channel)
                 # no interest to write invalid bytes as channel, should be processed if needed before writing
                 if channel.find('invalid_bytes') == -1 and data is not None and len(data) > 0:
                     byte_count = data.dtype.itemsize
@@ -1860,25 +2173,36 @@ class Mdf4(MdfSkeleton):
 
                     last_channel = n_channel
                     data_ndim = data.ndim - 1
-                    if not data_ndim:
-                        data_list = data_list + (data, )
+                    if isinstance(data, BitData):  # packed bits written as bits of shared record bytes
+                        if bit_field is None or len(bit_field.bits) == 8:
+                            bit_field = _BitFieldColumn(len(data))
+                            bit_field_offset = record_byte_offset
+                            columns.append(bit_field)
+                            record_byte_offset += 1
+                        blocks[n_channel]['cn_byte_offset'] = bit_field_offset
+                        bit_offset = len(bit_field.bits)
+                        bit_field.bits.append(data)
+                    elif not data_ndim:
+                        bit_field = None
+                        columns.append(data)
                         record_byte_offset += byte_count
-                    else:  # data contains arrays
+                    else:  # data contains arrays, interleaved as record sub-arrays
+                        bit_field = None
+                        columns.append(data)
                         data_dim_size = data.shape
                         if not cg_cycle_count == data_dim_size[0]:
                             warn('Array length do not match number of cycled in CG block')
                         data_dim_size = data_dim_size[1:]
-                        SNd = 0
                         PNd = 1
                         for x in data_dim_size:
-                            SNd += x
                             PNd *= x
-                        flattened = reshape(data, (cg_cycle_count, PNd))
-                        for i in range(PNd):
-                            data_list = data_list + (flattened[:, i],)
                         record_byte_offset += byte_count * PNd
 
-                    if issubdtype(data.dtype, numpy_number):  # is numeric
+                    if isinstance(data, BitData):
+                        blocks[n_channel]['cn_val_range_min'] = 0
+                        blocks[n_channel]['cn_val_range_max'] = 1
+                        blocks[n_channel]['cn_flags'] = 8  # only Bit 3: Limit range valid flag
+                    elif issubdtype(data.dtype, numpy_number):  # is numeric
                         blocks[n_channel]['cn_val_range_min'] = npmin(data)
                         blocks[n_channel]['cn_val_range_max'] = npmax(data)
                         blocks[n_channel]['cn_flags'] = 8  # only Bit 3: Limit range valid flag
@@ -1911,9 +2235,12 @@ class Mdf4(MdfSkeleton):
                         warn('{} {} {}'.format(channel, data.dtype, cn_numpy_kind))
                         raise Exception('Not recognized dtype')
                     blocks[n_channel]['cn_data_type'] = data_type
-                    blocks[n_channel]['cn_bit_offset'] = 0  # always byte aligned
-
-                    blocks[n_channel]['cn_bit_count'] = byte_count * 8
+                    if isinstance(data, BitData):
+                        blocks[n_channel]['cn_bit_offset'] = bit_offset
+                        blocks[n_channel]['cn_bit_count'] = 1
+                    else:
+                        blocks[n_channel]['cn_bit_offset'] = 0  # byte aligned
+                        blocks[n_channel]['cn_bit_count'] = byte_count * 8
                     blocks[n_channel]['block_start'] = pointer
                     pointer = blocks[n_channel]['block_start'] + 160
 
@@ -1973,7 +2300,7 @@ class Mdf4(MdfSkeleton):
 
             if n_records == 0 and masterChannel is not self.masterChannelList[masterChannel]:
                 # No master channel in channel group
-                n_records = len(data_list[0])
+                n_records = len(columns[0])
 
             if last_channel in blocks:
                 blocks[last_channel]['CN'] = 0  # last CN link is null
@@ -1985,7 +2312,6 @@ class Mdf4(MdfSkeleton):
             if compression:
                 data = HLBlock()
                 data.load(record_byte_offset, n_records, pointer)
-                dg_start_position = fid.tell()
                 dg['DG'] = 0
             else:
                 data = DTBlock()
@@ -1998,16 +2324,22 @@ class Mdf4(MdfSkeleton):
             for block in blocks.values():
                 block.write(fid)
 
-            # data block writing
-            pointer = data.write(fid, fromarrays(data_list).tobytes(order='F'))
+            # data block writing, records interleaved chunk by chunk into a reused buffer
+            if compression:
+                records = _interleave_records(columns, [n_record_chunk for n_record_chunk, _ in data['chunks']])
+            else:
+                records = _interleave_records(columns, _record_chunks(n_records, record_byte_offset))
+            pointer = data.write(fid, records)
             if compression:
                 # next DG position is not predictable due to DZ Blocks unknown length
-                fid.seek(dg_start_position + 24)
+                fid.seek(dg['block_start'] + 24)
                 fid.write(pack('<Q', pointer))
                 fid.seek(pointer)
 
-        fid.seek(dg['block_start'] + 24)
-        fid.write(pack('Q', 0))  # last DG pointer is null
+        if dg is not None:
+            fid.seek(dg['block_start'] + 24)
+            fid.write(pack('Q', 0))  # last DG pointer is null
+        return pointer
 
     def _write4_column(self, fid, pointer, cg_cycle_count, channel, master_channel_flag,
                        compression=False, cg_master_pointer=None):
@@ -2056,6 +2388,9 @@ class Mdf4(MdfSkeleton):
 
         # write channels
         data = self.get_channel_data(channel)
+        # packed bits written one per byte with bit count of 1 to be read back as packed bits
+        bit_channel = isinstance(self.get_channel(channel)[dataField], BitData) and \
+            self.get_channel(channel).get(conversionField) is None
         if self.get_invalid_channel(channel) or isinstance(data, MaskedArray):
             invalid_channel = True
             blocks['CG']['cg_inval_bytes'] = 1  # as column oriented, only one byte for DIBlock
@@ -2119,7 +2454,7 @@ class Mdf4(MdfSkeleton):
             blocks['CN']['cn_data_type'] = data_type
             blocks['CN']['cn_bit_offset'] = 0  # always byte aligned
             blocks['CN']['cn_byte_offset'] = 0  # only one channel
-            blocks['CN']['cn_bit_count'] = byte_count * 8
+            blocks['CN']['cn_bit_count'] = 1 if bit_channel else byte_count * 8
             blocks['CN']['block_start'] = pointer
             pointer = blocks['CN']['block_start'] + 160
             blocks['CN']['CN'] = 0  # creates first CN link, null for the moment
@@ -2177,7 +2512,6 @@ class Mdf4(MdfSkeleton):
                 data_blocks = LDBlock()
                 data_blocks.load(record_byte_offset, cg_cycle_count, pointer,
                                  invalid_bytes=blocks['CG']['cg_inval_bytes'], column_oriented_flag=True)
-                dg_start_position = fid.tell()
                 dg['DG'] = 0
             else:
                 data_blocks = DVBlock()
@@ -2206,7 +2540,7 @@ class Mdf4(MdfSkeleton):
 
             if compression or invalid_channel:
                 # next DG position is not predictable due to DZ Blocks unknown length
-                fid.seek(dg_start_position + 24)
+                fid.seek(dg['block_start'] + 24)
                 fid.write(pack('<Q', pointer))
                 fid.seek(pointer)
 
@@ -2221,10 +2555,12 @@ class Mdf4(MdfSkeleton):
             Name of channel
         """
         try:
-            data = self._get_channel_data4(channel_name)
-            data = data.view(MaskedArray)
-            data.mask = self.get_invalid_mask(channel_name)
-            self.set_channel_data(channel_name, data)
+            mask = self.get_invalid_mask(channel_name)
+            if mask is not None:  # otherwise all samples valid, data kept as it is
+                data = self._get_channel_data4(channel_name)
+                data = data.view(MaskedArray)
+                data.mask = mask
+                self.set_channel_data(channel_name, data)
             self._remove_channel_field(channel_name, invalidPosField)
             self._remove_channel_field(channel_name, invalidChannel)
         except KeyError:
@@ -2232,17 +2568,51 @@ class Mdf4(MdfSkeleton):
             # warn('no invalid data found for channel ')
 
     def get_invalid_mask(self, channel_name):
-        invalid_channel = self._get_channel_data4(self.get_invalid_channel(channel_name))
+        """ boolean mask of invalid samples of channel
+
+        Parameters
+        ----------------
+        channel_name : str
+            Name of channel
+
+        Returns
+        -----------
+        numpy boolean array, None if channel has no invalid bit or all its samples are valid
+        """
         invalid_bit_pos = self.get_invalid_bit(channel_name)
         if isinstance(invalid_bit_pos, int):  # invalid bit existing
-            invalid_byte = invalid_bit_pos >> 3
-            return bitwise_and(invalid_channel[:, invalid_byte], invalid_bit_pos & 0x07)
+            return self._get_invalid_bitmaps(self.get_invalid_channel(channel_name)).mask(invalid_bit_pos)
         else:
             return None
 
+    def _get_invalid_bitmaps(self, invalid_channel):
+        """ invalidation bitmaps of data group, computed once and cached in invalid bytes channel
+
+        Parameters
+        ----------------
+        invalid_channel : str
+            invalid bytes channel name
+
+        Returns
+        -----------
+        InvalidBitmaps
+        """
+        invalid_bytes = self.get_channel(invalid_channel)[dataField]
+        if invalid_bytes is None or isinstance(invalid_bytes, CompressedData):
+            invalid_bytes = self._get_channel_data4(invalid_channel, raw_data=True)
+            if isinstance(invalid_bytes, CompressedData):
+                invalid_bytes = invalid_bytes.decompression()
+        bitmaps = self[invalid_channel].get(invalidBitmapsField)
+        if bitmaps is None or bitmaps.source is not invalid_bytes:  # new or cut invalid bytes
+            bitmaps = InvalidBitmaps(invalid_bytes)
+            self[invalid_channel][invalidBitmapsField] = bitmaps
+        return bitmaps
+
     def apply_all_invalid_bit(self):
         """Mask data of all channels based on its invalid bit definition if there is
 
+        Invalid bits of each data group are extracted in one pass, channels without invalid
+        sample keep their data unmasked.
         """
         for master_channel in self.masterChannelList:
             group_channels = set(self.masterChannelList[master_channel])
@@ -2250,8 +2620,13 @@ class Mdf4(MdfSkeleton):
             invalid_channel = 'invalid_bytes{}'.format(group_number)
             if invalid_channel in group_channels:
                 # invalid bytes channel present in this data group
-                for channel_name in self.masterChannelList[master_channel]:
-                    self.apply_invalid_bit(channel_name)
+                if self._get_invalid_bitmaps(invalid_channel).all_valid():
+                    for channel_name in self.masterChannelList[master_channel]:
+                        self._remove_channel_field(channel_name, invalidPosField)
+                        self._remove_channel_field(channel_name, invalidChannel)
+                else:
+                    for channel_name in self.masterChannelList[master_channel]:
+                        self.apply_invalid_bit(channel_name)
                 # remove invalid bytes channel, redundant
                 self.masterChannelList[master_channel].remove(invalid_channel)
                 self.pop(invalid_channel)
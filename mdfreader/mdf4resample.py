@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+""" Measured Data Format streaming resampling for version 4.x
+
+:Author: `Aymeric Rateau <https://github.com/ratal/mdfreader>`__
+
+Resamples all data groups of a file on a common master channel without loading it in memory.
+Data groups are read in parallel by chunks of records, ordered by master channel, only the
+samples needed to interpolate the next chunk are carried over so memory is proportional to
+chunk length and number of channels, not to recording length.
+
+Dependencies
+-------------------
+- Python >3.4 <http://www.python.org>
+- Numpy >1.14 <http://numpy.scipy.org>
+
+mdf4resample
+--------------------------
+"""
+from io import open
+from os.path import splitext
+from collections import OrderedDict
+from warnings import warn
+from numpy import frombuffer, concatenate, searchsorted, empty, arange
+from .mdfinfo4 import Info4
+from .mdf4reader import Mdf4
+from .mdf4writer import Mdf4Writer
+from .mdf4tools import _data_blocks4, _rechunk, _raw_values, _check_file4
+from .channel import Channel4
+from .mdf import Resampler
+
+chunk_length_resampling = 65536  # number of records or samples per chunk
+
+
+def _channel_description(info, data_group, channel_group, channel_number):
+    """ collects channel decoding description from info4
+
+    Parameters
+    ----------------
+    info : mdfinfo4.Info4 class
+        info4 class containing all MDF Blocks
+    data_group : int
+        data group number
+    channel_group : int
+        channel group number
+    channel_number : int
+        channel number
+
+    Returns
+    -----------
+    dict with keys cn_type, data_type, bit_offset, byte_offset, bit_count, conversion,
+    unit and description
+    """
+    cn = info['CN'][data_group][channel_group][channel_number]
+    channel = Channel4(data_group, channel_group, channel_number)
+    channel.set(info)
+    description = {'cn_type': cn['cn_type'], 'data_type': cn['cn_data_type'], 'bit_offset': cn['cn_bit_offset'],
+                   'byte_offset': cn['cn_byte_offset'], 'bit_count': cn['cn_bit_count'], 'conversion': None,
+                   'unit': channel.unit(info), 'description': channel.desc(info)}
+    conversion = channel.conversion(info)
+    if conversion is not None and conversion['cc_type']:
+        description['conversion'] = {'type': conversion['cc_type'], 'parameters': {}}
+        for key in ('cc_val', 'cc_ref'):
+            if key in conversion:
+                description['conversion']['parameters'][key] = conversion[key]
+    return description
+
+
+class _GroupStream(object):
+    __slots__ = ['group', 'records', 'index', 'buffer', 'exhausted']
+    """ decodes records of a data group chunk by chunk and resamples them
+
+    Attributes
+    --------------
+    group : dict
+        data group description with keys data, record_length, master and channels
+    records : generator
+        records chunks
+    index : int
+        number of records already decoded
+    buffer : dict
+        decoded samples not yet consumed, key 'master' for master channel
+    exhausted : bool
+        flag set when all records have been decoded
+    """
+
+    def __init__(self, fid, group, chunk_length):
+        self.group = group
+        self.records = _rechunk(_data_blocks4(fid, group['data']), chunk_length * group['record_length'])
+        self.index = 0
+        self.buffer = None
+        self.exhausted = False
+
+    def pull(self):
+        """ decodes next chunk of records and appends it to buffer
+        """
+        try:
+            chunk = next(self.records)
+        except StopIteration:
+            self.exhausted = True
+            return
+        record_length = self.group['record_length']
+        n_records = len(chunk) // record_length
+        if not n_records:
+            return
+        records = frombuffer(chunk, dtype='u1', count=n_records * record_length).reshape(n_records, record_length)
+        values = {'master': _physical_values(records, self.group['master'], self.index)}
+        for name, channel in self.group['channels'].items():
+            values[name] = _physical_values(records, channel, self.index)
+        self.index += n_records
+        if self.buffer is None:
+            self.buffer = values
+        else:
+            self.buffer = {name: concatenate((self.buffer[name], values[name])) for name in values}
+
+    def first(self):
+        """ first master channel value, None if data group has no records
+        """
+        while self.buffer is None and not self.exhausted:
+            self.pull()
+        if self.buffer is None:
+            return None
+        return self.buffer['master'][0]
+
+    def last(self):
+        """ last decoded master channel value
+        """
+        return self.buffer['master'][-1]
+
+    def resample(self, grid):
+        """ resamples channels of data group on grid
+
+        Records are decoded until master channel covers grid, each part of grid is resampled as soon
+        as it is covered and samples before it are dropped, keeping last one for interpolation.
+
+        Parameters
+        ----------------
+        grid : numpy 1D array
+            new master channel values, increasing
+
+        Returns
+        -----------
+        dict of numpy arrays
+        """
+        resampled = {}
+        position = 0
+        while position < len(grid):
+            master = self.buffer['master']
+            if self.exhausted:
+                stop = len(grid)
+            else:
+                stop = searchsorted(grid, master[-1], side='right')
+            if stop > position:
+                part = grid[position:stop]
+                resampler = Resampler(master, part)
+                for name in self.group['channels']:
+                    values = resampler(self.buffer[name])
+                    if name not in resampled:
+                        resampled[name] = empty(len(grid), dtype=values.dtype)
+                    resampled[name][position:stop] = values
+                keep = max(searchsorted(master, part[-1], side='right') - 1, 0)
+                self.buffer = {name: self.buffer[name][keep:] for name in self.buffer}
+                position = stop
+            if position < len(grid):
+                self.pull()
+        return resampled
+
+
+def _physical_values(records, channel, first_index):
+    """ decodes and converts channel values from records
+
+    Parameters
+    ----------------
+    records : numpy 2D array of uint8
+        records, one per row
+    channel : dict
+        channel description from _channel_description
+    first_index : int
+        index of first record in channel group
+
+    Returns
+    -----------
+    numpy 1D array
+    """
+    values = _raw_values(records, channel, first_index)
+    if channel['conversion'] is not None:
+        values = Mdf4._convert_channel_data4({'data': values, 'conversion': channel['conversion']},
+                                             'channel', True)['channel']
+    return values
+
+
+class StreamingResampler(object):
+    __slots__ = ['fileName', 'sampling', 'masterType', 'chunkLength', 'masterName', 'masterUnit',
+                 'channels', '_groups']
+    """ resamples all channels of mdf 4.x file on common master channel with constant memory
+
+    New master channel starts at the smallest first master channel value of data groups and ends
+    before the largest last one, covering all data groups whereas Mdf.resample keeps the range of
+    the first master channel. Data groups are read in parallel, chunk by chunk,
+    and resampled channels are produced by chunks of new master channel samples. Float channels are
+    linearly interpolated, others take previous sample value.
+
+    Attributes
+    --------------
+    fileName : str
+        mdf 4.x file name
+    sampling : float
+        resampling interval
+    masterType : int
+        master channel sync type of resampled data groups, 1 time, 2 angle, 3 distance, 4 index
+    chunkLength : int
+        number of records decoded or samples produced at once
+    masterName : str
+        new master channel name, master channel name of first resampled data group
+    masterUnit : str
+        new master channel unit
+    channels : OrderedDict
+        resampled channel names with dict of their unit and description
+
+    Methods
+    ------------
+    __iter__()
+        generator of resampled chunks
+    write(output_file_name=None, compression=False)
+        writes resampled channels in new mdf 4.x file
+
+    Notes
+    --------
+    Only sorted data groups are resampled, use sort_mdf first for unsorted files.
+    Only numeric channels are kept, channel arrays, variable length and value to text
+    converted channels are dropped as strings can not be interpolated.
+    Mdf 3.x files can be converted before with convert3to4.
+
+    Examples
+    --------------
+    >>> from mdfreader import StreamingResampler
+    >>> resampler = StreamingResampler('big_file.mf4', 0.01)
+    >>> resampler.write('big_file_10ms.mf4')
+    >>> for chunk in StreamingResampler('big_file.mf4', 0.01, channel_list=['speed']):
+    >>>     exporter.write(chunk['t'], chunk['speed'])
+    """
+
+    def __init__(self, file_name, sampling, channel_list=None, master_type=1,
+                 chunk_length=chunk_length_resampling):
+        """ collects channels to resample
+
+        Parameters
+        ----------------
+        file_name : str
+            mdf 4.x file name
+        sampling : float
+            resampling interval
+        channel_list : list of str, optional
+            channels to resample, all numeric channels by default
+        master_type : int, optional
+            master channel sync type of resampled data groups, 1 time by default
+        chunk_length : int, optional
+            number of records decoded or samples produced at once
+        """
+        self.fileName = file_name
+        self.sampling = sampling
+        self.masterType = master_type
+        self.chunkLength = chunk_length
+        self.masterName = None
+        self.masterUnit = ''
+        self.channels = OrderedDict()
+        self._groups = []
+        with open(file_name, 'rb') as fid:
+            _check_file4(fid, file_name)
+        info = Info4(file_name)
+        if channel_list is not None:
+            channel_list = set(channel_list)
+        for dg in info['DG']:
+            if len(info['CG'][dg]) != 1:
+                warn('data group {} is unsorted, not resampled, use sort_mdf first'.format(dg))
+                continue
+            cg = next(iter(info['CG'][dg]))
+            if info['CG'][dg][cg]['cg_flags'] & 0b1 or not info['CG'][dg][cg]['cg_cycle_count']:
+                continue  # VLSD or empty channel group
+            master = None
+            channels = OrderedDict()
+            for cn, block in info['CN'][dg][cg].items():
+                if block['cn_type'] in (2, 3):
+                    if block['cn_sync_type'] == master_type:
+                        master = (cn, block['name'])
+                elif block['cn_type'] in (0, 6) and block['cn_data_type'] < 6 \
+                        and 'CABlock' not in block \
+                        and (channel_list is None or block['name'] in channel_list):
+                    channels[block['name']] = cn
+            if master is None or not channels:
+                continue
+            group = {'data': info['DG'][dg]['dg_data'],
+                     'record_length': info['CG'][dg][cg]['cg_data_bytes'] + info['CG'][dg][cg]['cg_invalid_bytes'],
+                     'master': _channel_description(info, dg, cg, master[0]),
+                     'channels': OrderedDict()}
+            for name, cn in channels.items():
+                channel = _channel_description(info, dg, cg, cn)
+                if channel['conversion'] is not None and channel['conversion']['type'] in (7, 8, 10, 11):
+                    continue  # converted to text
+                group['channels'][name] = channel
+                self.channels[name] = {'unit': channel['unit'], 'description': channel['description']}
+            if group['channels']:
+                if self.masterName is None:
+                    self.masterName = master[1]
+                    self.masterUnit = group['master']['unit']
+                self._groups.append(group)
+
+    def __iter__(self):
+        """ generator of resampled chunks
+
+        Returns
+        -----------
+        generator of OrderedDict with new master channel first and resampled channels,
+        numpy arrays of at most chunkLength samples
+        """
+        with open(self.fileName, 'rb') as fid:
+            streams = [_GroupStream(fid, group, self.chunkLength) for group in self._groups]
+            firsts = [stream.first() for stream in streams]
+            if any(first is None for first in firsts):
+                raise Exception('data missing in {}'.format(self.fileName))
+            if not streams:
+                return
+            start = min(firsts)
+            sample = 0
+            while True:
+                grid = start + arange(sample, sample + self.chunkLength) * self.sampling
+                chunk = OrderedDict()
+                chunk[self.masterName] = grid
+                for stream in streams:
+                    chunk.update(stream.resample(grid))
+                n_samples = len(grid)
+                if all(stream.exhausted for stream in streams):
+                    end = max(stream.last() for stream in streams)
+                    n_samples = searchsorted(grid, end, side='left')
+                    for name in chunk:
+                        chunk[name] = chunk[name][:n_samples]
+                if n_samples:
+                    yield chunk
+                if n_samples < self.chunkLength:
+                    break
+                sample += self.chunkLength
+
+    def write(self, output_file_name=None, compression=False):
+        """ writes resampled channels in new mdf 4.x file, one data group
+
+        Parameters
+        ----------------
+        output_file_name : str, optional
+            new file name, file name with '_Resampled' suffix by default
+        compression : bool, optional
+            writes data as DZ blocks
+
+        Returns
+        -----------
+        str
+            new file name
+        """
+        if output_file_name is None:
+            name, extension = splitext(self.fileName)
+            output_file_name = '{}_Resampled{}'.format(name, extension)
+        with Mdf4Writer(output_file_name, compression=compression) as writer:
+            for chunk in self:
+                if not writer.groups:
+                    channels = OrderedDict()
+                    channels[self.masterName] = {'dtype': chunk[self.masterName].dtype, 'unit': self.masterUnit}
+                    for name, channel in self.channels.items():
+                        channels[name] = {'dtype': chunk[name].dtype, 'unit': channel['unit'],
+                                          'description': channel['description']}
+                    writer.add_group(channels, master_channel=self.masterName, master_type=self.masterType)
+                writer.append(chunk)
+        return output_file_name
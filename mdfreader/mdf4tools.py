@@ -0,0 +1,962 @@
+# -*- coding: utf-8 -*-
+""" Measured Data Format block level tools for version 4.x
+
+:Author: `Aymeric Rateau <https://github.com/ratal/mdfreader>`__
+
+Tools working directly on file blocks, metadata blocks being copied with relocated links
+and data blocks streamed, channels are never decoded nor converted except master channels
+to locate time windows.
+
+Dependencies
+-------------------
+- Python >3.4 <http://www.python.org>
+- Numpy >1.14 <http://numpy.scipy.org>
+
+mdf4tools
+--------------------------
+"""
+from io import open
+from os.path import splitext
+from struct import Struct, pack, unpack
+from warnings import warn
+from numpy import frombuffer, concatenate, zeros, ones, arange, left_shift, right_shift, bitwise_and
+from .mdfinfo4 import DZBlock, DLBlock, _HeaderStruct, _HLStruct, _DGStruct, _calculate_block_start, \
+    _compress_blocks, chunk_size_writing
+from .mdf4reader import _linear_conversion, _rational_conversion
+from .channel import array_format4
+
+_LinkStruct = Struct('<Q')
+
+
+def _read_links(fid, pointer):
+    """ reads mdf 4.x block header and links
+
+    Parameters
+    ----------------
+    fid
+        file identifier
+    pointer : int
+        block position
+
+    Returns
+    -----------
+    tuple of block id, block length and list of links
+    """
+    fid.seek(pointer)
+    (block_id, reserved, length, link_count) = _HeaderStruct.unpack(fid.read(24))
+    return block_id, length, list(unpack('<{}Q'.format(link_count), fid.read(8 * link_count)))
+
+
+def _data_blocks4(fid, pointer):
+    """ reads uncompressed data of data blocks linked by a data group, in order
+
+    Parameters
+    ----------------
+    fid
+        file identifier
+    pointer : int
+        position of DT, DV, DZ, DL, LD or HL block
+
+    Returns
+    -----------
+    generator of bytes
+
+    Notes
+    --------
+    LD blocks are read only without invalidation data, DI blocks are not supported
+    """
+    while pointer:
+        block_id, length, links = _read_links(fid, pointer)
+        pointer = 0
+        if block_id in (b'##DT', b'##DV', b'##RD', b'##SD'):
+            length -= 24
+            position = fid.tell()
+            while length > 0:
+                fid.seek(position)  # other generators may share file identifier
+                chunk = fid.read(min(chunk_size_writing, length))
+                length -= len(chunk)
+                position += len(chunk)
+                yield chunk
+        elif block_id == b'##DZ':
+            dz = DZBlock()
+            dz.read_dz(fid)
+            yield DZBlock.decompress_data_block(fid.read(dz['dz_data_length']), dz['dz_zip_type'],
+                                                dz['dz_zip_parameter'], dz['dz_org_data_length'])
+        elif block_id == b'##DL':
+            for data_pointer in links[1:]:
+                for chunk in _data_blocks4(fid, data_pointer):
+                    yield chunk
+            pointer = links[0]  # next DL
+        elif block_id == b'##LD':
+            (ld_flags, ld_count) = unpack('<2I', fid.read(8))
+            if ld_flags & (1 << 31):
+                raise Exception('LD block with invalidation data (DI blocks) not supported')
+            for data_pointer in links[1:1 + ld_count]:
+                for chunk in _data_blocks4(fid, data_pointer):
+                    yield chunk
+            pointer = links[0]  # next LD
+        elif block_id == b'##HL':
+            pointer = links[0]  # first DL
+        else:
+            raise Exception('Unexpected {} block in data group data'.format(block_id))
+
+
+def _rechunk(blocks, chunk_size):
+    """ regroups stream of bytes into chunks of given size
+
+    Parameters
+    ----------------
+    blocks : iterable of bytes
+        data stream
+    chunk_size : int
+        size of chunks in bytes, last chunk can be smaller
+
+    Returns
+    -----------
+    generator of bytes
+    """
+    buffer = bytearray()
+    for block in blocks:
+        buffer += block
+        while len(buffer) >= chunk_size:
+            yield bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def _copy_blocks4(fid, out, roots, skipped_links=None, excluded=None):
+    """ copies blocks reachable from roots into output file, links being relocated
+
+    Blocks are written in same order as in input file, starting after ID block.
+
+    Parameters
+    ----------------
+    fid
+        input file identifier
+    out
+        output file identifier
+    roots : list of int
+        positions of blocks to be copied with the blocks they link to
+    skipped_links : dict, optional
+        indexes of links not followed and written null, by block position
+    excluded : set, optional
+        positions of blocks not to be copied, links to them written null
+
+    Returns
+    -----------
+    tuple of relocation dict (new position by input position), list of (link position in output
+    file, linked block position in input file) for links to excluded blocks and next free position
+    """
+    if skipped_links is None:
+        skipped_links = dict()
+    if excluded is None:
+        excluded = set()
+    blocks = dict()  # length by block position
+    stack = list(roots)
+    while stack:
+        pointer = stack.pop()
+        if pointer in blocks or pointer in excluded:
+            continue
+        block_id, length, links = _read_links(fid, pointer)
+        if block_id[:2] != b'##':
+            warn('link to position {} not pointing to a block, ignored'.format(pointer))
+            continue
+        blocks[pointer] = length
+        skipped = skipped_links.get(pointer, ())
+        stack.extend(link for index, link in enumerate(links) if link and index not in skipped)
+
+    relocation = dict()
+    pointer = 64
+    for block_pointer in sorted(blocks):
+        relocation[block_pointer] = pointer
+        pointer = _calculate_block_start(pointer + blocks[block_pointer])
+    patches = []
+    for block_pointer in sorted(blocks):
+        block_id, length, links = _read_links(fid, block_pointer)
+        skipped = skipped_links.get(block_pointer, ())
+        new_links = []
+        for index, link in enumerate(links):
+            if not link or index in skipped:
+                new_links.append(0)
+            elif link in relocation:
+                new_links.append(relocation[link])
+            else:  # excluded block
+                new_links.append(0)
+                patches.append((relocation[block_pointer] + 24 + 8 * index, link))
+        out.seek(relocation[block_pointer])
+        out.write(_HeaderStruct.pack(block_id, 0, length, len(links)))
+        out.write(pack('<{}Q'.format(len(new_links)), *new_links))
+        length -= 24 + 8 * len(links)
+        while length > 0:
+            chunk = fid.read(min(chunk_size_writing, length))
+            length -= len(chunk)
+            out.write(chunk)
+    return relocation, patches, pointer
+
+
+def _write_data_blocks4(out, pointer, chunks, record_length=0, compression=True, zip_type=1):
+    """ writes data chunks as DT or DZ blocks, linked by a DL block (and HL block if compressed)
+
+    Parameters
+    ----------------
+    out
+        output file identifier
+    pointer : int
+        position of first block
+    chunks : iterable of bytes
+        data chunks, one per data block
+    record_length : int, optional
+        record length in bytes, needed for transposition
+    compression : bool, optional
+        flag to write DZ blocks
+    zip_type : int, optional
+        0 for non transposed, 1 for transposed data
+
+    Returns
+    -----------
+    tuple of position of data block to be linked by data group (0 if no data), next free position
+    """
+    if not record_length:
+        zip_type = 0
+    data_blocks = []
+    dl_chunks = []
+    if compression:
+        blocks = _compress_blocks(chunks, None, record_length, zip_type)
+    else:
+        blocks = ((chunk, None) for chunk in chunks)
+    for block, compressed_data in blocks:
+        position = None
+        if compression:
+            dz = DZBlock()
+            dz['block_start'] = pointer
+            dz['dz_org_block_type'] = b'DT'
+            dz['dz_zip_type'] = zip_type
+            position = dz.write(out, block, record_length, compressed_data)
+        if position is None:  # not compressed or not enough data to compress
+            out.seek(pointer)
+            out.write(_HeaderStruct.pack(b'##DT', 0, 24 + len(block), 0))
+            out.write(block)
+            position = pointer + 24 + len(block)
+        data_blocks.append(pointer)
+        dl_chunks.append((len(block) // record_length if record_length else 0, len(block)))
+        pointer = _calculate_block_start(position)
+    if compression:
+        blocks.close()
+    if not data_blocks:
+        return 0, pointer
+    if len(data_blocks) == 1 and not compression:
+        return data_blocks[0], pointer
+    data_pointer = pointer
+    dl = DLBlock()
+    if compression:
+        out.seek(pointer)
+        out.write(_HeaderStruct.pack(b'##HL', 0, 40, 1))
+        out.write(_HLStruct.pack(pointer + 40, 0, zip_type, b'\x00' * 5))
+        pointer += 40
+    dl['block_start'] = pointer
+    out.seek(pointer)
+    dl.write(out, dl_chunks)
+    out.seek(dl['block_start'] + 32)
+    out.write(pack('<{}Q'.format(len(data_blocks)), *data_blocks))
+    return data_pointer, _calculate_block_start(dl['block_start'] + dl['block_length'])
+
+
+def _data_groups4(fid):
+    """ lists data groups of mdf 4.x file and their channel groups
+
+    Parameters
+    ----------------
+    fid
+        file identifier
+
+    Returns
+    -----------
+    list of dict with keys pointer, data, rec_id_size and channel_groups list of dict
+    with keys pointer, cn_first, cg_master, fields, record_id, cycle_count, vlsd, record_length
+    and inval_bytes, fields being the offset of data section in block
+    """
+    hd_block_id, hd_length, hd_links = _read_links(fid, 64)
+    data_groups = []
+    dg_pointer = hd_links[0]
+    while dg_pointer:
+        block_id, length, dg_links = _read_links(fid, dg_pointer)
+        (rec_id_size,) = unpack('<B', fid.read(1))
+        data_group = {'pointer': dg_pointer, 'data': dg_links[2], 'md_comment': dg_links[3],
+                      'rec_id_size': rec_id_size, 'channel_groups': []}
+        cg_pointer = dg_links[1]
+        while cg_pointer:
+            block_id, length, links = _read_links(fid, cg_pointer)
+            (record_id, cycle_count, flags, path_separator, reserved, data_bytes, inval_bytes) = \
+                unpack('<2Q2H3I', fid.read(32))
+            data_group['channel_groups'].append({'pointer': cg_pointer, 'cn_first': links[1],
+                                                 'cg_master': links[6] if len(links) > 6 else 0,
+                                                 'fields': 24 + 8 * len(links),
+                                                 'record_id': record_id, 'cycle_count': cycle_count,
+                                                 'vlsd': flags & 0b1,
+                                                 'record_length': data_bytes + inval_bytes,
+                                                 'inval_bytes': inval_bytes})
+            cg_pointer = links[0]
+        data_groups.append(data_group)
+        dg_pointer = dg_links[0]
+    return data_groups
+
+
+def _check_file4(fid, file_name):
+    """ checks file is a finalised mdf 4.x file
+
+    Parameters
+    ----------------
+    fid
+        file identifier
+    file_name : str
+        file name
+
+    Returns
+    -----------
+    ID block bytes
+    """
+    fid.seek(0)
+    header = fid.read(64)
+    (version,) = unpack('<H', header[28:30])
+    if header[:3] != b'MDF' or version < 400:
+        raise Exception('{} is not a mdf 4.x file'.format(file_name))
+    if b'UnFin' in header[:8]:
+        raise Exception('{} is not finalised'.format(file_name))
+    return header
+
+
+def recompress(file_name, output_file_name=None, compression=True, transposition=True,
+               chunk_size=chunk_size_writing):
+    """ writes copy of mdf 4.x file with data blocks re-encoded, DT or DZ
+
+    Data of each data group is streamed from its DT, DL, DZ or HL blocks and written again
+    as DT blocks or DZ blocks of new chunk size. Metadata blocks are copied unchanged,
+    channels are neither decoded nor converted.
+
+    Parameters
+    ----------------
+    file_name : str
+        name of mdf 4.x file
+    output_file_name : str, optional
+        name of written file, by default file name with appended '_Recompressed' string before extension
+    compression : bool, optional
+        flag to write DZ blocks, DT blocks otherwise
+    transposition : bool, optional
+        flag to transpose records before compression, only for sorted data groups
+    chunk_size : int, optional
+        size of uncompressed data blocks in bytes
+
+    Returns
+    -----------
+    output file name
+
+    Notes
+    --------
+    Column oriented data groups (LD blocks) and signal data (SD blocks) are copied unchanged.
+    File version is raised to 4.10 if DZ blocks are written in older version file.
+
+    Examples
+    --------------
+    >>> from mdfreader import recompress
+    >>> recompress('file.mf4', 'file_compressed.mf4', compression=True)
+    """
+    if output_file_name is None:
+        split_name = splitext(file_name)
+        output_file_name = ''.join([split_name[-2], '_Recompressed', split_name[-1]])
+    with open(file_name, 'rb') as fid, open(output_file_name, 'wb') as out:
+        header = _check_file4(fid, file_name)
+        (version,) = unpack('<H', header[28:30])
+        if compression and version < 410:  # DZ and HL blocks introduced in version 4.1
+            header = b''.join([header[:8], b'4.10    ', header[16:28], pack('<H', 410), header[30:]])
+        out.write(header)
+        data_groups = _data_groups4(fid)
+        skipped_links = dict()
+        for data_group in data_groups:
+            if data_group['data'] and _read_links(fid, data_group['data'])[0] in (b'##DT', b'##DZ', b'##DL', b'##HL'):
+                skipped_links[data_group['pointer']] = {2}  # data link
+            else:
+                data_group['data'] = 0  # copied unchanged
+        relocation, patches, pointer = _copy_blocks4(fid, out, [64], skipped_links)
+        for data_group in data_groups:
+            if not data_group['data']:
+                continue
+            record_length = 0
+            if not data_group['rec_id_size'] and len(data_group['channel_groups']) == 1:
+                record_length = data_group['channel_groups'][0]['record_length']
+            if record_length:
+                data_chunk_size = max(chunk_size // record_length, 1) * record_length
+            else:
+                data_chunk_size = chunk_size
+            data_pointer, pointer = _write_data_blocks4(out, pointer,
+                                                        _rechunk(_data_blocks4(fid, data_group['data']),
+                                                                 data_chunk_size),
+                                                        record_length, compression, int(transposition))
+            out.seek(relocation[data_group['pointer']] + 24 + 8 * 2)
+            out.write(_LinkStruct.pack(data_pointer))
+    return output_file_name
+
+
+def _channel_span(fid, cn_pointer):
+    """ reads channel block and byte ranges it uses in record, including its composition
+
+    Parameters
+    ----------------
+    fid
+        file identifier
+    cn_pointer : int
+        channel block position
+
+    Returns
+    -----------
+    tuple of channel dict with keys name, next, cn_type and data, and list of
+    (first byte, end byte) ranges used in record by channel and its composition
+    """
+    block_id, length, links = _read_links(fid, cn_pointer)
+    (cn_type, sync_type, data_type, bit_offset, byte_offset, bit_count, flags, inval_bit_pos,
+     precision, reserved, attachment_count) = unpack('<4B4I2BH', fid.read(24))
+    channel = {'next': links[0], 'cn_type': cn_type, 'data': links[5]}
+    spans = []
+    n_bytes = (bit_offset + bit_count + 7) // 8
+    if cn_type not in (3, 6) and n_bytes:  # not virtual channel
+        spans.append((byte_offset, byte_offset + n_bytes))
+    composition = links[1]
+    if composition:
+        composition_id, composition_length, composition_links = _read_links(fid, composition)
+        if composition_id == b'##CA':
+            (ca_type, ca_storage, ca_ndim, ca_flags, ca_byte_offset_base, ca_inval_bit_pos_base) = \
+                unpack('<2BHIiI', fid.read(16))
+            if ca_storage == 0 and n_bytes:  # array elements in record
+                n_elements = 1
+                for dim_size in unpack('<{}Q'.format(ca_ndim), fid.read(8 * ca_ndim)):
+                    n_elements *= dim_size
+                spans.append((byte_offset, byte_offset + abs(ca_byte_offset_base) * (n_elements - 1) + n_bytes))
+        elif composition_id == b'##CN':  # structure, children channels
+            child = composition
+            while child:
+                child_channel, child_spans = _channel_span(fid, child)
+                spans.extend(child_spans)
+                child = child_channel['next']
+    if links[2]:  # channel name
+        tx_id, tx_length, tx_links = _read_links(fid, links[2])
+        channel['name'] = fid.read(tx_length - 24).rstrip(b'\x00').decode('UTF-8', 'ignore')
+    else:
+        channel['name'] = ''
+    return channel, spans
+
+
+def _merge_spans(spans):
+    """ merges overlapping byte ranges and computes their position in repacked record
+
+    Parameters
+    ----------------
+    spans : list of tuples
+        (first byte, end byte) ranges
+
+    Returns
+    -----------
+    list of (first byte, end byte, first byte in repacked record) sorted ranges
+    """
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    ranges = []
+    new_start = 0
+    for start, end in merged:
+        ranges.append((start, end, new_start))
+        new_start += end - start
+    return ranges
+
+
+def extract(file_name, channel_list, output_file_name=None, compression=False):
+    """ writes new mdf 4.x file with only selected channels, raw data being repacked
+
+    Records of each data group are repacked to keep only bytes of selected channels at their
+    original bit positions. Channel groups and channels blocks are copied with new byte offsets,
+    conversion, unit, comment and source blocks are reused, values are neither decoded nor converted.
+
+    Parameters
+    ----------------
+    file_name : str
+        name of mdf 4.x file
+    channel_list : list of str
+        names of channels to extract, as in file. Master channels of their channel groups are always kept,
+        including master channel groups referenced by column oriented channel groups
+    output_file_name : str, optional
+        name of written file, by default file name with appended '_Extract' string before extension
+    compression : bool, optional
+        flag to write DZ blocks
+
+    Returns
+    -----------
+    output file name
+
+    Notes
+    --------
+    Channels of unsorted data groups are not extracted, file can be sorted first with sort_mdf.
+    Invalidation bytes are kept, channel hierarchy and sample reduction blocks are not copied.
+
+    Examples
+    --------------
+    >>> from mdfreader import extract
+    >>> extract('file.mf4', ['EngineSpeed', 'VehicleSpeed'], 'supplier.mf4')
+    """
+    if output_file_name is None:
+        split_name = splitext(file_name)
+        output_file_name = ''.join([split_name[-2], '_Extract', split_name[-1]])
+    channel_set = set(channel_list)
+    with open(file_name, 'rb') as fid, open(output_file_name, 'wb') as out:
+        header = _check_file4(fid, file_name)
+        if compression and unpack('<H', header[28:30])[0] < 410:  # DZ and HL blocks introduced in version 4.1
+            header = b''.join([header[:8], b'4.10    ', header[16:28], pack('<H', 410), header[30:]])
+        out.write(header)
+        data_groups = _data_groups4(fid)
+        excluded = set()
+        skipped_links = {64: {0, 2}}  # header first data group and channel hierarchy links
+        roots = [64]
+        kept_groups = []
+        found = set()
+        group_channels = dict()  # channels by channel group position
+        master_groups = set()  # channel groups containing master channel of other channel groups
+        for data_group in data_groups:
+            excluded.add(data_group['pointer'])
+            for channel_group in data_group['channel_groups']:
+                excluded.add(channel_group['pointer'])
+                channels = []
+                cn_pointer = channel_group['cn_first']
+                while cn_pointer:
+                    channel, spans = _channel_span(fid, cn_pointer)
+                    channel['pointer'] = cn_pointer
+                    channel['spans'] = spans
+                    channels.append(channel)
+                    excluded.add(cn_pointer)
+                    cn_pointer = channel['next']
+                group_channels[channel_group['pointer']] = channels
+                if channel_group['cg_master'] and any(channel['name'] in channel_set for channel in channels):
+                    master_groups.add(channel_group['cg_master'])
+        for data_group in data_groups:
+            for channel_group in data_group['channel_groups']:
+                channels = group_channels[channel_group['pointer']]
+                selected = [channel for channel in channels if channel['name'] in channel_set]
+                if not selected and channel_group['pointer'] not in master_groups:
+                    continue
+                found.update(channel['name'] for channel in selected)
+                if data_group['rec_id_size']:
+                    warn('unsorted data group {} not extracted, file can be sorted first with sort_mdf'
+                         .format(data_group['pointer']))
+                    continue
+                # master and maximum length reference channels are kept
+                selected_pointers = set(channel['pointer'] for channel in selected)
+                selected_pointers.update(channel['data'] for channel in selected if channel['cn_type'] == 5)
+                selected = [channel for channel in channels if channel['pointer'] in selected_pointers or
+                            channel['cn_type'] in (2, 3)]
+                for channel in selected:
+                    excluded.discard(channel['pointer'])
+                    skipped_links[channel['pointer']] = {0}  # next channel link
+                    roots.append(channel['pointer'])
+                excluded.discard(channel_group['pointer'])
+                skipped_links[channel_group['pointer']] = {0, 1, 4}  # next CG, first CN and SR links
+                roots.append(channel_group['pointer'])
+                if data_group['md_comment']:
+                    roots.append(data_group['md_comment'])
+                kept_groups.append((data_group, channel_group, selected))
+        for channel in channel_set.difference(found):
+            warn('{} channel not found in file {}'.format(channel, file_name))
+
+        relocation, patches, pointer = _copy_blocks4(fid, out, roots, skipped_links, excluded)
+
+        new_data_groups = dict()
+        for data_group, channel_group, selected in kept_groups:
+            ranges = _merge_spans([span for channel in selected for span in channel['spans']])
+            new_record_length = sum(end - start for start, end, new_start in ranges)
+            record_length = channel_group['record_length']
+            data_bytes = record_length - channel_group['inval_bytes']
+            # inval bytes kept at end of record
+            columns = [(start, end) for start, end, new_start in ranges]
+            if data_bytes < record_length:
+                columns.append((data_bytes, record_length))
+            # channel groups and channels blocks patched with new record layout
+            cg_pointer = relocation[channel_group['pointer']]
+            out.seek(cg_pointer + 24 + 8)
+            out.write(_LinkStruct.pack(relocation[selected[0]['pointer']]))
+            out.seek(cg_pointer + channel_group['fields'] + 24)  # cg_data_bytes
+            out.write(pack('<I', new_record_length))
+            for channel, next_channel in zip(selected, selected[1:] + [None]):
+                cn_pointer = relocation[channel['pointer']]
+                out.seek(cn_pointer + 24)
+                out.write(_LinkStruct.pack(relocation[next_channel['pointer']] if next_channel else 0))
+            for block_pointer in _composition_channels(fid, [channel['pointer'] for channel in selected]):
+                cn_id, cn_length, cn_links = _read_links(fid, block_pointer)
+                fid.seek(block_pointer + 24 + 8 * len(cn_links) + 4)
+                (byte_offset,) = unpack('<I', fid.read(4))
+                for start, end, new_start in ranges:
+                    if start <= byte_offset < end:
+                        byte_offset = new_start + byte_offset - start
+                        break
+                out.seek(relocation[block_pointer] + 24 + 8 * len(cn_links) + 4)
+                out.write(pack('<I', byte_offset))
+            # repacked records
+            chunks = (_repack_records(chunk, record_length, columns)
+                      for chunk in _rechunk(_data_blocks4(fid, data_group['data']),
+                                            max(chunk_size_writing // record_length, 1) * record_length))
+            data_pointer, pointer = _write_data_blocks4(out, pointer, chunks,
+                                                        new_record_length + channel_group['inval_bytes'],
+                                                        compression)
+            out.seek(pointer)
+            out.write(_DGStruct.pack(b'##DG', 0, 64, 4, 0, cg_pointer, data_pointer,
+                                     relocation.get(data_group['md_comment'], 0), 0, b'\x00' * 7))
+            new_data_groups[data_group['pointer']] = pointer
+            pointer += 64
+
+        # data groups chain and links to data groups
+        dg_chain = [new_data_groups[data_group['pointer']] for data_group in data_groups
+                    if data_group['pointer'] in new_data_groups]
+        out.seek(64 + 24)
+        out.write(_LinkStruct.pack(dg_chain[0] if dg_chain else 0))
+        for dg_pointer, next_dg_pointer in zip(dg_chain, dg_chain[1:]):
+            out.seek(dg_pointer + 24)
+            out.write(_LinkStruct.pack(next_dg_pointer))
+        for link_position, link in patches:
+            if link in new_data_groups:
+                out.seek(link_position)
+                out.write(_LinkStruct.pack(new_data_groups[link]))
+    return output_file_name
+
+
+def _composition_channels(fid, cn_pointers):
+    """ lists channels and their composition children channels
+
+    Parameters
+    ----------------
+    fid
+        file identifier
+    cn_pointers : list of int
+        channel blocks positions
+
+    Returns
+    -----------
+    list of channel blocks positions
+    """
+    channels = []
+    stack = list(cn_pointers)
+    while stack:
+        cn_pointer = stack.pop()
+        channels.append(cn_pointer)
+        block_id, length, links = _read_links(fid, cn_pointer)
+        if links[1] and _read_links(fid, links[1])[0] == b'##CN':
+            child = links[1]
+            while child:
+                stack.append(child)
+                child = _read_links(fid, child)[2][0]
+    return channels
+
+
+def _repack_records(data, record_length, columns):
+    """ keeps only columns of records
+
+    Parameters
+    ----------------
+    data : bytes
+        records
+    record_length : int
+        record length in bytes
+    columns : list of tuples
+        (first byte, end byte) of records to keep
+
+    Returns
+    -----------
+    bytes
+    """
+    n_records = len(data) // record_length
+    records = frombuffer(data, dtype='u1', count=n_records * record_length).reshape(n_records, record_length)
+    return concatenate([records[:, start:end] for start, end in columns], axis=1).tobytes()
+
+
+def _master_channel4(fid, cn_pointer):
+    """ reads master channel description of channel group
+
+    Parameters
+    ----------------
+    fid
+        file identifier
+    cn_pointer : int
+        first channel block position of channel group
+
+    Returns
+    -----------
+    dict with keys cn_type, sync_type, data_type, bit_offset, byte_offset, bit_count, cc_type
+    and cc_val, None if channel group has no master channel
+    """
+    while cn_pointer:
+        block_id, length, links = _read_links(fid, cn_pointer)
+        (cn_type, sync_type, data_type, bit_offset, byte_offset, bit_count) = unpack('<4B2I', fid.read(12))
+        if cn_type in (2, 3):  # master or virtual master channel
+            master = {'cn_type': cn_type, 'sync_type': sync_type, 'data_type': data_type,
+                      'bit_offset': bit_offset, 'byte_offset': byte_offset, 'bit_count': bit_count,
+                      'cc_type': 0, 'cc_val': ()}
+            if links[4]:  # conversion
+                cc_id, cc_length, cc_links = _read_links(fid, links[4])
+                (cc_type, precision, flags, ref_count, val_count) = unpack('<2B3H', fid.read(8))
+                fid.read(16)  # physical range
+                master['cc_type'] = cc_type
+                master['cc_val'] = unpack('<{}d'.format(val_count), fid.read(8 * val_count))
+            return master
+        cn_pointer = links[0]
+    return None
+
+
+def _raw_values(records, channel, first_index):
+    """ extracts raw values of numeric channel from records
+
+    Parameters
+    ----------------
+    records : numpy 2D array of uint8
+        records, one per row
+    channel : dict
+        channel description with keys cn_type, data_type, bit_offset, byte_offset and bit_count
+    first_index : int
+        index of first record in channel group
+
+    Returns
+    -----------
+    numpy 1D array
+    """
+    n_records = records.shape[0]
+    if channel['cn_type'] in (3, 6):  # virtual channel, record index
+        return arange(first_index, first_index + n_records)
+    n_bytes = (channel['bit_offset'] + channel['bit_count'] + 7) // 8
+    endian, data_type = array_format4(channel['data_type'], n_bytes)
+    item_size = int(data_type[1:])
+    columns = zeros((n_records, item_size), dtype='u1')
+    if endian == '<':
+        columns[:, :n_bytes] = records[:, channel['byte_offset']:channel['byte_offset'] + n_bytes]
+    else:
+        columns[:, item_size - n_bytes:] = records[:, channel['byte_offset']:channel['byte_offset'] + n_bytes]
+    values = columns.view(endian + data_type).ravel()
+    n_bits = 8 * item_size
+    if data_type[0] in 'ui' and (channel['bit_offset'] or channel['bit_count'] < n_bits):
+        if data_type[0] == 'i':  # sign extension
+            values = right_shift(left_shift(values, n_bits - channel['bit_offset'] - channel['bit_count']),
+                                 n_bits - channel['bit_count'])
+        else:
+            values = bitwise_and(right_shift(values, channel['bit_offset']), (1 << channel['bit_count']) - 1)
+    return values
+
+
+def _master_values(records, master, first_index):
+    """ computes physical values of master channel from records
+
+    Parameters
+    ----------------
+    records : numpy 2D array of uint8
+        records, one per row
+    master : dict
+        master channel description from _master_channel4
+    first_index : int
+        index of first record in channel group
+
+    Returns
+    -----------
+    numpy 1D array
+    """
+    values = _raw_values(records, master, first_index)
+    if master['cc_type'] == 1:
+        values = _linear_conversion(values, master['cc_val'])
+    elif master['cc_type'] == 2:
+        values = _rational_conversion(values, master['cc_val'])
+    return values
+
+
+def _cut_records(chunks, record_length, master, begin, end, counter):
+    """ keeps records with master channel values within window
+
+    Parameters
+    ----------------
+    chunks : iterable of bytes
+        records chunks, records not split between chunks
+    record_length : int
+        record length in bytes
+    master : dict
+        master channel description from _master_channel4
+    begin : float
+        first master channel value kept, None for no lower bound
+    end : float
+        last master channel value kept, None for no upper bound
+    counter : dict
+        records count, key index for records read, first for index of first record kept
+        and cycle_count for records kept
+
+    Returns
+    -----------
+    generator of bytes
+    """
+    for chunk in chunks:
+        n_records = len(chunk) // record_length
+        records = frombuffer(chunk, dtype='u1', count=n_records * record_length).reshape(n_records, record_length)
+        values = _master_values(records, master, counter['index'])
+        mask = ones(n_records, dtype=bool)
+        if begin is not None:
+            mask &= values >= begin
+        if end is not None:
+            mask &= values <= end
+        kept = records[mask]
+        if kept.shape[0]:
+            if not counter['cycle_count']:
+                counter['first'] = counter['index'] + int(mask.argmax())
+            counter['cycle_count'] += kept.shape[0]
+            yield kept.tobytes()
+        counter['index'] += n_records
+        if end is not None and n_records and values[-1] > end:
+            break  # master channel is monotonous, no more records in window
+
+
+def _slice_records(chunks, record_length, first, count):
+    """ keeps records within index window
+
+    Parameters
+    ----------------
+    chunks : iterable of bytes
+        records chunks, records not split between chunks
+    record_length : int
+        record length in bytes
+    first : int
+        index of first record kept
+    count : int
+        number of records kept
+
+    Returns
+    -----------
+    generator of bytes
+    """
+    index = 0
+    for chunk in chunks:
+        n_records = len(chunk) // record_length
+        start = max(first - index, 0)
+        stop = min(first + count - index, n_records)
+        if start < stop:
+            yield chunk[start * record_length:stop * record_length]
+        index += n_records
+        if index >= first + count:
+            break
+
+
+def cut(file_name, begin=None, end=None, output_file_name=None, sync_type=1, compression=False):
+    """ writes new mdf 4.x file with only records within master channel window
+
+    Master channel of each data group is decoded chunk by chunk to select records, selected records
+    are copied raw and cycle counts of channel groups are patched.
+    Other blocks are copied as is.
+
+    Parameters
+    ----------------
+    file_name : str
+        name of mdf 4.x file
+    begin : float, optional
+        first master channel value to be kept
+    end : float, optional
+        last master channel value to be kept
+    output_file_name : str, optional
+        name of written file, by default file name with appended '_Cut' string before extension
+    sync_type : int, optional
+        master channel synchronisation type of data groups to be cut, 1 for time by default
+    compression : bool, optional
+        flag to write DZ blocks
+
+    Returns
+    -----------
+    output file name
+
+    Notes
+    --------
+    Data groups without master channel of sync_type, with master channel conversion other than linear
+    or rational, or unsorted are copied entirely. Unsorted files can be sorted first with sort_mdf.
+    Data groups of column oriented files using master channel of another channel group are cut with
+    its records window, or all copied entirely if one of them can not be cut.
+    Sample reduction blocks are not copied.
+
+    Examples
+    --------------
+    >>> from mdfreader import cut
+    >>> cut('file.mf4', 120.5, 125.0, 'event.mf4')
+    """
+    if begin is None and end is None:
+        raise Exception('Please input at least one beginning or ending value to cut data')
+    if output_file_name is None:
+        split_name = splitext(file_name)
+        output_file_name = ''.join([split_name[-2], '_Cut', split_name[-1]])
+    with open(file_name, 'rb') as fid, open(output_file_name, 'wb') as out:
+        header = _check_file4(fid, file_name)
+        if compression and unpack('<H', header[28:30])[0] < 410:  # DZ and HL blocks introduced in version 4.1
+            header = b''.join([header[:8], b'4.10    ', header[16:28], pack('<H', 410), header[30:]])
+        out.write(header)
+        data_groups = _data_groups4(fid)
+        channel_groups = dict((channel_group['pointer'], channel_group) for data_group in data_groups
+                              for channel_group in data_group['channel_groups'])
+        skipped_links = dict()
+        cut_groups = []
+        uncut_masters = set()  # master channel groups of data groups copied entirely
+        for data_group in data_groups:
+            for channel_group in data_group['channel_groups']:
+                skipped_links[channel_group['pointer']] = {4}  # sample reduction link
+            if data_group['rec_id_size'] or not data_group['channel_groups']:
+                if data_group['rec_id_size']:
+                    warn('unsorted data group {} copied entirely, file can be sorted first with sort_mdf'
+                         .format(data_group['pointer']))
+                continue
+            channel_group = data_group['channel_groups'][0]
+            # column oriented channel group can use master channel of another channel group
+            master_group = channel_groups.get(channel_group['cg_master'], channel_group)
+            master = _master_channel4(fid, master_group['cn_first'])
+            if master is None or master['sync_type'] != sync_type or not channel_group['record_length']:
+                continue
+            if master['cc_type'] not in (0, 1, 2):
+                warn('master channel conversion of data group {} not supported, data group copied entirely'
+                     .format(data_group['pointer']))
+                uncut_masters.add(master_group['pointer'])
+                continue
+            if data_group['data'] and _read_links(fid, data_group['data'])[0] == b'##LD' and \
+                    unpack('<I', fid.read(4))[0] & (1 << 31):
+                warn('invalidation data of data group {} not supported, data group copied entirely'
+                     .format(data_group['pointer']))
+                uncut_masters.add(master_group['pointer'])
+                continue
+            cut_groups.append((data_group, channel_group, master_group, master))
+        # data groups sharing master channel are all cut or all copied entirely
+        cut_masters = set(master_group['pointer'] for data_group, channel_group, master_group, master in cut_groups
+                          if master_group is channel_group).difference(uncut_masters)
+        for data_group, channel_group, master_group, master in cut_groups:
+            if master_group['pointer'] not in cut_masters:
+                warn('data group {} shares master channel with data group copied entirely, '
+                     'data group copied entirely'.format(data_group['pointer']))
+        cut_groups = [group for group in cut_groups if group[2]['pointer'] in cut_masters]
+        # data groups with their own master channel first to know records windows
+        cut_groups.sort(key=lambda group: group[1] is not group[2])
+        for data_group, channel_group, master_group, master in cut_groups:
+            skipped_links[data_group['pointer']] = {2}  # data link
+
+        relocation, patches, pointer = _copy_blocks4(fid, out, [64], skipped_links)
+
+        windows = dict()  # index of first record and cycle count by master channel group
+        for data_group, channel_group, master_group, master in cut_groups:
+            record_length = channel_group['record_length']
+            blocks = _data_blocks4(fid, data_group['data'])
+            chunks = _rechunk(blocks, max(chunk_size_writing // record_length, 1) * record_length)
+            if master_group is channel_group:
+                counter = {'index': 0, 'first': 0, 'cycle_count': 0}
+                chunks = _cut_records(chunks, record_length, master, begin, end, counter)
+            else:
+                (first, cycle_count) = windows.get(master_group['pointer'], (0, 0))
+                chunks = _slice_records(chunks, record_length, first, cycle_count)
+            data_pointer, pointer = _write_data_blocks4(out, pointer, chunks, record_length, compression)
+            blocks.close()
+            if master_group is channel_group:
+                cycle_count = counter['cycle_count']
+                windows[channel_group['pointer']] = (counter['first'], cycle_count)
+            out.seek(relocation[data_group['pointer']] + 24 + 8 * 2)
+            out.write(_LinkStruct.pack(data_pointer))
+            out.seek(relocation[channel_group['pointer']] + channel_group['fields'] + 8)  # cg_cycle_count
+            out.write(pack('<Q', cycle_count))
+    return output_file_name
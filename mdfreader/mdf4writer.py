@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+""" Measured Data Format streaming writer for version 4.x
+
+:Author: `Aymeric Rateau <https://github.com/ratal/mdfreader>`__
+
+Dependencies
+-------------------
+- Python >3.4 <http://www.python.org>
+- Numpy >1.14 <http://numpy.scipy.org>
+
+mdf4writer
+--------------------------
+"""
+from io import open
+from struct import pack
+from time import time
+from collections import OrderedDict
+from numpy import empty, asarray, concatenate, issubdtype, number as numpy_number
+from numpy import dtype as numpy_dtype, max as npmax, min as npmin
+from .mdfinfo4 import IDBlock, HDBlock, FHBlock, CommentBlock, DGBlock, CGBlock, CNBlock, CABlock, \
+    DTBlock, DZBlock, DLBlock, HLBlock, _calculate_block_start, _compress_blocks, chunk_size_writing
+
+
+def _mdf4_data_type(numpy_kind):
+    """ converts numpy dtype kind into mdf 4.x cn_data_type, little endian
+
+    Parameters
+    ----------------
+    numpy_kind : str
+        numpy dtype kind
+
+    Returns
+    -----------
+    int
+        cn_data_type
+    """
+    if numpy_kind in ('u', 'b'):
+        return 0  # LE
+    elif numpy_kind == 'i':
+        return 2  # LE
+    elif numpy_kind == 'f':
+        return 4  # LE
+    elif numpy_kind == 'S':
+        return 6
+    elif numpy_kind == 'U':
+        return 7  # UTF-8
+    elif numpy_kind == 'V':
+        return 10  # bytes
+    raise Exception('Not recognized dtype kind {}'.format(numpy_kind))
+
+
+class Mdf4Writer(object):
+    """ writes mdf 4.1 file incrementally with constant memory
+
+    Channel groups are declared once with add_group, their blocks are written immediately.
+    Data is then given chunk by chunk with append, written as DT or DZ blocks at end of file.
+    close() writes data lists and patches cycle counts, value ranges and links.
+
+    Attributes
+    --------------
+    fileName : str
+        file name
+    fid
+        file identifier
+    compression : bool
+        flag to write DZ blocks (transposed and deflated) instead of DT blocks
+    groups : OrderedDict
+        channel groups by master channel name
+    pointer : int
+        position in file of next block
+
+    Methods
+    ------------
+    add_group(channels, master_channel=None, master_type=1)
+        declares channel group and writes its blocks
+    append(chunk)
+        writes chunk of data
+    close()
+        writes data lists, patches links and closes file
+
+    Examples
+    --------------
+    >>> with Mdf4Writer('file.mf4', compression=True) as writer:
+    >>>     writer.add_group({'t': {'dtype': 'f8', 'unit': 's'}, 'speed': 'f4'}, master_channel='t')
+    >>>     for time_chunk, speed_chunk in acquisition:
+    >>>         writer.append({'t': time_chunk, 'speed': speed_chunk})
+    """
+
+    def __init__(self, file_name, metadata=None, compression=False):
+        """ opens file and writes ID, HD and FH blocks
+
+        Parameters
+        ----------------
+        file_name : str
+            name of file to be written
+        metadata : dict, optional
+            file metadata with keys author, organisation, project, subject, comment, time
+        compression : bool, optional
+            flag to compress data blocks
+        """
+        self.fileName = file_name
+        self.compression = compression
+        self.groups = OrderedDict()
+        self._channel_group = dict()  # channel name to master of its group
+        file_metadata = {'author': '', 'organisation': '', 'project': '',
+                         'subject': '', 'comment': '', 'time': time()}
+        if metadata is not None:
+            file_metadata.update(metadata)
+        self.fid = open(file_name, 'wb')
+
+        # IDBLock writing
+        temp = IDBlock()
+        temp['id_vers'] = b'4.11    '
+        temp['id_ver'] = 411
+        temp.write(self.fid)
+
+        blocks = OrderedDict()
+        pointer = 64
+        # Header Block, first DG link patched when first group is added
+        blocks['HD'] = HDBlock()
+        blocks['HD']['time'] = file_metadata['time']
+        blocks['HD']['block_start'] = pointer
+        blocks['HD']['DG'] = 0
+        pointer += 104
+
+        # Header Block comments
+        blocks['HD']['MD'] = pointer
+        blocks['HD_comment'] = CommentBlock()
+        blocks['HD_comment']['block_start'] = pointer
+        blocks['HD_comment'].load(file_metadata, 'HD')
+        pointer = blocks['HD_comment']['block_start'] + blocks['HD_comment']['block_length']
+
+        # file history block
+        blocks['FH'] = FHBlock()
+        blocks['HD']['FH'] = pointer
+        blocks['FH']['block_start'] = pointer
+        pointer = blocks['FH']['block_start'] + 56
+
+        # File History comment
+        blocks['FH']['MD'] = pointer
+        blocks['FH_comment'] = CommentBlock()
+        blocks['FH_comment']['block_start'] = pointer
+        blocks['FH_comment'].load(file_metadata, 'FH')
+        pointer = blocks['FH_comment']['block_start'] + blocks['FH_comment']['block_length']
+
+        for block in blocks.values():
+            block.write(self.fid)
+        self.pointer = pointer
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_group(self, channels, master_channel=None, master_type=1):
+        """ declares a channel group and writes its DG, CG, CN and TX blocks
+
+        Parameters
+        ----------------
+        channels : dict
+            channel name keys with values being either a numpy dtype (or its str representation)
+            or a dict with keys 'dtype', optionally 'shape' for arrays, 'unit' and 'description'
+        master_channel : str, optional
+            name of master channel, must be in channels
+        master_type : int, optional
+            master channel type : 1=Time, 2=Angle, 3=Distance, 4=index
+        """
+        if master_channel is not None and master_channel not in channels:
+            raise Exception('master channel {} not in channels'.format(master_channel))
+        if master_channel in self.groups:
+            raise Exception('group with master channel {} already declared'.format(master_channel))
+        names = list(channels)
+        if master_channel is not None:  # master in first position
+            names.remove(master_channel)
+            names.insert(0, master_channel)
+        group = dict()
+        group['master'] = master_channel
+        group['channels'] = OrderedDict()
+        for name in names:
+            if name in self._channel_group:
+                raise Exception('channel {} already declared in another group'.format(name))
+            self._channel_group[name] = master_channel
+            description = channels[name]
+            if not isinstance(description, dict):
+                description = {'dtype': description}
+            group['channels'][name] = {'dtype': numpy_dtype(description['dtype']),
+                                       'shape': tuple(description.get('shape', ())),
+                                       'unit': description.get('unit', ''),
+                                       'description': description.get('description', '')}
+        # packed record, channels are byte aligned
+        group['record_dtype'] = numpy_dtype({'names': names,
+                                             'formats': [(group['channels'][name]['dtype'],
+                                                          group['channels'][name]['shape'])
+                                                         if group['channels'][name]['shape']
+                                                         else group['channels'][name]['dtype']
+                                                         for name in names]})
+        record_length = group['record_dtype'].itemsize
+
+        pointer = self.pointer
+        dg = DGBlock()
+        dg['block_start'] = pointer
+        dg['DG'] = 0
+        dg['data'] = 0  # patched at close
+        pointer += 64
+        dg['CG'] = pointer
+
+        blocks = OrderedDict()
+        blocks['CG'] = CGBlock()
+        blocks['CG']['length'] = 104
+        blocks['CG']['block_start'] = pointer
+        pointer += blocks['CG']['length']
+        blocks['CG']['CN'] = pointer
+        blocks['CG']['cg_inval_bytes'] = 0
+        blocks['CG']['cg_cycle_count'] = 0  # patched at close
+        blocks['CG']['cg_data_bytes'] = record_length
+
+        group['CN'] = OrderedDict()
+        previous = None
+        for n_channel, name in enumerate(names):
+            channel = group['channels'][name]
+            cn = CNBlock()
+            cn['block_start'] = pointer
+            pointer += 160
+            cn['cn_byte_offset'] = group['record_dtype'].fields[name][1]
+            cn['cn_bit_offset'] = 0  # always byte aligned
+            cn['cn_bit_count'] = channel['dtype'].itemsize * 8
+            cn['cn_data_type'] = _mdf4_data_type(channel['dtype'].kind)
+            cn['cn_val_range_min'] = 0
+            cn['cn_val_range_max'] = 0
+            cn['cn_flags'] = 0  # value range flag set at close if numeric data
+            if name == master_channel:
+                cn['cn_type'] = 2  # master channel
+                cn['cn_sync_type'] = master_type
+            else:
+                cn['cn_type'] = 0
+                cn['cn_sync_type'] = 0
+            cn['CN'] = 0
+            if previous is not None:
+                previous['CN'] = cn['block_start']
+            previous = cn
+            blocks[n_channel] = cn
+            group['CN'][name] = cn
+
+            # arrays handling
+            if channel['shape']:
+                cn['Composition'] = pointer  # pointer to CABlock
+                ca = ''.join([name, '_CA'])
+                blocks[ca] = CABlock()
+                blocks[ca]['block_start'] = pointer
+                blocks[ca]['ndim'] = len(channel['shape'])
+                blocks[ca]['ndim_size'] = channel['shape']
+                blocks[ca].load(channel['dtype'].itemsize)
+                pointer += blocks[ca]['block_length']
+            else:
+                cn['Composition'] = 0
+
+            # channel name
+            cn['TX'] = pointer
+            blocks[name] = CommentBlock()
+            blocks[name].load(name, 'TX')
+            pointer += blocks[name]['block_length']
+
+            # channel unit
+            if channel['unit']:
+                cn['Unit'] = pointer
+                unit_name = u'{}{}{}'.format(name, '_U_', n_channel)
+                blocks[unit_name] = CommentBlock()
+                blocks[unit_name].load(channel['unit'], 'TX')
+                pointer += blocks[unit_name]['block_length']
+            else:
+                cn['Unit'] = 0
+
+            # channel description
+            if channel['description']:
+                cn['Comment'] = pointer
+                desc_name = '{}{}{}'.format(name, '_C_', n_channel)
+                blocks[desc_name] = CommentBlock()
+                blocks[desc_name].load(channel['description'], 'TX')
+                pointer += blocks[desc_name]['block_length']
+            else:
+                cn['Comment'] = 0
+            channel['min'] = None
+            channel['max'] = None
+
+        dg.write(self.fid)
+        for block in blocks.values():
+            block.write(self.fid)
+
+        # links this new data group
+        if self.groups:
+            self.fid.seek(self.groups[next(reversed(self.groups))]['DG']['block_start'] + 24)
+        else:
+            self.fid.seek(64 + 24)  # HD first DG link
+        self.fid.write(pack('<Q', dg['block_start']))
+
+        group['DG'] = dg
+        group['CG'] = blocks['CG']
+        group['buffer'] = []
+        group['buffered_bytes'] = 0
+        group['data_blocks'] = []  # pointers to data blocks
+        group['chunks'] = []  # (number of records, size in bytes) of data blocks
+        self.groups[master_channel] = group
+        self.pointer = _calculate_block_start(pointer)
+
+    def append(self, chunk):
+        """ appends chunk of data
+
+        Parameters
+        ----------------
+        chunk : dict
+            channel name keys with numpy array values. For each channel group touched,
+            all its channels must be given with the same length
+        """
+        masters = set(self._channel_group[name] for name in chunk if name in self._channel_group)
+        for name in chunk:
+            if name not in self._channel_group:
+                raise Exception('channel {} not declared'.format(name))
+        for master in masters:
+            group = self.groups[master]
+            missing = [name for name in group['channels'] if name not in chunk]
+            if missing:
+                raise Exception('channels {} missing in chunk'.format(missing))
+            n_records = len(chunk[next(iter(group['channels']))])
+            records = empty(n_records, dtype=group['record_dtype'])
+            for name, channel in group['channels'].items():
+                data = asarray(chunk[name])
+                if len(data) != n_records:
+                    raise Exception('channel {} length {} differs from group length {}'.format(
+                        name, len(data), n_records))
+                records[name] = data
+                if n_records and issubdtype(data.dtype, numpy_number):
+                    data_min = npmin(data)
+                    data_max = npmax(data)
+                    if channel['min'] is None or data_min < channel['min']:
+                        channel['min'] = data_min
+                    if channel['max'] is None or data_max > channel['max']:
+                        channel['max'] = data_max
+            group['buffer'].append(records)
+            group['buffered_bytes'] += records.nbytes
+            if group['buffered_bytes'] >= chunk_size_writing:
+                self._flush(group)
+
+    def _flush(self, group):
+        """ writes buffered records of a group as data blocks
+
+        Parameters
+        ----------------
+        group : dict
+            channel group
+        """
+        if not group['buffer']:
+            return
+        records = concatenate(group['buffer'])
+        group['buffer'] = []
+        group['buffered_bytes'] = 0
+        record_length = group['record_dtype'].itemsize
+        if record_length == 0:
+            return
+        n_record_block = max(chunk_size_writing // record_length, 1)
+        chunks = [(min(n_record_block, len(records) - start), min(n_record_block, len(records) - start) * record_length)
+                  for start in range(0, len(records), n_record_block)]
+        data = memoryview(records.tobytes())
+        if self.compression:  # blocks compressed in parallel, written in order
+            compressed_blocks = _compress_blocks(data, chunks, record_length, 1)
+        data_pointer = 0
+        for n_records, chunk_size in chunks:
+            position = None
+            if self.compression:
+                dz = DZBlock()
+                dz['block_start'] = self.pointer
+                dz['dz_org_block_type'] = b'DT'
+                dz['dz_zip_type'] = 1  # transposed data
+                position = dz.write(self.fid, data[data_pointer: data_pointer + chunk_size], record_length,
+                                    next(compressed_blocks)[1])
+            if position is None:  # not compressed or not enough data to compress
+                dt = DTBlock()
+                dt.load(record_length, n_records, self.pointer)
+                position = dt.write(self.fid, data[data_pointer: data_pointer + chunk_size])
+            group['data_blocks'].append(self.pointer)
+            group['chunks'].append((n_records, chunk_size))
+            self.pointer = _calculate_block_start(position)
+            data_pointer += chunk_size
+        if self.compression:
+            compressed_blocks.close()
+
+    def close(self):
+        """ writes remaining data and data lists, patches links, cycle counts and value ranges
+        then closes file
+        """
+        if self.fid is None or self.fid.closed:
+            return
+        for group in self.groups.values():
+            self._flush(group)
+            # data list
+            if not group['data_blocks']:
+                data_pointer = 0
+            elif len(group['data_blocks']) == 1 and not self.compression:
+                data_pointer = group['data_blocks'][0]
+            else:
+                data_pointer = self.pointer
+                dl = DLBlock()
+                if self.compression:
+                    hl = HLBlock()
+                    hl['block_start'] = self.pointer
+                    hl['block_length'] = 40
+                    dl['block_start'] = self.pointer + hl['block_length']
+                    self.fid.seek(hl['block_start'])
+                    self.fid.write(pack('<4sI2Q', b'##HL', 0, hl['block_length'], 1))
+                    self.fid.write(pack('<QHB5s', dl['block_start'], 0, 1, b'\x00' * 5))
+                else:
+                    dl['block_start'] = self.pointer
+                self.fid.seek(dl['block_start'])
+                dl.write(self.fid, group['chunks'])
+                self.fid.seek(dl['block_start'] + 32)
+                self.fid.write(pack('<{}Q'.format(len(group['data_blocks'])), *group['data_blocks']))
+                self.pointer = _calculate_block_start(dl['block_start'] + dl['block_length'])
+            self.fid.seek(group['DG']['block_start'] + 40)
+            self.fid.write(pack('<Q', data_pointer))
+            # cycle count
+            group['CG']['cg_cycle_count'] = sum(n_records for n_records, size in group['chunks'])
+            self.fid.seek(group['CG']['block_start'])
+            group['CG'].write(self.fid)
+            # value ranges
+            for name, cn in group['CN'].items():
+                channel = group['channels'][name]
+                if channel['min'] is not None:
+                    cn['cn_val_range_min'] = channel['min']
+                    cn['cn_val_range_max'] = channel['max']
+                    cn['cn_flags'] = 8  # only Bit 3: Limit range valid flag
+                    self.fid.seek(cn['block_start'])
+                    cn.write(self.fid)
+        self.fid.close()
@@ -15,7 +15,7 @@ mdfinfo3
 --------------------------
 """
 from warnings import warn
-from numpy import sort, zeros
+from numpy import sort, zeros, array, argsort, searchsorted, interp, diff, empty, asarray
 from struct import unpack, Struct
 from .mdf import dataField, descriptionField, unitField, masterField, masterTypeField, idField
 
@@ -589,11 +589,158 @@ def read_cc_block(fid, pointer):
             # made
             warn('Conversion Formula type (cc_type={})not supported.'.format(temp['cc_type']))
 
+        # tables compiled once for all channels using this conversion
+        table = compile_cc_table(temp['cc_type'], temp['conversion'])
+        if table is not None:
+            temp['table'] = table
+
         return temp
     else:
         return None
 
 
+def compile_cc_table(cc_type, conversion):
+    """ builds conversion object from table conversion pairs
+
+    Parameters
+    ----------------
+    cc_type : int
+        conversion type
+    conversion : dict
+        conversion pairs from CC block
+
+    Returns
+    -----------
+    callable conversion object for types 1, 2, 11 and 12, None otherwise
+    """
+    if not conversion:
+        return None
+    if cc_type in (1, 2):
+        return ValueTable(conversion, interpolation=cc_type == 1)
+    elif cc_type == 11:
+        return TextTable(conversion)
+    elif cc_type == 12:
+        return TextRangeTable(conversion)
+    return None
+
+
+class ValueTable(object):
+    __slots__ = ['int_values', 'phys_values', 'interpolation']
+    """ tabular conversion (types 1 and 2) with sorted numpy tables
+
+    Attributes
+    --------------
+    int_values : numpy array
+        sorted raw values of table
+    phys_values : numpy array
+        physical values corresponding to int_values
+    interpolation : bool
+        flag for linear interpolation between table values
+    """
+
+    def __init__(self, conversion, interpolation=True):
+        table = array([(conversion[pair]['int'], conversion[pair]['phys']) for pair in range(len(conversion))])
+        order = argsort(table[:, 0], kind='stable')
+        self.int_values = table[order, 0]
+        self.phys_values = table[order, 1]
+        self.interpolation = interpolation
+
+    def __call__(self, data):
+        if self.interpolation:
+            return interp(data, self.int_values, self.phys_values)
+        indexes = searchsorted(self.int_values, data)
+        indexes[indexes >= len(self.int_values)] = len(self.int_values) - 1
+        return self.phys_values[indexes]
+
+
+class TextTable(object):
+    __slots__ = ['keys', 'texts']
+    """ text table conversion (type 11) as categorical lookup
+
+    Attributes
+    --------------
+    keys : numpy array
+        sorted raw values of table
+    texts : numpy array
+        texts corresponding to keys, last item is empty text for values not in table
+    """
+
+    def __init__(self, conversion):
+        keys = array([conversion[pair]['int'] for pair in range(len(conversion))])
+        order = argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.texts = array([conversion[pair]['text'] for pair in order] + [''])
+
+    def __call__(self, data):
+        indexes = searchsorted(self.keys, data)
+        indexes[indexes >= len(self.keys)] = len(self.keys) - 1
+        not_found = self.keys[indexes] != data
+        indexes[not_found] = len(self.keys)  # empty text
+        return self.texts[indexes]
+
+
+class TextRangeTable(object):
+    __slots__ = ['lower', 'upper', 'texts', 'sorted_ranges', 'compiled']
+    """ text range table conversion (type 12)
+
+    Attributes
+    --------------
+    lower : numpy array
+        lower range limits, first pair is default value
+    upper : numpy array
+        upper range limits
+    texts : list
+        texts of ranges, could be LINEAR_CONV formula from CANape
+    sorted_ranges : bool
+        flag indicating ranges are sorted and not overlapping, allowing binary search
+    compiled : bool
+        flag indicating LINEAR_CONV formulas are compiled
+    """
+
+    def __init__(self, conversion):
+        n_pair = len(conversion)
+        self.lower = array([conversion[pair]['lowerRange'] for pair in range(n_pair)])
+        self.upper = array([conversion[pair]['upperRange'] for pair in range(n_pair)])
+        self.texts = [conversion[pair]['Textrange'] for pair in range(n_pair)]
+        self.sorted_ranges = n_pair > 1 and bool((diff(self.lower[1:]) > 0).all() and
+                                                 (self.upper[1:-1] < self.lower[2:]).all())
+        self.compiled = False
+
+    def _compile(self):
+        """ compiles LINEAR_CONV formulas, requires sympy """
+        for pair, text in enumerate(self.texts):
+            if text is not None and 'LINEAR_CONV' in text:  # linear conversion from CANape
+                from sympy import lambdify, symbols
+                X = symbols('X')  # variable is X
+                left = text.find('"')
+                right = text.rfind('"')
+                text = text[left + 1: right].replace('{', '').replace('}', '')
+                self.texts[pair] = lambdify(X, text, modules='numpy', dummify=False)
+        self.compiled = True
+
+    def __call__(self, data):
+        if not self.compiled:
+            self._compile()
+        n_pair = len(self.texts)
+        if self.sorted_ranges:
+            indexes = searchsorted(self.lower[1:], data, side='right')
+            indexes[data > self.upper[indexes]] = 0  # out of range, default value
+        else:
+            indexes = zeros(len(data), dtype='i8')
+            for pair in range(n_pair - 1, 0, -1):  # reverse order as first range found is kept
+                indexes[(self.lower[pair] <= data) & (data <= self.upper[pair])] = pair
+        formulas = [pair for pair in range(n_pair) if callable(self.texts[pair])]
+        if not formulas:
+            return array(self.texts)[indexes]
+        values = empty(len(data), dtype=object)
+        texts = array(self.texts, dtype=object)
+        values[:] = texts[indexes]
+        for pair in formulas:
+            mask = indexes == pair
+            values[mask] = self.texts[pair](data[mask])
+        return asarray(values.tolist())
+
+
 def read_tx_block(fid, pointer):
     """ reads text block """
     if pointer != 0 and pointer is not None:
@@ -12,11 +12,14 @@ from struct import calcsize, unpack, pack, Struct
 from os import remove
 from warnings import warn
 from zlib import compress, decompress
-from numpy import zeros, array, append
+from numpy import zeros, array, append, empty, frombuffer
+from threading import local
+from multiprocessing import cpu_count
+from concurrent.futures import ThreadPoolExecutor
 from math import isnan
 from time import time
 from sys import getsizeof
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from xml.etree.ElementTree import Element, SubElement, \
     tostring, register_namespace
 from lxml import objectify
@@ -85,6 +88,7 @@ EV_formula = objectify.ObjectPath('EVcomment.formula')
 EV_timeout = objectify.ObjectPath('EVcomment.timeout')
 
 chunk_size_writing = 4194304  # write by chunk of 4Mb, can be tuned for best performance
+_transpose_buffers = local()  # per thread reusable buffer for DZ data transposition
 
 
 def _load_header(fid, pointer):
@@ -140,6 +144,81 @@ def _mdf_block_read(fid, data_type, count):
         return None
 
 
+def _transpose_buffer(length):
+    """ returns reusable buffer of current thread for data transposition
+
+    Parameters
+    ----------------
+    length : int
+        needed buffer length in bytes
+
+    Returns
+    -----------
+    numpy uint8 array of given length
+    """
+    buffer = getattr(_transpose_buffers, 'buffer', None)
+    if buffer is None or len(buffer) < length:
+        buffer = empty(length, dtype='u1')
+        _transpose_buffers.buffer = buffer
+    return buffer[:length]
+
+
+def _data_blocks(data, chunks):
+    """ splits data into chunks
+
+    Parameters
+    ----------------
+    data : bytes or memoryview
+        data
+    chunks : list of tuples
+        (number of records, size in bytes) of each chunk of data
+
+    Returns
+    -----------
+    generator of memoryview of each chunk of data
+    """
+    data = memoryview(data)
+    data_pointer = 0
+    for n_record_chunk, chunk_size in chunks:
+        yield data[data_pointer: data_pointer + chunk_size]
+        data_pointer += chunk_size
+
+
+def _compress_blocks(data, chunks, record_length, zip_type):
+    """ compresses data chunks in parallel, zlib releasing GIL
+
+    Parameters
+    ----------------
+    data : bytes, memoryview or iterable
+        uncompressed data, or iterable of data chunks possibly sharing a reused buffer
+    chunks : list of tuples
+        (number of records, size in bytes) of each chunk of data
+    record_length : int
+        record length in bytes, used for transposition
+    zip_type : int
+        0 for non transposed, 1 for transposed data
+
+    Returns
+    -----------
+    generator of tuples (uncompressed chunk, compressed chunk), in chunks order
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        blocks = _data_blocks(data, chunks)
+    else:  # chunks are copied as iterable can reuse its buffer while chunk is still being compressed
+        blocks = (bytes(block) for block in data)
+    n_workers = cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        pending = deque()
+        for block in blocks:
+            pending.append((block, pool.submit(DZBlock.compress_data, block, record_length, zip_type)))
+            if len(pending) > 2 * n_workers:  # bounds memory used by compressed chunks not yet written
+                block, compressed = pending.popleft()
+                yield block, compressed.result()
+        while pending:
+            block, compressed = pending.popleft()
+            yield block, compressed.result()
+
+
 def _calculate_block_start(current_position):
     """ converts pointer position into one being multiple of 8
 
@@ -1363,7 +1442,11 @@ class DTBlock(dict):
         fid.seek(self['pointer'])
         fid.write(_HeaderStruct.pack(b'##DT', 0, self['datablocks_length'], 0))
         # dumps data
-        fid.write(data)
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            fid.write(data)
+        else:  # iterable of records chunks
+            for chunk in data:
+                fid.write(chunk)
         return self['end_position']
 
 
@@ -1479,9 +1562,18 @@ class LDBlock(dict):
                 # uses not equal length blocks, transposed compressed data
                 dz_zip_type = 1
 
+            data = memoryview(data)
+            compressed_blocks = _compress_blocks(data, self['chunks'], self['record_length'], dz_zip_type)
+            if invalid_data is not None:
+                invalid_data = memoryview(invalid_data)
+                invalid_chunks = [(n_record_chunk, n_record_chunk * self['invalid_bytes'])
+                                  for (n_record_chunk, chunk_size) in self['chunks']]
+                compressed_invalid_blocks = _compress_blocks(invalid_data, invalid_chunks,
+                                                             self['invalid_bytes'], dz_zip_type)
             for counter, (n_record_chunk, chunk_size) in enumerate(self['chunks']):
                 position, dl_data = self.write_DZ(fid, pointer, data, dl_data, counter, data_pointer,
-                                                  self['record_length'], chunk_size, dz_zip_type, b'DV')
+                                                  self['record_length'], chunk_size, dz_zip_type, b'DV',
+                                                  next(compressed_blocks)[1])
                 if position is not None:
                     pointer = position
                 else:  # no compression, not enough data
@@ -1491,7 +1583,8 @@ class LDBlock(dict):
                 if invalid_data is not None:
                     position, dl_invalid_data = self.write_DZ(fid, pointer, invalid_data, dl_invalid_data,
                                                               counter, data_invalid_pointer, self['invalid_bytes'],
-                                                              n_record_chunk, dz_zip_type, b'DI')
+                                                              n_record_chunk * self['invalid_bytes'], dz_zip_type,
+                                                              b'DI', next(compressed_invalid_blocks)[1])
                     if position is not None:
                         pointer = position
                     else:  # no compression
@@ -1501,7 +1594,10 @@ class LDBlock(dict):
                                                                   n_record_chunk * self['invalid_bytes'],
                                                                   n_record_chunk)
                 data_pointer += chunk_size
-                data_invalid_pointer += n_record_chunk
+                data_invalid_pointer += n_record_chunk * self['invalid_bytes']
+            compressed_blocks.close()
+            if invalid_data is not None:
+                compressed_invalid_blocks.close()
         else:
             for counter, (n_record_chunk, chunk_size) in enumerate(self['chunks']):
                 pointer, dl_data = self.write_DIV(fid, pointer, DVBlock(), data, dl_data,
@@ -1533,13 +1629,13 @@ class LDBlock(dict):
         return position, dl_data
 
     def write_DZ(self, fid, pointer, data, dl_data, counter, data_pointer, record_length, chunk_size,
-                 dz_zip_type, dz_org_block_type):
+                 dz_zip_type, dz_org_block_type, compressed_data=None):
         DZ = DZBlock()
         DZ['block_start'] = _calculate_block_start(pointer)
         DZ['dz_org_block_type'] = dz_org_block_type
         DZ['dz_zip_type'] = dz_zip_type
         dl_data[counter] = DZ['block_start']
-        position = DZ.write(fid, data[data_pointer: data_pointer + chunk_size], record_length)
+        position = DZ.write(fid, data[data_pointer: data_pointer + chunk_size], record_length, compressed_data)
         return position, dl_data
 
 
@@ -1578,7 +1674,7 @@ class DLBlock(dict):
         dl_offset = zeros(shape=number_dl, dtype='<u8')
         if number_dl > 1:
             for counter in range(1, number_dl):
-                (n_record_chunk, chunk_size) = chunks[counter]
+                (n_record_chunk, chunk_size) = chunks[counter - 1]  # size of previous data block
                 dl_offset[counter] = dl_offset[counter - 1] + chunk_size
         data_bytes = (b'##DL', 0, self['block_length'], number_dl + 1, 0)
         fid.write(pack('<4sI3Q', *data_bytes))
@@ -1630,25 +1726,43 @@ class DZBlock(dict):
             temp = temp.reshape(zip_parameter, M).T.ravel()
             if len(tail) > 0:
                 temp = append(temp, tail)
-            block = temp.tostring()
+            block = temp.tobytes()
         return block
 
-    def write(self, fid, data, record_length):
+    @staticmethod
+    def compress_data(data, record_length, zip_type):
+        """ compresses data block
+
+        Parameters
+        --------------
+        data : bytes or memoryview
+            raw data
+        record_length : int
+            record length, first dimension of matrix to be transposed
+        zip_type : int
+            0 for non transposed, 1 for transposed data
+
+        Returns
+        ---------
+        compressed data
+        """
+        if zip_type:
+            # uses data transposition for max compression, into thread reusable buffer
+            org_data_length = len(data)
+            M = org_data_length // record_length
+            raw = frombuffer(data, dtype='u1')
+            temp = _transpose_buffer(org_data_length)
+            temp[:M * record_length].reshape(record_length, M)[:] = raw[:M * record_length].reshape(M, record_length).T
+            temp[M * record_length:] = raw[M * record_length:]
+            return compress(temp)
+        return compress(data)
+
+    def write(self, fid, data, record_length, compressed_data=None):
         fid.seek(self['block_start'])
-        # compress data
-        # uses data transposition for max compression
         org_data_length = len(data)
-        if self['dz_zip_type']:
-            M = org_data_length // record_length
-            temp = array(memoryview(data[:M * record_length]))
-            tail = array(memoryview(data[M * record_length:]))
-            temp = temp.reshape(M, record_length).T.ravel()
-            if len(tail) > 0:
-                temp = append(temp, tail)
-            # compress transposed data
-            compressed_data = compress(temp.tostring())
-        else:
-            compressed_data = compress(data)
+        if compressed_data is None:
+            compressed_data = self.compress_data(data, record_length, self['dz_zip_type'])
+        if not self['dz_zip_type']:
             record_length = 0
         dz_data_length = len(compressed_data)
         if org_data_length > dz_data_length + 24:
@@ -1691,6 +1805,19 @@ class HLBlock(dict):
             self['chunks'].append((n_record_chunk, record_byte_offset * n_record_chunk))
 
     def write(self, fid, data):
+        """ writes HL block, its DL block and data as DZ blocks
+
+        Parameters
+        ----------------
+        fid
+            file identifier
+        data : bytes, memoryview or iterable
+            records data, or iterable of records data for each of self['chunks']
+
+        Returns
+        -----------
+        position of next block
+        """
         fid.write(_HeaderStruct.pack(b'##HL', 0, self['block_length'], 1))
         # uses not equal length blocks, transposed compressed data
         DL = DLBlock()
@@ -1702,22 +1829,24 @@ class HLBlock(dict):
         DL.write(fid, self['chunks'])
         pointer += DL['block_length']
         dl_data = zeros(shape=len(self['chunks']), dtype='<u8')
-        data_pointer = 0
+        # chunks compressed in parallel, written in order
+        compressed_blocks = _compress_blocks(data, self['chunks'], self['record_length'], dz_zip_type)
         for counter, (n_record_chunk, chunk_size) in enumerate(self['chunks']):
+            block, compressed_data = next(compressed_blocks)
             DZ = DZBlock()
             DZ['block_start'] = _calculate_block_start(pointer)
             DZ['dz_org_block_type'] = dz_org_block_type
             DZ['dz_zip_type'] = dz_zip_type
             dl_data[counter] = DZ['block_start']
-            position = DZ.write(fid, data[data_pointer: data_pointer + chunk_size], self['record_length'])
+            position = DZ.write(fid, block, self['record_length'], compressed_data)
             if position is not None:
                 pointer = position
             else:  # not enough data to be compressed, back to normal DTBlock
                 DT = DTBlock()
                 DT.load(self['record_length'], n_record_chunk, pointer)
                 dl_data[counter] = DT['pointer']
-                pointer = DT.write(fid, data[data_pointer: data_pointer + chunk_size])
-            data_pointer += chunk_size
+                pointer = DT.write(fid, block)
+        compressed_blocks.close()
         # writes links to all DZBlocks
         # write dl_data
         fid.seek(DL['block_start'] + 32)
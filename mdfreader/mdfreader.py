@@ -31,19 +31,45 @@ from io import open
 from struct import unpack
 from math import ceil
 from os.path import splitext
-from os import remove
+from os import remove, close
 from os import name as osname
 from warnings import warn
+from tempfile import mkstemp
 from datetime import datetime
+from collections import defaultdict, OrderedDict
 from argparse import ArgumentParser
-from numpy import arange, linspace, interp, all, diff, mean, vstack, hstack, float64, float32
-from numpy import nan, datetime64, array, searchsorted, clip, empty
+from numpy import arange, linspace, all, diff, mean, vstack, hstack, float64, float32
+from numpy import nan, datetime64, array, searchsorted, empty, full
 from numpy.ma import MaskedArray, masked, empty as ma_empty
 from .mdf3reader import Mdf3
 from .mdf4reader import Mdf4
-from .mdf import _open_mdf, dataField, descriptionField, unitField, masterField, masterTypeField, idField
+from .mdf import _open_mdf, dataField, conversionField, descriptionField, unitField, masterField, \
+    masterTypeField, idField, Resampler, AlignedView, CompressedData, RangeData, RunData, run_length_ratio
 from .mdfinfo3 import Info3, _generate_dummy_mdf3
 from .mdfinfo4 import Info4, _generate_dummy_mdf4
+from .mdf4writer import Mdf4Writer
+from .mdf4tools import cut as _cut4
+
+csv_rows_chunk = 10000  # number of rows aligned and written at once in csv export
+
+
+def _sampled_master(start, stop, sampling):
+    """ regularly sampled master channel, same values as numpy.arange but not stored
+
+    Parameters
+    -----------------
+    start : float
+        first value
+    stop : float
+        end of interval, excluded
+    sampling : float
+        sampling interval
+
+    Returns
+    -----------
+    RangeData
+    """
+    return RangeData(start, sampling, max(int(ceil((stop - start) / sampling)), 0))
 
 
 def _convert_to_matlab_name(channel):
@@ -274,16 +300,22 @@ class Mdf(Mdf4, Mdf3):
         reads mdf file version 3.x and 4.x
     write( file_name=None )
         writes simple mdf file
-    get_channel_data( channel_name )
+    get_channel_data( channel_name, raw_data=False, lazy_conversion=False )
         returns channel numpy array
     convert_all_channel()
         converts all channel data according to CCBlock information
+    compact_master_channels( relative_tolerance=1e-6 )
+        stores regularly sampled master channels as start and sampling interval
+    run_length_encode_channels( max_run_ratio=0.01, channel_list=None )
+        stores slowly changing channels as runs of same value
     get_channel_unit( channel_name )
         returns channel unit
     plot( channels )
         Plot channels with Matplotlib
     resample( sampling_time = 0.1, master_channel=None )
         Resamples all data groups
+    aligned_view( channel_list=None, sampling=None, master_channel=None )
+        returns read-only view of channels aligned on one master channel
     export_to_csv( file_name = None, sampling = 0.1 )
         Exports mdf data into CSV file
     export_to_NetCDF( file_name = None, sampling = None )
@@ -342,7 +374,8 @@ class Mdf(Mdf4, Mdf3):
     """
 
     def read(self, file_name=None, multi_processed=False, channel_list=None, convert_after_read=True,
-             filter_channel_names=False, no_data_loading=False, compression=False, metadata=2):
+             filter_channel_names=False, no_data_loading=False, compression=False, metadata=2,
+             compression_cache=None):
         """ reads mdf file version 3.x and 4.x
 
         Parameters
@@ -371,9 +404,10 @@ class Mdf(Mdf4, Mdf3):
             Flag to read only file info but no data to have minimum memory use.
 
         compression : bool or str, optional
-            To compress data in memory using blosc or bcolz, takes cpu time.
-            if compression = int(1 to 9), uses bcolz for compression.
-            if compression = 'blosc', uses blosc for compression.
+            To compress data in memory using blosc, takes cpu time.
+            Data is compressed by chunks of around 1MB, slicing decompresses only needed chunks.
+            if compression = int(1 to 9), compression level.
+            if compression = str, blosc compressor name ('blosclz', 'lz4', 'lz4hc', 'zlib' or 'zstd').
             Choice given, efficiency depends of data.
 
         metadata: int, optional, default = 2
@@ -382,6 +416,10 @@ class Mdf(Mdf4, Mdf3):
             1: used for noDataLoading.
             0: all metadata reading, including Source Information, Attachment, etc..
 
+        compression_cache : int, optional
+            number of decompressed chunks kept in cache per compressed channel,
+            0 deactivates cache. By default, value given to constructor
+
         Notes
         --------
         If you keep convertAfterRead to true, you can set attribute mdf.multiProc to activate channel conversion
@@ -395,6 +433,8 @@ class Mdf(Mdf4, Mdf3):
         """
         if self.fileName is None or file_name is not None:
             self.fileName = file_name
+        if compression_cache is not None:
+            self._compression_cache = compression_cache
 
         # Open file
         (self.fid, self.fileName, self.zipfile) = _open_mdf(self.fileName)
@@ -404,10 +444,24 @@ class Mdf(Mdf4, Mdf3):
         mdf_version_number = unpack('<H', self.fid.read(2))
         self.MDFVersionNumber = mdf_version_number[0]
 
+        window = None
+        if self._readWindow is not None and not no_data_loading:
+            # window pushed by cut, data previously not loaded
+            window = self._readWindow
+            window_info = self.info  # info of original file, restored after windowed read
+            self._readWindow = None
+            self._noDataLoading = False
+            self.info = None
+            self.clear()
+            self.masterChannelList.clear()
+
         if self.MDFVersionNumber < 400:  # up to version 3.x not compatible with version 4.x
             if not no_data_loading:
                 self.read3(self.fileName, None, multi_processed, channel_list,
                            convert_after_read, filter_channel_names, compression)
+                if window is not None:
+                    self.cut(window['master_channel'], window['begin'], window['end'])
+                    self.info = window_info
             else:  # populate minimum mdf structure
                 self._noDataLoading = True
                 self.info = Info3(None, fid=self.fid,
@@ -415,7 +469,22 @@ class Mdf(Mdf4, Mdf3):
                 (self.masterChannelList, mdf_dict) = _generate_dummy_mdf3(self.info, channel_list)
                 self.update(mdf_dict)
         else:  # MDF version 4.x
-            if not no_data_loading:
+            if window is not None:
+                # records within window copied in temporary file, blocks after window not read
+                self.fid.close()
+                file_name = self.fileName
+                (handle, self.fileName) = mkstemp(suffix='.mf4')
+                close(handle)
+                _cut4(file_name, window['begin'], window['end'], self.fileName, sync_type=window['master_type'])
+                try:
+                    self.read4(self.fileName, None, multi_processed, channel_list,
+                               convert_after_read, filter_channel_names, compression, metadata)
+                finally:
+                    remove(self.fileName)
+                    # temporary file deleted, object refers again to original file
+                    self.fileName = file_name
+                    self.info = window_info
+            elif not no_data_loading:
                 self.read4(self.fileName, None, multi_processed, channel_list,
                            convert_after_read, filter_channel_names, compression, metadata)
             else:  # populate minimum mdf structure
@@ -428,7 +497,7 @@ class Mdf(Mdf4, Mdf3):
         if not self.fid.closed:  # close file
             self.fid.close()
 
-    def write(self, file_name=None, compression=False, column_oriented=False):
+    def write(self, file_name=None, compression=False, column_oriented=False, append=False, master_channels=None):
         """Writes simple mdf file, same format as originally read, default is 4.x
 
         Parameters
@@ -442,11 +511,23 @@ class Mdf(Mdf4, Mdf3):
             If activated, will write in version 4.1 even if original file is in version 3.x
         column_oriented : bool
             Flag to store , column oriented channels
+        append : bool
+            Flag to append data groups at end of existing mdf 4.x file instead of writing a new file,
+            existing blocks are left untouched. If file name is not input, appends to file read
+        master_channels : list of str, optional
+            master channels of data groups to be appended, by default data groups having
+            none of their channels already in file. Only used with append
 
         Notes
         --------
-        All channels will be converted, so size might be bigger than original file
+        All channels will be converted, so size might be bigger than original file.
+        When appending, only channels of appended data groups are converted
         """
+        if append:
+            if column_oriented:
+                warn('column oriented storage not available when appending data groups')
+            self.append4(file_name=file_name, master_channels=master_channels, compression=compression)
+            return
         if file_name is None:
             split_name = splitext(self.fileName)
             if split_name[-1] in ('.mfxz', '.MFXZ'):
@@ -459,7 +540,7 @@ class Mdf(Mdf4, Mdf3):
         else:
             self.write4(file_name=file_name, compression=compression, column_oriented=column_oriented)
 
-    def get_channel_data(self, channel_name, raw_data=False):
+    def get_channel_data(self, channel_name, raw_data=False, lazy_conversion=False, dtype=None):
         """Return channel numpy array
 
         Parameters
@@ -468,6 +549,14 @@ class Mdf(Mdf4, Mdf3):
             channel name
         raw_data: bool
             flag to return non converted data
+        lazy_conversion: bool
+            flag to return channels with linear or rational conversion as ScaledData object:
+            raw data is kept and conversion applied only when sliced or used by numpy.
+            Regularly sampled channels stored as RangeData and slowly changing channels stored as RunData
+            are also returned as is instead of being expanded into numpy array
+        dtype : numpy dtype or str, optional
+            converted data precision: None (default, mostly float64), 'float32', 'float64'
+            or 'keep' to keep raw integer dtype when converted values are integers
 
         Returns
         -----------
@@ -479,22 +568,101 @@ class Mdf(Mdf4, Mdf3):
         This method is the safest to get channel data as numpy array from 'data' dict key might contain raw data
         """
         if self.MDFVersionNumber < 400:
-            vector = self._get_channel_data3(channel_name, raw_data)
+            vector = self._get_channel_data3(channel_name, raw_data, lazy_conversion, dtype)
         else:
-            vector = self._get_channel_data4(channel_name, raw_data)
+            vector = self._get_channel_data4(channel_name, raw_data, lazy_conversion, dtype)
         if self._noDataLoading:
             # remove data loaded in object to save memory
             self.set_channel_data(channel_name, None)
         return vector
 
-    def convert_all_channels(self):
+    def convert_all_channels(self, dtype=None):
         """Converts all channels from raw data to converted data according to CCBlock information.
         Converted data will take more memory.
+
+        Parameters
+        ----------------
+        dtype : numpy dtype or str, optional
+            converted data precision: None (default, mostly float64), 'float32', 'float64'
+            or 'keep' to keep raw integer dtype when converted values are integers.
+            Conversion is made by chunks directly into output array to limit memory peak
         """
         if self.MDFVersionNumber < 400:
-            return self._convert_all_channel3()
+            return self._convert_all_channel3(dtype)
         else:
-            return self._convert_all_channel4()
+            return self._convert_all_channel4(dtype)
+
+    def compact_master_channels(self, relative_tolerance=1e-6):
+        """ stores regularly sampled master channels as RangeData, start and sampling interval only
+
+        Parameters
+        ----------------
+        relative_tolerance : float, optional
+            maximum deviation from regular sampling, relative to sampling interval
+
+        Returns
+        -----------
+        list of str
+            compacted master channel names
+
+        Notes
+        --------
+        Master channels with non linear conversion are not compacted.
+        Master channel values are computed back when accessed with get_channel_data,
+        slicing, cut and resampling keep the compact form
+        """
+        compacted = []
+        for master in self.masterChannelList:
+            if master in self:
+                conversion = self[master].get(conversionField)
+                if conversion is not None and conversion['type'] != (0 if self.MDFVersionNumber < 400 else 1):
+                    continue  # only linear conversion is kept as range
+                data = self.get_channel_data(master, raw_data=True, lazy_conversion=True)
+                if isinstance(data, RangeData):
+                    continue
+                if isinstance(data, CompressedData):
+                    data = data.decompression()
+                compact = RangeData.from_array(data, relative_tolerance)
+                if compact is not None:
+                    self.set_channel_data(master, compact)
+                    compacted.append(master)
+        return compacted
+
+    def run_length_encode_channels(self, max_run_ratio=run_length_ratio, channel_list=None):
+        """ stores slowly changing channels, like states, flags or counters, as runs of same value
+
+        Parameters
+        ----------------
+        max_run_ratio : float, optional
+            channels are encoded only if their number of runs per sample is lower, 0.01 by default
+        channel_list : list of str, optional
+            channels to be encoded, by default all channels except master channels
+
+        Returns
+        -----------
+        list of str
+            encoded channel names
+
+        Notes
+        --------
+        Raw data is encoded, channel conversion is then computed only on runs values.
+        Channel values are expanded back when accessed with get_channel_data,
+        use lazy_conversion to get RunData instead. Slicing and cut keep runs.
+        """
+        if channel_list is None:
+            channel_list = [channel for channel in self if channel not in self.masterChannelList]
+        encoded = []
+        for channel in channel_list:
+            data = self.get_channel_data(channel, raw_data=True, lazy_conversion=True)
+            if isinstance(data, RunData):
+                continue
+            if isinstance(data, CompressedData):
+                data = data.decompression()
+            runs = RunData.from_array(data, max_run_ratio)
+            if runs is not None:
+                self.set_channel_data(channel, runs)
+                encoded.append(channel)
+        return encoded
 
     def plot(self, channel_name_list_of_list):
         """Plot channels with Matplotlib
@@ -601,7 +769,7 @@ class Mdf(Mdf4, Mdf3):
         given by channel or master_channel parameters (applicable only to mdf4)
 
         2. resampling will convert all your channels so be careful for big files
-        and memory consumption
+        and memory consumption, mdf4resample.StreamingResampler resamples mdf4 files by chunks instead
         """
         if self:  # mdf contains data
             # must make sure all channels are converted
@@ -619,7 +787,7 @@ class Mdf(Mdf4, Mdf3):
                 master_channel_type = self.get_channel_master_type(master_channel)
             master_data = self.get_channel_data(master_channel_name)
             if sampling is not None:
-                master_data = arange(master_data[0], master_data[-1], sampling)
+                master_data = _sampled_master(master_data[0], master_data[-1], sampling)
 
             if master_channel_name is None or \
                     master_channel_name not in self.masterChannelList[master_channel_name]:
@@ -643,7 +811,7 @@ class Mdf(Mdf4, Mdf3):
                     if sampling is None:
                         master_data = linspace(min(min_master), max(max_master), num=max(length))
                     else:
-                        master_data = arange(min(min_master), max(max_master), sampling)
+                        master_data = _sampled_master(min(min_master), max(max_master), sampling)
                     self.add_channel(master_channel_name, master_data, master_channel_name,
                                      master_type=self.get_channel_master_type(master),
                                      unit=self.get_channel_unit(master),
@@ -660,7 +828,7 @@ class Mdf(Mdf4, Mdf3):
                     master_channel_type = self.get_channel_master_type(master_channel_name)
                     master_data = self.get_channel_data(master_channel_name)
                     if sampling is not None:
-                        master_data = arange(master_data[0], master_data[-1], sampling)
+                        master_data = _sampled_master(master_data[0], master_data[-1], sampling)
 
             # Interpolate channels
             for master in list(self.masterChannelList.keys()):
@@ -680,7 +848,7 @@ class Mdf(Mdf4, Mdf3):
         else:
             warn('no data to be resampled')
 
-    def resample_group(self, sampling, channel, new_master_data=None):
+    def resample_group(self, sampling, channel, new_master_data=None, stack_channels=False):
         """ Resamples one channel along with its dataGroup
 
         Parameters
@@ -694,24 +862,23 @@ class Mdf(Mdf4, Mdf3):
         new_master_data : array, optional
             master channel data to be applied to the group identified by channel
 
+        stack_channels : bool, optional
+            flag to resample channels having same dtype at once, stacked in a 2D matrix.
+            Faster for groups with many channels but needs memory for the whole group
+
         Notes
         --------
         Resampling will convert all channels so be careful for big files
-        and memory consumption
+        and memory consumption.
+        Bracketing indexes and interpolation weights are computed once for the group
+        and applied to all its channels
         """
-        def interpolate(new_x, x, y):
-            if y.dtype.kind == 'f':
-                return interp(new_x, x, y)
-            else:
-                idx = searchsorted(x, new_x, side='right')
-                idx -= 1
-                idx = clip(idx, 0, idx[-1])
-                return y[idx]
-
         master_channel = self.get_channel_master(channel)
         old_master_data = self.get_channel_data(master_channel)
         if new_master_data is None:
-            new_master_data = arange(old_master_data[0], old_master_data[-1], sampling)
+            new_master_data = _sampled_master(old_master_data[0], old_master_data[-1], sampling)
+        resampler = None
+        stacked = defaultdict(list)  # converted channel data with its name, by dtype
         for Name in list(self.masterChannelList[master_channel]):
             # forces list() because masterChannelList is dynamic, channels can be removed
             if Name == master_channel:  # master channel
@@ -721,20 +888,71 @@ class Mdf(Mdf4, Mdf3):
                 if channel_data.dtype.kind not in ('S', 'U', 'V'):
                     # if channel not array of string
                     try:
-                        self.set_channel_data(Name, interpolate(new_master_data, old_master_data, channel_data))
+                        if resampler is None:
+                            resampler = Resampler(old_master_data, new_master_data)
+                        if stack_channels and channel_data.ndim == 1 and len(channel_data) == resampler.length:
+                            stacked[channel_data.dtype].append((Name, channel_data))
+                        else:
+                            self.set_channel_data(Name, resampler(channel_data))
                     except:
                         if not all(diff(old_master_data) > 0):
                             warn('{} has non regularly increasing master channel {}.\n'
                                  ' Faulty samples will be dropped in related data group'.
                                  format(Name, master_channel))
                             self._clean_uneven_master_data(master_channel)
-                            self.set_channel_data(Name, interpolate(new_master_data, old_master_data, channel_data))
+                            old_master_data = self.get_channel_data(master_channel)
+                            resampler = Resampler(old_master_data, new_master_data)
+                            self.set_channel_data(Name, resampler(self.get_channel_data(Name)))
                         elif old_master_data is not None and len(old_master_data) != len(channel_data):
                             warn('{} and master channel {} do not have same length'.
                                  format(Name, master_channel))
                     self.remove_channel_conversion(Name)
                 else:  # can not interpolate strings, remove channel containing string
                     self.remove_channel(Name)
+        for channels in stacked.values():
+            for (Name, _), data in zip(channels, resampler.stack([data for _, data in channels])):
+                self.set_channel_data(Name, data)
+
+    def aligned_view(self, channel_list=None, sampling=None, master_channel=None, master_data=None):
+        """ returns read-only view of channels aligned on one master channel, data is not modified
+
+        Parameters
+        ----------------
+        channel_list : list of str, optional
+            channels to align, by default all channels of master channels having same type
+            as reference master channel
+        sampling : float, optional
+            resampling interval of reference master channel
+        master_channel : str, optional
+            reference master channel name, first master by default
+        master_data : numpy array, optional
+            increasing master channel data to align channels on, overrides master_channel and sampling
+
+        Returns
+        -----------
+        AlignedView
+            channels are resampled only when accessed, fully or by slice
+
+        Examples
+        --------------
+        >>> view = yop.aligned_view(['speed', 'torque'], sampling=0.01)
+        >>> view['speed', 1000:2000]
+        """
+        if master_data is None:
+            if master_channel is None:
+                master_channel = list(self.masterChannelList.keys())[0]
+            master_data = self.get_channel_data(master_channel)
+            if sampling is not None:
+                master_data = _sampled_master(master_data[0], master_data[-1], sampling)
+        if channel_list is None:
+            if master_channel is None:
+                channel_list = [name for name in self if name not in self.masterChannelList]
+            else:
+                master_type = self.get_channel_master_type(master_channel)
+                channel_list = [name for name in self
+                                if (name not in self.masterChannelList or name == master_channel)
+                                and self.get_channel_master_type(self.get_channel_master(name)) == master_type]
+        return AlignedView(self, master_data, channel_list)
 
     def _clean_uneven_master_data(self, master_channel_name):
         """ clean data group having non evenly increasing master
@@ -753,7 +971,7 @@ class Mdf(Mdf4, Mdf3):
             data.mask = mask
             self.set_channel_data(channel, data.compressed())
 
-    def cut(self, master_channel, begin=None, end=None):
+    def cut(self, master_channel, begin=None, end=None, read_window=False):
         """ Cut data
 
         Parameters
@@ -767,19 +985,34 @@ class Mdf(Mdf4, Mdf3):
         end : float
             ending value in master channel from which to start cutting in all channels
 
+        read_window : bool, optional
+            if True, data is not cut but window is applied by next read(), only records within
+            window are then loaded (mdf4), typically after reading with no_data_loading
+
         Notes
         ------
         Only the data groups with same master type as master_channel will be cut (only for mdf4)
-
+        Channels keep their raw data and conversion, sliced as views without copy so cutting
+        costs only one master channel search per data group, conversion is applied on access.
+
+        Examples
+        --------------
+        >>> yop = Mdf('file.mf4', no_data_loading=True)
+        >>> yop.cut('t', 120.5, 125., read_window=True)
+        >>> yop.read()  # loads only records between 120.5 and 125 s
         """
         if begin is None and end is None:
             raise Exception('Please input at least one beginning or ending value to cut data')
 
         master_channel = self.get_channel_master(master_channel)
         master_channel_type = self.get_channel_master_type(master_channel)
+        if read_window:
+            self._readWindow = {'master_channel': master_channel, 'master_type': master_channel_type,
+                                'begin': begin, 'end': end}
+            return
         for master in self.masterChannelList:  # for each channel group
             # find corresponding indexes to cut
-            master_data = self.get_channel_data(master)
+            master_data = self.get_channel_data(master, lazy_conversion=True)
             if master_data is not None and len(master_data) > 0 and \
                     self.get_channel_master_type(master) == master_channel_type:
                 # not empty data and same master type
@@ -791,13 +1024,11 @@ class Mdf(Mdf4, Mdf3):
                     end_index = searchsorted(master_data, end, side='right')
                 else:
                     end_index = len(master_data)
-                if start_index == end_index:
-                    # empty array
-                    for channel in self.masterChannelList[master]:
-                        self.set_channel_data(channel, array([]))
-                else:
-                    for channel in self.masterChannelList[master]:
-                        data = self.get_channel_data(channel)
+                for channel in self.masterChannelList[master]:
+                    data = self.get_channel_data(channel, raw_data=True, lazy_conversion=True)  # conversion kept
+                    if isinstance(data, CompressedData):
+                        self.set_channel_data(channel, data[start_index: end_index], compression=True)
+                    else:
                         self.set_channel_data(channel, data[start_index: end_index])
 
     def export_to_csv(self, file_name=None, sampling=None):
@@ -813,7 +1044,8 @@ class Mdf(Mdf4, Mdf3):
 
         Notes
         --------
-        Data saved in CSV file be automatically resampled as it is difficult to save in this format
+        Data saved in CSV file be automatically resampled as it is difficult to save in this format,
+        by chunks through an aligned view so object data is not modified
         data not sharing same master channel -> not applicable for mdf4 in case there are master channels
          with various types
         Warning: this can be slow for big data, CSV is text format after all
@@ -822,7 +1054,7 @@ class Mdf(Mdf4, Mdf3):
 
         if self:  # data in mdf
             import csv
-            self.resample(sampling)
+            view = self.aligned_view(sampling=sampling)
             if file_name is None:
                 file_name = splitext(self.fileName)[0]
                 file_name = file_name + '.csv'
@@ -830,30 +1062,19 @@ class Mdf(Mdf4, Mdf3):
                 encoding = 'utf8'  # mdf4 encoding is unicode
             else:
                 encoding = 'latin-1'  # mdf3 encoding is latin-1
+            names = [name for name in view
+                     if view[name, :0].dtype.kind not in ('S', 'U', 'V') and view[name, :0].ndim <= 1]
             # writes header
             f = open(file_name, "wt", encoding=encoding)
             writer = csv.writer(f, dialect=csv.excel)
-            writer.writerow([name for name in self
-                             if self.get_channel_data(name).dtype.kind not in ('S', 'U', 'V')
-                             and self.get_channel_data(name).ndim <= 1])  # writes channel names
-            # writes units
-            writer.writerow([self.get_channel_unit(name)
-                             for name in self
-                             if self.get_channel_data(name).dtype.kind not in ('S', 'U', 'V')
-                             and self.get_channel_data(name).ndim <= 1])  # writes units
-            # concatenate all channels
-            temp = []
-            for name in self:
-                data = self.get_channel_data(name)
-                if data.dtype.kind not in ('S', 'U', 'V') \
-                        and data.ndim <= 1:
-                    temp.append(data.transpose())
-            if temp:
-                buf = vstack(temp)
-                buf = buf.transpose()
-                # Write all rows
-                r, c = buf.shape
-                writer.writerows([list(buf[i, :]) for i in range(r)])
+            writer.writerow(names)  # writes channel names
+            writer.writerow([self.get_channel_unit(name) for name in names])  # writes units
+            if names:
+                # aligns and writes rows by chunks
+                for start in range(0, len(view), csv_rows_chunk):
+                    buf = vstack([view[name, start:start + csv_rows_chunk] for name in names])
+                    buf = buf.transpose()
+                    writer.writerows([list(row) for row in buf])
             f.close()
         else:
             warn('no data to be exported')
@@ -1286,6 +1507,7 @@ class Mdf(Mdf4, Mdf3):
         It creates union of both channel lists and fills with Nan for unknown sections in channels
         If one channel is not present in both classes, masked array is created
         If invalid bytes are present, masked array are created
+        To concatenate many files, Mdf.concat allocates channels once instead of at each concatenation
         """
         first_class_masters = set(self.masterChannelList.keys())
         second_class_masters = set(mdf_class.masterChannelList.keys())
@@ -1435,6 +1657,129 @@ class Mdf(Mdf4, Mdf3):
                     master_data[0] = 0
                     self.set_channel_data(master_channel_name, master_data)
 
+    @classmethod
+    def concat(cls, mdf_list, output_file_name=None, compression=False):
+        """ Concatenates several mdf files or objects in one pass
+
+        Parameters
+        ----------------
+        mdf_list : list of str or Mdf
+            file names or mdf class instances, in concatenation order
+        output_file_name : str, optional
+            if given, data is streamed into this new mdf 4.x file instead of returned as Mdf
+        compression : bool, optional
+            flag to compress data blocks of output file
+
+        Returns
+        -----------
+        Mdf class instance with concatenated data, or output file name
+
+        Notes
+        --------
+        Channel groups are matched by master channel name. Time master channels are shifted
+        after the end of previous file by their mean sampling interval, like concat_mdf.
+        First pass reads only metadata and master channels to compute final lengths and offsets,
+        every channel is then allocated once and filled file after file, only one file being
+        loaded at a time.
+        Samples of channels missing in some files are masked. When streamed into a file,
+        channel groups keep channels of first file containing them, missing samples are filled
+        with NaN or 0.
+        """
+        # first pass, final length and time offsets of each master channel
+        masters = OrderedDict()
+        for index, item in enumerate(mdf_list):
+            if isinstance(item, str):
+                mdf = cls(item, no_data_loading=True)
+            else:
+                mdf = item
+            for master_name, channel_names in mdf.masterChannelList.items():
+                if master_name not in mdf:
+                    continue  # no master channel
+                master_data = mdf.get_channel_data(master_name)
+                if master_data is None or not len(master_data):
+                    continue
+                if master_name not in masters:
+                    masters[master_name] = {'type': mdf.get_channel_master_type(master_name),
+                                            'length': 0, 'end': None, 'channels': OrderedDict(), 'sections': {}}
+                master = masters[master_name]
+                offset = 0
+                if master['type'] == 1 and master['end'] is not None and len(master_data) > 1:
+                    # mean sampling of master channel
+                    offset = master['end'] + (master_data[-1] - master_data[0]) / (len(master_data) - 1)
+                master['sections'][index] = (master['length'], len(master_data), offset)
+                master['length'] += len(master_data)
+                master['end'] = master_data[-1] + offset
+                for channel in channel_names:
+                    if not channel.startswith('invalid_bytes'):
+                        master['channels'].setdefault(channel, set()).add(index)
+        # second pass, filling channels
+        concatenated = cls()
+        writer = None
+        declared = dict()  # channels of groups declared in writer
+        if output_file_name is not None:
+            writer = Mdf4Writer(output_file_name, compression=compression)
+        for index, item in enumerate(mdf_list):
+            if isinstance(item, str):
+                mdf = cls(item)
+            else:
+                mdf = item
+            if index == 0:
+                concatenated.MDFVersionNumber = mdf.MDFVersionNumber
+                concatenated.fileMetadata = mdf.fileMetadata
+            if mdf.MDFVersionNumber >= 400 and any(channel.startswith('invalid_bytes') for channel in mdf):
+                mdf.apply_all_invalid_bit()
+            for master_name, master in masters.items():
+                if index not in master['sections']:
+                    continue
+                start, length, offset = master['sections'][index]
+                chunk = OrderedDict()
+                for channel, inputs in master['channels'].items():
+                    if index not in inputs or channel not in mdf:
+                        continue
+                    data = mdf.get_channel_data(channel)
+                    if channel == master_name and offset:
+                        data = data + offset
+                    if writer is not None:
+                        chunk[channel] = data
+                    elif channel not in concatenated:
+                        shape = (master['length'],) + data.shape[1:]
+                        if isinstance(data, MaskedArray) or len(inputs) < len(master['sections']):
+                            temp = ma_empty(shape, dtype=data.dtype)
+                            temp[:] = masked  # unmasked when filled
+                        else:
+                            temp = empty(shape, dtype=data.dtype)
+                        temp[start:start + length] = data
+                        concatenated.add_channel(channel, temp, master_name, master_type=master['type'],
+                                                 unit=mdf.get_channel_unit(channel),
+                                                 description=mdf.get_channel_desc(channel))
+                    else:
+                        concatenated.get_channel_data(channel)[start:start + length] = data
+                if writer is not None and master_name in chunk:
+                    if master_name not in declared:
+                        declared[master_name] = OrderedDict(
+                            (channel, {'dtype': data.dtype, 'shape': data.shape[1:],
+                                       'unit': mdf.get_channel_unit(channel),
+                                       'description': mdf.get_channel_desc(channel)})
+                            for channel, data in chunk.items())
+                        writer.add_group(declared[master_name], master_channel=master_name,
+                                         master_type=master['type'])
+                        missing = set(master['channels']) - set(chunk)
+                        if missing:
+                            warn('channels {} not in first file with master {}, not written'.format(
+                                missing, master_name))
+                    for channel, description in declared[master_name].items():
+                        if channel not in chunk:  # missing channel
+                            fill = nan if description['dtype'].kind in ('f', 'c') else 0
+                            chunk[channel] = full((length,) + description['shape'], fill,
+                                                  dtype=description['dtype'])
+                        elif isinstance(chunk[channel], MaskedArray):
+                            chunk[channel] = chunk[channel].data
+                    writer.append(OrderedDict((channel, chunk[channel]) for channel in declared[master_name]))
+        if writer is not None:
+            writer.close()
+            return output_file_name
+        return concatenated
+
     def merge_mdf(self, mdf_class):
         """merge data of input mdf class with the current one.
 
@@ -1445,7 +1790,9 @@ class Mdf(Mdf4, Mdf3):
 
         Notes
         --------
-        If there are common channel names between the 2 mdf, channels are renamed to make them unique
+        If there are common channel names between the 2 mdf, channels are renamed to make them unique.
+        If self was created with deduplicate flag, merged channels having same data as a channel of self
+        share its buffer
         """
         # apply eventual invalid bytes, most probably
         if self.MDFVersionNumber >= 400:
@@ -1463,6 +1810,8 @@ class Mdf(Mdf4, Mdf3):
         # copy the data
         for channel in mdf_class:
             self[channel] = mdf_class[channel]
+            if self._sharedData is not None:  # data identical to existing channel is shared
+                self[channel][dataField] = self._deduplicate(self[channel][dataField])
         # merge the 2 masterChannelList
         masterChannelList = {**self.masterChannelList, **mdf_class.masterChannelList}
         self.masterChannelList = masterChannelList
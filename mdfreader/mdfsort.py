@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+""" Measured Data Format offline sorting of unsorted files, versions 3.x and 4.x
+
+:Author: `Aymeric Rateau <https://github.com/ratal/mdfreader>`__
+
+Unsorted data groups contain records of several channel groups identified by a record ID,
+reading them requires to parse records one by one. sort_mdf reads once unsorted data blocks
+with bounded memory and writes a file with one data group per channel group so that next
+readings use the fast sorted reading.
+
+Dependencies
+-------------------
+- Python >3.4 <http://www.python.org>
+- Numpy >1.14 <http://numpy.scipy.org>
+
+mdfsort
+--------------------------
+"""
+from io import open
+from os.path import splitext
+from shutil import copyfileobj
+from struct import Struct, unpack
+from tempfile import TemporaryFile
+from warnings import warn
+from numpy import frombuffer, unique
+from .mdf import _record_chunks
+from .mdfinfo4 import _HeaderStruct, _DGStruct, _calculate_block_start, chunk_size_writing
+from .mdf4tools import _data_groups4, _data_blocks4, _copy_blocks4, _write_data_blocks4
+
+sort_buffer_size = 67108864  # bytes of records kept in memory before spilling partitions to temporary files
+_VLSDLength = Struct('<I')
+_LinkStruct = Struct('<Q')
+
+
+class _RecordPartitions(dict):
+    __slots__ = ['spills', 'sizes', 'buffered']
+    """ records of unsorted data split by record ID
+
+    Records are accumulated in memory and spilled to one temporary file per record ID
+    when more than sort_buffer_size bytes are kept in memory.
+
+    Attributes
+    --------------
+    spills : dict
+        temporary files by record ID
+    sizes : dict
+        total size in bytes of records by record ID
+    buffered : int
+        size in bytes of records kept in memory
+    """
+
+    def __init__(self, record_ids):
+        for record_id in record_ids:
+            self[record_id] = bytearray()
+        self.spills = dict()
+        self.sizes = dict.fromkeys(record_ids, 0)
+        self.buffered = 0
+
+    def add(self, record_id, data):
+        """ appends records to record ID partition
+
+        Parameters
+        ----------------
+        record_id : int
+            record ID
+        data : bytes or memoryview
+            records without record ID
+        """
+        self[record_id] += data
+        self.sizes[record_id] += len(data)
+        self.buffered += len(data)
+        if self.buffered > sort_buffer_size:
+            self.spill()
+
+    def spill(self):
+        """ writes records kept in memory into temporary files """
+        for record_id, buffer in self.items():
+            if buffer:
+                if record_id not in self.spills:
+                    self.spills[record_id] = TemporaryFile()
+                self.spills[record_id].write(buffer)
+                del buffer[:]
+        self.buffered = 0
+
+    def read(self, record_id, chunk_sizes):
+        """ reads back records of a record ID partition
+
+        Parameters
+        ----------------
+        record_id : int
+            record ID
+        chunk_sizes : list of int
+            size in bytes of each chunk to be returned
+
+        Returns
+        -----------
+        generator of bytes chunks
+        """
+        spill = self.spills.get(record_id)
+        if spill is not None:
+            spill.seek(0)
+        buffer = self[record_id]
+        buffer_pointer = 0
+        for chunk_size in chunk_sizes:
+            chunk = b''
+            if spill is not None:
+                chunk = spill.read(chunk_size)
+            if len(chunk) < chunk_size:
+                missing = chunk_size - len(chunk)
+                chunk = b''.join([chunk, buffer[buffer_pointer:buffer_pointer + missing]])
+                buffer_pointer += missing
+            yield chunk
+
+    def close(self):
+        """ removes temporary files """
+        for spill in self.spills.values():
+            spill.close()
+        self.spills = dict()
+
+
+def _split_records(data, partitions, record_lengths, id_size, id_struct, trailing_id=0):
+    """ splits unsorted records into partitions by record ID
+
+    Parameters
+    ----------------
+    data : bytes
+        unsorted records, last one possibly incomplete
+    partitions : _RecordPartitions
+        records partitions
+    record_lengths : dict
+        record length including record IDs by record ID, None for variable length (VLSD) records
+    id_size : int
+        size in bytes of record ID
+    id_struct : Struct
+        record ID unpacking structure
+    trailing_id : int, optional
+        size in bytes of record ID repeated after record (mdf 3.x)
+
+    Returns
+    -----------
+    bytes of incomplete last record
+    """
+    data = memoryview(data)
+    length = len(data)
+    position = 0
+    lengths = set(record_lengths.values())
+    if None not in lengths and len(lengths) == 1:  # records of equal length, vectorised split
+        record_length = lengths.pop()
+        n_records = length // record_length
+        records = frombuffer(data, dtype='u1', count=n_records * record_length).reshape(n_records, record_length)
+        ids = records[:, :id_size].copy().view('{}u{}'.format(id_struct.format[0], id_size)).ravel()
+        for record_id in unique(ids):
+            if record_id not in record_lengths:
+                raise Exception('Unknown record ID {}'.format(record_id))
+            partitions.add(int(record_id), records[ids == record_id, id_size:record_length - trailing_id].tobytes())
+        position = n_records * record_length
+    else:
+        while position + id_size <= length:
+            (record_id,) = id_struct.unpack_from(data, position)
+            try:
+                record_length = record_lengths[record_id]
+            except KeyError:
+                raise Exception('Unknown record ID {} at position {}'.format(record_id, position))
+            if record_length is None:  # VLSD record, length followed by data
+                if position + id_size + 4 > length:
+                    break
+                (vlsd_length,) = _VLSDLength.unpack_from(data, position + id_size)
+                record_length = id_size + 4 + vlsd_length
+            if position + record_length > length:
+                break
+            partitions.add(record_id, data[position + id_size:position + record_length - trailing_id])
+            position += record_length
+    return data[position:].tobytes()
+
+
+def sort_mdf(file_name, output_file_name=None, compression=True):
+    """ writes sorted copy of mdf file, one data group per channel group
+
+    Parameters
+    ----------------
+    file_name : str
+        name of mdf file to be sorted
+    output_file_name : str, optional
+        name of sorted file, by default file name with appended '_Sorted' string before extension
+    compression : bool, optional
+        flag to write sorted data in DZ blocks (mdf 4.1 and higher only)
+
+    Returns
+    -----------
+    output file name
+
+    Notes
+    --------
+    Unsorted data is read once, records are split by record ID into partitions kept in memory
+    up to sort_buffer_size bytes and then spilled into temporary files.
+    Sorted data groups and all other blocks are copied unchanged.
+
+    Examples
+    --------------
+    >>> from mdfreader import Mdf, sort_mdf
+    >>> yop = Mdf(sort_mdf('unsorted_logger_file.mf4'))
+    """
+    if output_file_name is None:
+        split_name = splitext(file_name)
+        output_file_name = ''.join([split_name[-2], '_Sorted', split_name[-1]])
+    with open(file_name, 'rb') as fid:
+        header = fid.read(64)
+        if header[:3] != b'MDF':
+            raise Exception('{} is not a mdf file'.format(file_name))
+        if b'UnFin' in header[:8]:
+            raise Exception('{} is not finalised, can not be sorted'.format(file_name))
+        (version,) = unpack('<H', header[28:30])
+        if version < 400:
+            _sort3(fid, output_file_name)
+        else:
+            if compression and version < 410:
+                warn('DZ blocks not allowed in mdf version {}, data not compressed'.format(version))
+                compression = False
+            _sort4(fid, output_file_name, compression)
+    return output_file_name
+
+
+def _sort3(fid, output_file_name):
+    """ sorts mdf 3.x file
+
+    File is copied, sorted records are written in place of unsorted records.
+    First channel group keeps its data group block, other ones get new data group blocks
+    at end of file, linked after it.
+
+    Parameters
+    ----------------
+    fid
+        input file identifier
+    output_file_name : str
+        name of sorted file
+    """
+    fid.seek(24)
+    (byte_order,) = unpack('<H', fid.read(2))
+    endian = '>' if byte_order else '<'
+    link = Struct(endian + 'I')
+    with open(output_file_name, 'wb') as out:
+        fid.seek(0)
+        copyfileobj(fid, out, chunk_size_writing)
+    with open(output_file_name, 'r+b') as out:
+        fid.seek(68)  # first data group link in header
+        (dg_pointer,) = link.unpack(fid.read(4))
+        n_new_data_group = 0
+        while dg_pointer:
+            fid.seek(dg_pointer + 4)
+            (dg_next, cg_pointer, trigger, data_pointer, n_cg, n_record_ids) = \
+                unpack(endian + '4I2H', fid.read(20))
+            if n_record_ids:  # unsorted
+                channel_groups = []
+                while cg_pointer:
+                    fid.seek(cg_pointer + 4)
+                    (cg_next, cn_pointer, tx_pointer, record_id, n_channels, record_size, n_records) = \
+                        unpack(endian + '3I3HI', fid.read(22))
+                    channel_groups.append((cg_pointer, record_id, record_size, n_records))
+                    cg_pointer = cg_next
+                record_lengths = dict((record_id, record_size + n_record_ids)
+                                      for (cg_pointer, record_id, record_size, n_records) in channel_groups)
+                data_length = sum(n_records * (record_size + n_record_ids)
+                                  for (cg_pointer, record_id, record_size, n_records) in channel_groups)
+                partitions = _RecordPartitions(record_lengths)
+                try:
+                    # reads unsorted data
+                    fid.seek(data_pointer)
+                    tail = b''
+                    position = 0
+                    while position < data_length:
+                        chunk = fid.read(min(chunk_size_writing, data_length - position))
+                        if not chunk:
+                            break
+                        position += len(chunk)
+                        tail = _split_records(b''.join([tail, chunk]), partitions, record_lengths,
+                                              1, Struct('<B'), n_record_ids - 1)
+                    # writes sorted data in place of unsorted data, data groups linked one after the other
+                    sorted_pointer = data_pointer
+                    out.seek(0, 2)
+                    new_dg_pointer = out.tell()
+                    for index, (cg_pointer, record_id, record_size, n_records) in enumerate(channel_groups):
+                        out.seek(sorted_pointer)
+                        for chunk in partitions.read(record_id, _record_chunks(partitions.sizes[record_id],
+                                                                               1, chunk_size_writing)):
+                            out.write(chunk)
+                        out.seek(cg_pointer + 4)
+                        out.write(link.pack(0))  # only one channel group in data group
+                        if index < len(channel_groups) - 1:
+                            next_pointer = new_dg_pointer + 28 * index
+                        else:
+                            next_pointer = dg_next
+                        if index == 0:  # keeps data group block
+                            out.seek(dg_pointer)
+                        else:
+                            out.seek(new_dg_pointer + 28 * (index - 1))
+                            trigger = 0
+                        out.write(Struct(endian + '2sH4I2H4s').pack(b'DG', 28, next_pointer, cg_pointer, trigger,
+                                                                      sorted_pointer, 1, 0, b'\x00' * 4))
+                        sorted_pointer += partitions.sizes[record_id]
+                    n_new_data_group += len(channel_groups) - 1
+                finally:
+                    partitions.close()
+            dg_pointer = dg_next
+        # updates number of data groups in header
+        fid.seek(64 + 16)
+        (n_data_group,) = unpack(endian + 'H', fid.read(2))
+        out.seek(64 + 16)
+        out.write(Struct(endian + 'H').pack(n_data_group + n_new_data_group))
+
+
+def _sort4(fid, output_file_name, compression=True):
+    """ sorts mdf 4.x file
+
+    All blocks reachable from header are copied with relocated links except unsorted data groups,
+    replaced by one data group per channel group. VLSD channel groups are replaced by SD blocks.
+
+    Parameters
+    ----------------
+    fid
+        input file identifier
+    output_file_name : str
+        name of sorted file
+    compression : bool, optional
+        flag to write sorted data in DZ blocks
+    """
+    data_groups = _data_groups4(fid)
+
+    # blocks to copy, links not followed (patched later) and blocks replaced
+    skipped_links = {64: {0}}  # header first data group link
+    replaced = dict()  # position of blocks not copied and their replacing block, known after data writing
+    roots = [64]
+    for data_group in data_groups:
+        if data_group['rec_id_size']:  # unsorted
+            replaced[data_group['pointer']] = None
+            for channel_group in data_group['channel_groups']:
+                if channel_group['vlsd']:
+                    replaced[channel_group['pointer']] = None
+                else:
+                    skipped_links[channel_group['pointer']] = {0}  # next channel group link
+                    roots.append(channel_group['pointer'])
+            if data_group['md_comment']:
+                roots.append(data_group['md_comment'])
+        else:
+            skipped_links[data_group['pointer']] = {0}  # next data group link
+            roots.append(data_group['pointer'])
+
+    with open(output_file_name, 'wb') as out:
+        fid.seek(0)
+        out.write(fid.read(64))  # ID block
+        relocation, patches, pointer = _copy_blocks4(fid, out, roots, skipped_links, set(replaced))
+
+        # writes sorted data groups
+        dg_chain = []
+        for data_group in data_groups:
+            if not data_group['rec_id_size']:
+                dg_chain.append(relocation[data_group['pointer']])
+                continue
+            record_lengths = dict((channel_group['record_id'],
+                                   None if channel_group['vlsd'] else
+                                   data_group['rec_id_size'] + channel_group['record_length'])
+                                  for channel_group in data_group['channel_groups'])
+            partitions = _RecordPartitions(record_lengths)
+            try:
+                tail = b''
+                id_struct = Struct('<{}'.format({1: 'B', 2: 'H', 4: 'I', 8: 'Q'}[data_group['rec_id_size']]))
+                for chunk in _data_blocks4(fid, data_group['data']):
+                    tail = _split_records(b''.join([tail, chunk]), partitions, record_lengths,
+                                          data_group['rec_id_size'], id_struct)
+                if tail:
+                    warn('incomplete record at end of data group {}'.format(data_group['pointer']))
+                first_dg_pointer = None
+                for channel_group in data_group['channel_groups']:
+                    record_id = channel_group['record_id']
+                    size = partitions.sizes[record_id]
+                    out.seek(pointer)
+                    if channel_group['vlsd']:  # signal data block
+                        out.write(_HeaderStruct.pack(b'##SD', 0, 24 + size, 0))
+                        for chunk in partitions.read(record_id, _record_chunks(size, 1, chunk_size_writing)):
+                            out.write(chunk)
+                        replaced[channel_group['pointer']] = pointer
+                        pointer = _calculate_block_start(pointer + 24 + size)
+                        continue
+                    record_length = channel_group['record_length']
+                    n_records = size // record_length if record_length else 0
+                    chunk_sizes = [n_record_chunk * record_length for n_record_chunk in
+                                   _record_chunks(n_records, record_length, chunk_size_writing)]
+                    data_pointer, pointer = _write_data_blocks4(out, pointer, partitions.read(record_id, chunk_sizes),
+                                                                record_length, compression)
+                    out.seek(pointer)
+                    out.write(_DGStruct.pack(b'##DG', 0, 64, 4, 0, relocation[channel_group['pointer']],
+                                             data_pointer, relocation.get(data_group['md_comment'], 0),
+                                             0, b'\x00' * 7))
+                    if first_dg_pointer is None:
+                        first_dg_pointer = pointer
+                    dg_chain.append(pointer)
+                    pointer += 64
+                replaced[data_group['pointer']] = first_dg_pointer
+            finally:
+                partitions.close()
+
+        # data groups chain and links to replaced blocks
+        for link_position, link in patches:
+            if replaced.get(link) is not None:
+                out.seek(link_position)
+                out.write(_LinkStruct.pack(replaced[link]))
+        out.seek(64 + 24)
+        out.write(_LinkStruct.pack(dg_chain[0] if dg_chain else 0))
+        for dg_pointer, next_dg_pointer in zip(dg_chain, dg_chain[1:]):
+            out.seek(dg_pointer + 24)
+            out.write(_LinkStruct.pack(next_dg_pointer))
@@ -83,6 +83,7 @@ extras_require = {
     'converter': ['PyQt5'],
     'experimental': ['bitarray'],
     'compression': ['blosc'],
+    'deduplication': ['xxhash'],
 }
 
 # If there are data files included in your packages that need to be